@@ -40,6 +40,8 @@ from picframe_blackout import PFBlackout
 from picframe_message import PFMessage
 from picframe_canvas_message import PFCanvasMessage
 from picframe_image import PFImage
+from picframe_decoder import PFDecoder
+from picframe_resample import PFResample
 from picframe_canvas import PFCanvas
 from picframe_video import PFVideo
 
@@ -59,6 +61,7 @@ def print_help(rval=0):
     print("    <-l|--logfile=<path to log file>")
     print("    <-f|--fullscreen")
     print("    <-g|--geom=<a geometry in the form 1920x1080)>")
+    print("    <-r|--resample=<resampling profile (fast, balanced, best, auto)>")
     sys.exit(rval)
 
 ############################################################
@@ -75,9 +78,9 @@ def get_args(argv):
     """
 
     try:
-        opts, inargs = getopt.getopt(argv, "hfs:d:g:",
+        opts, inargs = getopt.getopt(argv, "hfs:d:g:r:",
                 ["help", "fullscreen", "logfile=", "debuglevel=",
-                 "path=", "geom="])
+                 "path=", "geom=", "resample="])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
@@ -98,6 +101,11 @@ def get_args(argv):
             PFSettings.image_source = 'Filesystem'
             PFSettings.single_image = False
             PFSettings.image_dir = arg
+        elif opt in ('-r', '--resample'):
+            if arg not in PFResample.PROFILE_NAMES:
+                print(f"Unknown resampling profile '{arg}'")
+                print_help(2)
+            PFSettings.resample_profile = arg
 
 ############################################################
 #
@@ -169,6 +177,7 @@ def main():
         motion_p.terminate()
     timer_p.terminate()
     blackout_p.terminate()
+    PFDecoder.shutdown()
     PFMessage.canvas_mq.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,195 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_admission.py
+
+Decide whether an image can be decoded within the memory budget by
+reading only its header.  What matters is how large the image is once
+decoded, not how large the file is: a small PNG can expand to gigapixels
+while a large JPEG can be decoded at a reduced scale.
+"""
+
+import sys
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+
+if sys.platform in ("linux", "linux2"):
+    import pyheif
+
+
+class PFAdmission:
+    """
+    Read image headers and decide how (or whether) to decode the image.
+    """
+    headers = OrderedDict()
+    rejected = 0
+    reduced = 0
+    lock = threading.Lock()
+
+    # How many file headers to remember.
+    MAX_HEADERS = 10000
+
+    # Bytes of memory per pixel PIL uses for each mode.  Three and four
+    # band modes are stored four bytes per pixel.
+    MODE_BYTES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16B': 2}
+
+    # JPEG can be decoded at 1/2, 1/4 or 1/8 scale.
+    JPEG_SCALES = (1, 2, 4, 8)
+
+    ############################################################
+    #
+    # read_header
+    #
+    @staticmethod
+    def read_header(image_file, file_extension):
+        """
+        Read the image dimensions, mode and format without decoding the
+        pixels.
+
+        Returns:
+            (width, height, mode, format, animated), or None if the header
+            says the image is too large to even open.
+        """
+        if file_extension.lower() in ('.heic', '.avif'):
+            heif_file = pyheif.open(image_file)
+            return (heif_file.size[0], heif_file.size[1], heif_file.mode, 'HEIF', False)
+
+        try:
+            with Image.open(image_file) as pil_img:
+                return (pil_img.width, pil_img.height, pil_img.mode, pil_img.format,
+                        getattr(pil_img, 'is_animated', False))
+        except Image.DecompressionBombError as exc:
+            PFEnv.logger.warning("'%s' %s" % (image_file, str(exc)))
+            return None
+
+    ############################################################
+    #
+    # get_header
+    #
+    @staticmethod
+    def get_header(image_file, stat, file_extension):
+        """
+        Get the header for a file, from the cache if this version of the
+        file has been seen before.  Called from the prefetch thread as
+        well as the main thread.
+        """
+        key = (image_file, stat.st_size, stat.st_mtime_ns)
+        with PFAdmission.lock:
+            if key in PFAdmission.headers:
+                PFAdmission.headers.move_to_end(key)
+                return PFAdmission.headers[key]
+
+        header = PFAdmission.read_header(image_file, file_extension)
+        with PFAdmission.lock:
+            PFAdmission.headers[key] = header
+            PFAdmission.headers.move_to_end(key)
+            while len(PFAdmission.headers) > PFAdmission.MAX_HEADERS:
+                PFAdmission.headers.popitem(last=False)
+        return header
+
+    ############################################################
+    #
+    # decoded_bytes
+    #
+    @staticmethod
+    def decoded_bytes(width, height, mode):
+        """
+        Estimate the memory needed to hold one decoded frame.
+        """
+        return width * height * PFAdmission.MODE_BYTES.get(mode, 4)
+
+    ############################################################
+    #
+    # get_decode_scale
+    #
+    @staticmethod
+    def get_decode_scale(image_file, stat, file_extension):
+        """
+        Decide how to decode an image so it fits in
+        PFSettings.max_decoded_image_bytes.
+
+        Returns:
+            The factor (1, 2, 4 or 8) the image has to be reduced by while
+            decoding, or None if it can't be decoded within the budget.
+        """
+        header = PFAdmission.get_header(image_file, stat, file_extension)
+        if header is None:
+            with PFAdmission.lock:
+                PFAdmission.rejected = PFAdmission.rejected + 1
+            return None
+
+        width, height, mode, img_format, animated = header
+        nbytes = PFAdmission.decoded_bytes(width, height, mode)
+        if nbytes <= PFSettings.max_decoded_image_bytes:
+            return 1
+
+        if img_format == 'JPEG':
+            for scale in PFAdmission.JPEG_SCALES[1:]:
+                if nbytes // (scale * scale) <= PFSettings.max_decoded_image_bytes:
+                    with PFAdmission.lock:
+                        PFAdmission.reduced = PFAdmission.reduced + 1
+                    return scale
+
+        with PFAdmission.lock:
+            PFAdmission.rejected = PFAdmission.rejected + 1
+        PFEnv.logger.warning("'%s' is %dx%d %s, too large to decode." %
+                (image_file, width, height, mode))
+        return None
+
+    ############################################################
+    #
+    # take_counters
+    #
+    @staticmethod
+    def take_counters():
+        """
+        Get the counts since the last call, and start again from zero.
+        Used to pass a decoder process's counts back.
+        """
+        with PFAdmission.lock:
+            counters = (PFAdmission.rejected, PFAdmission.reduced)
+            PFAdmission.rejected = 0
+            PFAdmission.reduced = 0
+        return counters
+
+    ############################################################
+    #
+    # add_counters
+    #
+    @staticmethod
+    def add_counters(counters):
+        """
+        Add counts returned by take_counters() in another process.
+        """
+        rejected, reduced = counters
+        with PFAdmission.lock:
+            PFAdmission.rejected = PFAdmission.rejected + rejected
+            PFAdmission.reduced = PFAdmission.reduced + reduced
+
+    ############################################################
+    #
+    # get_stats_str
+    #
+    @staticmethod
+    def get_stats_str():
+        """
+        Get a string of the admission statistics.
+        """
+        outstr = \
+        ("%-20s: %s" % ("images_rejected", str(PFAdmission.rejected))) + os.linesep + \
+        ("%-20s: %s" % ("images_reduced", str(PFAdmission.reduced))) + os.linesep
+        return outstr
@@ -0,0 +1,401 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_benchmark.py is a standalone program that times the image
+pipeline used by PFImage.get_image(), one stage at a time, without
+needing the frame to be running.
+
+It generates a corpus of synthetic images (JPEG, PNG, TIFF, GIF and, if
+pillow_heif is installed to write them, HEIC) of various sizes and EXIF
+orientations.  Each is then decoded by PFImage.decode_image_local(), as
+the frame does, at several screen sizes and with each resampling
+profile, and the stages it records in PFStats (header, open, decode,
+transpose, resize) are reported along with enhance and PhotoImage
+conversion.  The PhotoImage stage is skipped if there is no display.
+Results are written as JSON so runs from before and after a change can
+be compared.
+
+    cd picframe/src
+    python3 picframe_benchmark.py -o before.json
+
+With -w it instead times walking a directory tree for image files, with
+os.walk and PFEnv.is_format_supported() and with PFWalker:
+
+    python3 picframe_benchmark.py -w /mnt/photos -o walk.json
+"""
+
+import getopt
+import sys
+import os
+import json
+import time
+import platform
+import statistics
+from datetime import datetime
+import PIL
+from PIL import Image
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_enhance import PFEnhance
+from picframe_image import PFImage
+from picframe_resample import PFResample
+from picframe_stats import PFStats
+from picframe_walker import PFWalker
+
+# Megapixel sizes of the generated images, all with a 3:2 aspect ratio.
+DEFAULT_MEGAPIXELS = (1, 4, 12, 24, 50)
+
+# Screen sizes to fit the images to.
+DEFAULT_GEOMETRIES = ("800x480", "1280x800", "1920x1080", "3840x2160")
+
+# EXIF orientations to generate for the JPEG images.
+JPEG_ORIENTATIONS = (1, 3, 6, 8)
+
+STAGES = ('header', 'open', 'decode', 'transpose', 'resize', 'enhance', 'photoimage', 'total')
+
+
+############################################################
+# print_help
+#
+def print_help(rval=0):
+    """
+    Print out the command-line help.
+    """
+
+    print("picframe_benchmark.py ")
+    print("    <-h|--help>")
+    print("    <-c|--corpus=<directory for the generated images (default /tmp/picframe_bench_corpus)>")
+    print("    <-o|--output=<JSON results file (default picframe_bench.json)>")
+    print("    <-m|--megapixels=<comma separated image sizes, e.g. 1,12,50>")
+    print("    <-g|--geoms=<comma separated screen sizes, e.g. 800x480,1920x1080>")
+    print("    <-r|--repeat=<times to run each measurement (default 3)>")
+    print("    <-p|--profiles=<comma separated resampling profiles (default all)>")
+    print("    <-w|--walk=<directory tree to time walking instead of the image pipeline>")
+    sys.exit(rval)
+
+
+############################################################
+# have_heif_writer
+#
+def have_heif_writer():
+    """
+    Returns whether HEIC files can be written, which requires pillow_heif.
+    """
+    try:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+        return True
+    except ImportError:
+        return False
+
+
+############################################################
+# make_source_image
+#
+def make_source_image(width, height):
+    """
+    Make an image with smooth gradients and some noise so that it
+    compresses roughly like a photograph.
+    """
+    red = Image.linear_gradient('L').resize((width, height))
+    green = Image.radial_gradient('L').resize((width, height))
+    blue = Image.effect_noise((width, height), 40)
+    return Image.merge('RGB', (red, green, blue))
+
+
+############################################################
+# generate_corpus
+#
+def generate_corpus(corpus_dir, megapixels_list):
+    """
+    Generate the synthetic images if they aren't already there.
+
+    Returns:
+        List of (path, format, megapixels, orientation)
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    heif = have_heif_writer()
+    corpus = []
+
+    for megapixels in megapixels_list:
+        height = int((megapixels * 1000000 / 1.5) ** 0.5)
+        width = int(height * 1.5)
+        source = None
+
+        wanted = [('JPEG', '.jpg', orientation) for orientation in JPEG_ORIENTATIONS]
+        wanted = wanted + [('PNG', '.png', 1), ('TIFF', '.tif', 1), ('GIF', '.gif', 1)]
+        if heif and sys.platform in ("linux", "linux2"):
+            # The frame decodes them with pyheif, which is Linux only.
+            wanted.append(('HEIF', '.heic', 1))
+
+        for img_format, extension, orientation in wanted:
+            name = "bench_%dmp_o%d%s" % (megapixels, orientation, extension)
+            path = os.path.join(corpus_dir, name)
+            corpus.append((path, img_format, megapixels, orientation))
+            if os.path.exists(path):
+                continue
+
+            if source is None:
+                source = make_source_image(width, height)
+            print("Generating %s" % (path,))
+
+            img = source
+            if orientation in (5, 6, 7, 8):
+                # Store it rotated so that the EXIF orientation puts it
+                # back to the landscape original.
+                img = source.transpose(Image.ROTATE_90)
+            if img_format == 'JPEG':
+                exif = Image.Exif()
+                exif[0x0112] = orientation
+                img.save(path, img_format, quality=90, exif=exif)
+            elif img_format == 'GIF':
+                img.convert('P', palette=Image.ADAPTIVE).save(path, img_format)
+            elif img_format == 'TIFF':
+                img.save(path, img_format, compression='tiff_lzw')
+            else:
+                img.save(path, img_format)
+
+    return corpus
+
+
+############################################################
+# get_tk_root
+#
+def get_tk_root():
+    """
+    Get a hidden tkinter root window so PhotoImage conversion can be
+    timed, or None if there is no display.
+    """
+    try:
+        from tkinter import Tk
+        root = Tk()
+        root.withdraw()
+        return root
+    except Exception:
+        return None
+
+
+############################################################
+# time_pipeline
+#
+def time_pipeline(path, width, height, profile, tk_root):
+    """
+    Run the image through the pipeline once, timing each stage.
+
+    Returns:
+        Dictionary of stage name to milliseconds.
+    """
+    saved_profile = PFSettings.resample_profile
+    PFSettings.resample_profile = profile
+    PFStats.begin(path)
+    try:
+        pil_img = PFImage.decode_image_local(path, width, height, os.stat(path))
+        with PFStats.stage('enhance'):
+            pil_img = PFEnhance.apply(pil_img, 0.8)
+        if tk_root is not None:
+            from PIL import ImageTk
+            with PFStats.stage('photoimage'):
+                ImageTk.PhotoImage(pil_img)
+    finally:
+        record = PFStats.detach()
+        PFSettings.resample_profile = saved_profile
+
+    timings = dict(record['stages'])
+    timings['total'] = sum(timings.values())
+    return timings
+
+
+############################################################
+# run_benchmark
+#
+def run_benchmark(corpus, geometries, profiles, repeat):
+    """
+    Time every image in the corpus at every geometry with every
+    resampling profile.
+
+    Returns:
+        List of result dictionaries, one per image, geometry and profile,
+        with the median of each stage over the repeats.
+    """
+    tk_root = get_tk_root()
+    if tk_root is None:
+        print("No display; the photoimage stage will not be timed.")
+
+    results = []
+    for path, img_format, megapixels, orientation in corpus:
+        with Image.open(path) as pil_img:
+            source_size = pil_img.size
+
+        for geom in geometries:
+            wstr, hstr = geom.split('x')
+            width, height = int(wstr), int(hstr)
+
+            for profile in profiles:
+                runs = []
+                for i in range(repeat):
+                    runs.append(time_pipeline(path, width, height, profile, tk_root))
+
+                stages = {}
+                for stage in STAGES:
+                    values = [run[stage] for run in runs if stage in run]
+                    stages[stage + '_ms'] = round(statistics.median(values), 3) if values else None
+
+                result = {
+                    'file': os.path.basename(path),
+                    'format': img_format,
+                    'bytes': os.path.getsize(path),
+                    'megapixels': megapixels,
+                    'orientation': orientation,
+                    'source_size': list(source_size),
+                    'geometry': geom,
+                    'profile': profile,
+                    'stages': stages,
+                }
+                results.append(result)
+                print("%-28s %-10s %-9s resize %8.1f ms, total %8.1f ms" %
+                        (result['file'], geom, profile, stages['resize_ms'], stages['total_ms']))
+
+    if tk_root is not None:
+        tk_root.destroy()
+
+    return results
+
+
+############################################################
+# walk_os
+#
+def walk_os(walk_dir):
+    """
+    Find the image files the way the filesystem source used to.
+    """
+    count = 0
+    for root, dirs, files in os.walk(walk_dir):
+        for file in files:
+            if PFEnv.is_format_supported(os.path.join(root, file)):
+                count = count + 1
+    return count
+
+
+############################################################
+# walk_pfwalker
+#
+def walk_pfwalker(walk_dir):
+    """
+    Find the image files with PFWalker.
+    """
+    count = 0
+    for entry in PFWalker.walk(walk_dir):
+        count = count + 1
+    return count
+
+
+############################################################
+# run_walk_benchmark
+#
+def run_walk_benchmark(walk_dir, repeat):
+    """
+    Time each way of walking the tree.  The first run of each warms the
+    OS directory cache, so the median is of the runs after it.
+
+    Returns:
+        List of result dictionaries, one per walker.
+    """
+    results = []
+    for name, walker in (('os_walk', walk_os), ('pfwalker', walk_pfwalker)):
+        walker(walk_dir)
+        runs = []
+        for i in range(repeat):
+            start = time.monotonic()
+            count = walker(walk_dir)
+            runs.append((time.monotonic() - start) * 1000)
+
+        result = {
+            'walker': name,
+            'directory': walk_dir,
+            'files': count,
+            'walk_ms': round(statistics.median(runs), 3),
+        }
+        results.append(result)
+        print("%-10s %8d files %10.1f ms" % (name, count, result['walk_ms']))
+
+    return results
+
+
+############################################################
+# main
+#
+def main(argv):
+    """
+    Parse the arguments, generate the corpus, run and save the benchmark.
+    """
+    corpus_dir = os.path.join('/tmp', 'picframe_bench_corpus')
+    output = 'picframe_bench.json'
+    megapixels_list = DEFAULT_MEGAPIXELS
+    geometries = DEFAULT_GEOMETRIES
+    repeat = 3
+    profiles = PFResample.PROFILE_NAMES
+    walk_dir = None
+
+    try:
+        opts, inargs = getopt.getopt(argv, "hc:o:m:g:r:p:w:",
+                ["help", "corpus=", "output=", "megapixels=", "geoms=", "repeat=",
+                 "profiles=", "walk="])
+    except getopt.GetoptError:
+        print_help(2)
+
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            print_help()
+        elif opt in ('-c', '--corpus'):
+            corpus_dir = arg
+        elif opt in ('-o', '--output'):
+            output = arg
+        elif opt in ('-m', '--megapixels'):
+            megapixels_list = [int(mp) for mp in arg.split(',')]
+        elif opt in ('-g', '--geoms'):
+            geometries = arg.split(',')
+        elif opt in ('-r', '--repeat'):
+            repeat = int(arg)
+        elif opt in ('-p', '--profiles'):
+            profiles = arg.split(',')
+        elif opt in ('-w', '--walk'):
+            walk_dir = arg
+
+    PFEnv.setup_logger()
+    if walk_dir is not None:
+        PFEnv.set_supported_types()
+        results = run_walk_benchmark(walk_dir, repeat)
+    else:
+        corpus = generate_corpus(corpus_dir, megapixels_list)
+        results = run_benchmark(corpus, geometries, profiles, repeat)
+
+    report = {
+        'time': datetime.now().strftime(PFEnv.HMS_FMT_STR),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'settings': {
+            'reduced_decode': PFSettings.reduced_decode,
+            'gamma': PFSettings.gamma,
+        },
+        'repeat': repeat,
+        'results': results,
+    }
+    with open(output, 'w') as outfile:
+        json.dump(report, outfile, indent=2)
+    print("Results written to %s" % (output,))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -176,7 +176,7 @@ class PFCanvasMessage:
         elif message.message == PFMessage.KEYBOARD_DECREASE_BRIGHTNESS:
             PFImage.adjust_brightness('down')
         elif message.message == PFMessage.KEYBOARD_USE_DEFAULT_BRIGHTNESS:
-            PFImage.brightness = 1
+            PFImage.adjust_brightness('default')
         elif message.message == PFMessage.BLACKOUT:
             PFCanvasMessage.in_blackout = True
             PFImage.display_black_image()
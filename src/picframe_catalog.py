@@ -0,0 +1,957 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_catalog.py
+
+Keep a persistent SQLite catalog of the supported image files under
+PFSettings.image_paths, with their size, mtime and directory.  On startup
+the slideshow is served from the catalog straight away, while a
+background thread walks the directories again and brings the catalog up
+to date.  Walking a large network mount can take minutes, so this gets
+the first image up immediately instead of after the walk.
+
+The catalog also keeps every directory's mtime so that a single changed
+directory can be brought up to date with sync_dir() (see
+picframe_watcher.py).  Files it finds are shown next, and files it
+finds deleted are skipped even if they were already read from the
+catalog.
+
+With PFSettings.shuffle the files are shown in a random order that
+changes every time through, see get_shuffled_file().
+
+Files can be given content hashes (see picframe_hasher.py).  Of the
+files with the same hash only the first catalogued is shown.
+"""
+
+import os
+import time
+import random
+import sqlite3
+import threading
+from collections import deque
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv, NoImagesFoundException
+from picframe_walker import PFWalker
+from picframe_shuffle import PFShuffle
+from picframe_image_source import PFChangeLog
+
+
+class PFCatalog:
+    """
+    The image file catalog for the filesystem image source.
+    """
+    initialized = False
+    db_path = None
+    local = threading.local()
+    scanner = None
+    scanning = False
+    rescan_event = threading.Event()
+    first_scan_done = threading.Event()
+    current_scan_id = 0
+    file_count = 0
+
+    # Bumped whenever files are added or a scan finishes.  Each thread
+    # that waits for that notes the generation before it looks, so one
+    # thread taking a wakeup can't hide it from the others.
+    scan_changed = threading.Condition()
+    scan_generation = 0
+
+    # Files found by sync_dir() that haven't been shown yet, and files
+    # removed since the reader last read a batch from the catalog.
+    lock = threading.Lock()
+    added = deque()
+    removed = set()
+
+    # The id at every BATCH_SIZE-th position of the catalog order, for
+    # get_file().  Built when first needed after update_count().
+    position_index = None
+
+    # Every file added and removed, for PFFilesystem.get_changes().
+    changes = PFChangeLog()
+
+    # How many rows to read or write at a time.
+    BATCH_SIZE = 500
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS files ("
+        " id INTEGER PRIMARY KEY,"
+        " path TEXT UNIQUE NOT NULL,"
+        " dir TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " mtime INTEGER NOT NULL,"
+        " scan_id INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS files_dir ON files(dir)",
+        "CREATE TABLE IF NOT EXISTS dirs ("
+        " path TEXT PRIMARY KEY,"
+        " parent TEXT NOT NULL,"
+        " mtime INTEGER NOT NULL,"
+        " scan_id INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent)",
+        "CREATE TABLE IF NOT EXISTS state ("
+        " key TEXT PRIMARY KEY,"
+        " value TEXT)",
+    )
+
+    # Columns added to the files table after it was first released.
+    # They are added to existing catalogs at startup.
+    # They describe the file's contents, so they are cleared when its
+    # size or mtime changes.  taken is when the photo was taken, in
+    # seconds since 1970 of local time; width and height are as
+    # displayed, after any EXIF rotation.  meta is set once they have
+    # been read from the file.
+    FILE_COLUMNS = (
+        ("hash", "TEXT"),
+        ("phash", "TEXT"),
+        ("taken", "INTEGER"),
+        ("width", "INTEGER"),
+        ("height", "INTEGER"),
+        ("meta", "INTEGER"),
+    )
+
+    # When the photo was taken, or if that isn't known the file's mtime
+    # converted to the same local time, and the 'MM-DD' of that.
+    TAKEN_EXPR = "COALESCE(taken, CAST(strftime('%s', mtime / 1000000000, " \
+            "'unixepoch', 'localtime') AS INTEGER))"
+    DAY_EXPR = "strftime('%%m-%%d', %s, 'unixepoch')" % (TAKEN_EXPR,)
+
+    # 'localtime' depends on the time zone, so SQLite won't index
+    # TAKEN_EXPR.  The indexes on the old UTC expressions are dropped.
+    INDEXES = (
+        "CREATE INDEX IF NOT EXISTS files_hash ON files(hash)",
+        "CREATE INDEX IF NOT EXISTS files_phash ON files(phash)",
+        "DROP INDEX IF EXISTS files_taken",
+        "DROP INDEX IF EXISTS files_day",
+    )
+
+    ############################################################
+    #
+    # init
+    #
+    @staticmethod
+    def init():
+        """
+        Open (creating if needed) the catalog, drop files that are no
+        longer under image_paths, and start the background rescan.
+        """
+        PFCatalog.db_path = PFEnv.path_to_platform(os.path.expanduser(PFSettings.catalog_path))
+        os.makedirs(os.path.dirname(PFCatalog.db_path), exist_ok=True)
+
+        conn = PFCatalog.get_conn()
+        with conn:
+            for statement in PFCatalog.SCHEMA:
+                conn.execute(statement)
+            PFCatalog.add_columns(conn)
+            for statement in PFCatalog.INDEXES:
+                conn.execute(statement)
+            PFCatalog.remove_other_roots(conn)
+
+        PFCatalog.update_count(conn)
+        PFCatalog.initialized = True
+        PFEnv.logger.info("Catalog %s: %d files" % (PFCatalog.db_path, PFCatalog.get_count()))
+
+        PFCatalog.scanning = True
+        PFCatalog.scanner = threading.Thread(target=PFCatalog.scan_main,
+                name="picframe_catalog", daemon=True)
+        PFCatalog.scanner.start()
+
+    ############################################################
+    #
+    # add_columns
+    #
+    @staticmethod
+    def add_columns(conn):
+        """
+        Add any of FILE_COLUMNS that an older catalog doesn't have.
+        """
+        existing = set(row[1] for row in conn.execute("PRAGMA table_info(files)"))
+        for name, decl in PFCatalog.FILE_COLUMNS:
+            if name not in existing:
+                conn.execute("ALTER TABLE files ADD COLUMN %s %s" % (name, decl))
+
+    ############################################################
+    #
+    # get_conn
+    #
+    @staticmethod
+    def get_conn():
+        """
+        Get this thread's connection to the catalog.  SQLite connections
+        can't be shared between threads.
+        """
+        conn = getattr(PFCatalog.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(PFCatalog.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            PFCatalog.local.conn = conn
+        return conn
+
+    ############################################################
+    #
+    # get_roots
+    #
+    @staticmethod
+    def get_roots():
+        """
+        Get the image paths in the right format for the platform.  They
+        are normalized so that they match the directory names of the
+        files under them.
+        """
+        return [os.path.normpath(PFEnv.path_to_platform(idir)) for idir in PFSettings.image_paths]
+
+    ############################################################
+    #
+    # remove_other_roots
+    #
+    @staticmethod
+    def remove_other_roots(conn):
+        """
+        Remove files that are not under any of the current image paths,
+        e.g. after the settings were changed.
+        """
+        roots = PFCatalog.get_roots()
+        if not roots:
+            conn.execute("DELETE FROM files")
+            conn.execute("DELETE FROM dirs")
+            return
+
+        # A root matches itself and what is under it, not a sibling
+        # that starts with the same name.
+        conditions = " OR ".join(["path = ? OR substr(path, 1, ?) = ?"] * len(roots))
+        params = []
+        for root in roots:
+            prefix = os.path.join(root, '')
+            params.extend([root, len(prefix), prefix])
+        conn.execute("DELETE FROM files WHERE NOT (%s)" % (conditions,), params)
+        conn.execute("DELETE FROM dirs WHERE NOT (%s)" % (conditions,), params)
+
+    ############################################################
+    #
+    # get_state
+    #
+    @staticmethod
+    def get_state(key, default=None):
+        """
+        Get a value saved in the catalog's state table.
+        """
+        row = PFCatalog.get_conn().execute(
+                "SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        return row[0]
+
+    ############################################################
+    #
+    # set_state
+    #
+    @staticmethod
+    def set_state(key, value, conn=None):
+        """
+        Save a value in the catalog's state table.
+        """
+        if conn is None:
+            conn = PFCatalog.get_conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                    (key, str(value)))
+
+    ############################################################
+    #
+    # walk_files
+    #
+    @staticmethod
+    def walk_files(roots, on_dir=None, report=True):
+        """
+        Yield (path, dirname, stat) for every supported file under the
+        roots.  on_dir and report are passed on to PFWalker.walk_roots().
+        """
+        for entry in PFWalker.walk_roots(roots, on_dir, report):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            yield entry.path, os.path.dirname(entry.path), stat
+
+    ############################################################
+    #
+    # scan
+    #
+    @staticmethod
+    def scan():
+        """
+        Walk all of the image paths, adding new files, updating changed
+        ones and finally removing files that weren't found.
+        """
+        conn = PFCatalog.get_conn()
+        scan_id = int(PFCatalog.get_state('scan_id', 0)) + 1
+        PFCatalog.current_scan_id = scan_id
+        start = time.monotonic()
+        count = 0
+        last_id = conn.execute("SELECT MAX(id) FROM files").fetchone()[0] or 0
+
+        batch = []
+        dir_rows = deque()
+        roots = []
+        missing_roots = []
+
+        # Called from the walker threads.
+        def record_dir(dirpath):
+            dir_row = PFCatalog.get_dir_row(dirpath, scan_id)
+            if dir_row is not None:
+                dir_rows.append(dir_row)
+
+        def take_dir_rows():
+            dir_batch = []
+            while dir_rows:
+                dir_batch.append(dir_rows.popleft())
+            return dir_batch
+
+        for root in PFCatalog.get_roots():
+            if os.path.exists(root):
+                roots.append(root)
+            else:
+                missing_roots.append(root)
+
+        for path, dirname, stat in PFCatalog.walk_files(roots, record_dir):
+            batch.append((path, dirname, stat.st_size, stat.st_mtime_ns, scan_id))
+            if len(batch) >= PFCatalog.BATCH_SIZE:
+                PFCatalog.add_files(conn, batch)
+                PFCatalog.add_dirs(conn, take_dir_rows())
+                count = count + len(batch)
+                batch = []
+        PFCatalog.add_files(conn, batch)
+        PFCatalog.add_dirs(conn, take_dir_rows())
+        count = count + len(batch)
+
+        # If a mount is down, keep what is known about it rather than
+        # emptying the catalog.
+        removed = []
+        if missing_roots:
+            PFEnv.logger.warning("Image paths %s not found, not removing missing files." %
+                    (str(missing_roots),))
+        else:
+            with conn:
+                removed = [row[0] for row in conn.execute(
+                        "SELECT path FROM files WHERE scan_id < ?", (scan_id,))]
+                conn.execute("DELETE FROM files WHERE scan_id < ?", (scan_id,))
+                conn.execute("DELETE FROM dirs WHERE scan_id < ?", (scan_id,))
+            PFCatalog.mark_removed(removed)
+        PFCatalog.set_state('scan_id', scan_id)
+
+        # New files get higher ids than any before them.
+        added = [row[0] for row in conn.execute("SELECT path FROM files WHERE id > ? LIMIT ?",
+                (last_id, PFChangeLog.SIZE + 1))]
+        PFCatalog.changes.record(added, [])
+        PFCatalog.update_count(conn)
+
+        PFEnv.logger.info("Catalog scan found %d files, removed %d, in %.1f seconds" %
+                (count, len(removed), time.monotonic() - start))
+
+    ############################################################
+    #
+    # add_files
+    #
+    @staticmethod
+    def add_files(conn, batch):
+        """
+        Insert or update a batch of (path, dir, size, mtime, scan_id) rows
+        and let any waiting readers know there are new files.  The
+        FILE_COLUMNS of a file whose size or mtime changed are cleared.
+        """
+        if not batch:
+            return
+        clear = "".join([", %s = CASE WHEN size = excluded.size AND mtime = excluded.mtime "
+                "THEN %s END" % (name, name) for name, decl in PFCatalog.FILE_COLUMNS])
+        with conn:
+            conn.executemany(
+                "INSERT INTO files (path, dir, size, mtime, scan_id) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET size = excluded.size, "
+                "mtime = excluded.mtime, scan_id = excluded.scan_id" + clear, batch)
+        PFCatalog.notify_scan()
+
+    ############################################################
+    #
+    # get_dir_row
+    #
+    @staticmethod
+    def get_dir_row(dirpath, scan_id):
+        """
+        Get the (path, parent, mtime, scan_id) row for a directory, or
+        None if it can't be stat'ed.
+        """
+        try:
+            mtime = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            return None
+        return (dirpath, os.path.dirname(dirpath), mtime, scan_id)
+
+    ############################################################
+    #
+    # add_dirs
+    #
+    @staticmethod
+    def add_dirs(conn, batch):
+        """
+        Insert or update a batch of (path, parent, mtime, scan_id) rows.
+        """
+        if not batch:
+            return
+        with conn:
+            conn.executemany(
+                "INSERT INTO dirs (path, parent, mtime, scan_id) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET mtime = excluded.mtime, "
+                "scan_id = excluded.scan_id", batch)
+
+    ############################################################
+    #
+    # get_dirs
+    #
+    @staticmethod
+    def get_dirs(root):
+        """
+        Get a list of (path, mtime) of the catalogued directories under
+        root, including root.
+        """
+        prefix = os.path.join(root, '')
+        rows = PFCatalog.get_conn().execute(
+                "SELECT path, mtime FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+                (root, len(prefix), prefix))
+        return rows.fetchall()
+
+    ############################################################
+    #
+    # get_dir_files
+    #
+    @staticmethod
+    def get_dir_files(dirpath):
+        """
+        Get a list of (path, size, mtime) of the catalogued files in
+        one directory, not including its subdirectories.
+        """
+        rows = PFCatalog.get_conn().execute(
+                "SELECT path, size, mtime FROM files WHERE dir = ?", (dirpath,))
+        return rows.fetchall()
+
+    ############################################################
+    #
+    # sync_dir
+    #
+    @staticmethod
+    def sync_dir(dirpath):
+        """
+        Bring the catalog up to date for one directory that has changed:
+        add new and changed files, remove deleted ones, walk new
+        subdirectories and remove deleted ones.  Only this directory is
+        listed; subdirectories are only walked if they are new.
+
+        Returns:
+            List of the directories that are new to the catalog.
+        """
+        conn = PFCatalog.get_conn()
+        scan_id = PFCatalog.current_scan_id
+
+        # The directory's mtime is read before listing it, so anything
+        # that changes while it is listed changes the mtime again.
+        dir_row = PFCatalog.get_dir_row(dirpath, scan_id)
+        try:
+            entries, subdirs = PFWalker.list_dir(dirpath)
+        except FileNotFoundError:
+            PFCatalog.mark_removed(PFCatalog.remove_dir(conn, dirpath))
+            return []
+        except OSError as exc:
+            PFEnv.logger.warning("Could not read directory '%s': %s" % (dirpath, str(exc)))
+            return []
+
+        known = {}
+        for path, size, mtime in conn.execute(
+                "SELECT path, size, mtime FROM files WHERE dir = ?", (dirpath,)):
+            known[path] = (size, mtime)
+
+        batch = []
+        added = []
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            old = known.pop(entry.path, None)
+            if old != (stat.st_size, stat.st_mtime_ns):
+                batch.append((entry.path, dirpath, stat.st_size, stat.st_mtime_ns, scan_id))
+                if old is None:
+                    added.append(entry.path)
+        PFCatalog.add_files(conn, batch)
+
+        removed = list(known)
+        if removed:
+            with conn:
+                conn.executemany("DELETE FROM files WHERE path = ?",
+                        [(path,) for path in removed])
+
+        new_dirs = []
+        known_dirs = set(row[0] for row in conn.execute(
+                "SELECT path FROM dirs WHERE parent = ? AND path != ?", (dirpath, dirpath)))
+        for subdir in subdirs:
+            if subdir in known_dirs:
+                known_dirs.discard(subdir)
+            else:
+                new_dirs.extend(PFCatalog.add_tree(conn, subdir, added))
+        for subdir in known_dirs:
+            removed.extend(PFCatalog.remove_dir(conn, subdir))
+
+        if dir_row is not None:
+            PFCatalog.add_dirs(conn, [dir_row])
+        PFCatalog.mark_removed(removed)
+        PFCatalog.mark_added(added)
+        if added or removed:
+            PFCatalog.update_count(conn)
+            PFEnv.logger.info("Catalog: %d files added, %d removed in '%s'" %
+                    (len(added), len(removed), dirpath))
+        return new_dirs
+
+    ############################################################
+    #
+    # add_tree
+    #
+    @staticmethod
+    def add_tree(conn, root, added):
+        """
+        Add a new directory and everything under it, appending the files
+        to added.
+
+        Returns:
+            List of the directories added.
+        """
+        scan_id = PFCatalog.current_scan_id
+        batch = []
+        dir_batch = []
+
+        def record_dir(dirpath):
+            dir_row = PFCatalog.get_dir_row(dirpath, scan_id)
+            if dir_row is not None:
+                dir_batch.append(dir_row)
+
+        for path, dirname, stat in PFCatalog.walk_files([root], record_dir, False):
+            batch.append((path, dirname, stat.st_size, stat.st_mtime_ns, scan_id))
+            added.append(path)
+        PFCatalog.add_files(conn, batch)
+        PFCatalog.add_dirs(conn, dir_batch)
+        return [dir_row[0] for dir_row in dir_batch]
+
+    ############################################################
+    #
+    # remove_dir
+    #
+    @staticmethod
+    def remove_dir(conn, dirpath):
+        """
+        Remove a directory and everything under it from the catalog.
+
+        Returns:
+            List of the files removed.
+        """
+        prefix = os.path.join(dirpath, '')
+        params = (dirpath, len(prefix), prefix)
+        with conn:
+            removed = [row[0] for row in conn.execute(
+                    "SELECT path FROM files WHERE substr(path, 1, ?) = ?", params[1:])]
+            conn.execute("DELETE FROM files WHERE substr(path, 1, ?) = ?", params[1:])
+            conn.execute("DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?", params)
+        return removed
+
+    ############################################################
+    #
+    # mark_added
+    #
+    @staticmethod
+    def mark_added(paths):
+        """
+        Queue newly found files to be shown next.
+        """
+        if not paths:
+            return
+        PFCatalog.changes.record(paths, [])
+        with PFCatalog.lock:
+            PFCatalog.added.extend(paths)
+        PFCatalog.notify_scan()
+
+    ############################################################
+    #
+    # mark_removed
+    #
+    @staticmethod
+    def mark_removed(paths):
+        """
+        Note files that were removed so the reader skips them.
+        """
+        if not paths:
+            return
+        PFCatalog.changes.record([], paths)
+        with PFCatalog.lock:
+            PFCatalog.removed.update(paths)
+            if PFCatalog.added:
+                PFCatalog.added = deque(path for path in PFCatalog.added
+                        if path not in PFCatalog.removed)
+
+    ############################################################
+    #
+    # pop_added
+    #
+    @staticmethod
+    def pop_added():
+        """
+        Get the next newly found file to show, or None.
+        """
+        with PFCatalog.lock:
+            if PFCatalog.added:
+                return PFCatalog.added.popleft()
+        return None
+
+    ############################################################
+    #
+    # is_removed
+    #
+    @staticmethod
+    def is_removed(path):
+        """
+        Returns whether a file was removed since the reader's last batch.
+        """
+        with PFCatalog.lock:
+            return path in PFCatalog.removed
+
+    ############################################################
+    #
+    # get_scan_generation
+    #
+    @staticmethod
+    def get_scan_generation():
+        """
+        Get the current scan generation, to pass to wait_for_scan().
+        """
+        with PFCatalog.scan_changed:
+            return PFCatalog.scan_generation
+
+    ############################################################
+    #
+    # notify_scan
+    #
+    @staticmethod
+    def notify_scan():
+        """
+        Wake every thread waiting for files to be added.
+        """
+        with PFCatalog.scan_changed:
+            PFCatalog.scan_generation = PFCatalog.scan_generation + 1
+            PFCatalog.scan_changed.notify_all()
+
+    ############################################################
+    #
+    # wait_for_scan
+    #
+    @staticmethod
+    def wait_for_scan(generation, timeout):
+        """
+        Wait until files have been added or a scan has finished since
+        get_scan_generation() returned generation, or until timeout
+        seconds have passed.
+        """
+        with PFCatalog.scan_changed:
+            PFCatalog.scan_changed.wait_for(
+                    lambda: PFCatalog.scan_generation != generation, timeout)
+
+    ############################################################
+    #
+    # request_rescan
+    #
+    @staticmethod
+    def request_rescan():
+        """
+        Wake the scan thread to walk all of the image paths now.
+        """
+        PFCatalog.rescan_event.set()
+
+    ############################################################
+    #
+    # scan_main
+    #
+    @staticmethod
+    def scan_main():
+        """
+        Rescan at startup, then every catalog_rescan_interval seconds or
+        when request_rescan() is called.
+        """
+        PFEnv.setup_logger()
+        while True:
+            PFCatalog.scanning = True
+            try:
+                PFCatalog.scan()
+            except (OSError, sqlite3.Error) as exc:
+                PFEnv.logger.error("Catalog scan failed: %s" % (str(exc),))
+            PFCatalog.scanning = False
+            PFCatalog.notify_scan()
+            PFCatalog.first_scan_done.set()
+
+            PFCatalog.rescan_event.wait(PFSettings.catalog_rescan_interval or None)
+            PFCatalog.rescan_event.clear()
+
+    ############################################################
+    #
+    # get_count
+    #
+    @staticmethod
+    def get_count():
+        """
+        Get the number of files in the catalog, leaving out duplicates,
+        as of the last update_count().
+        """
+        return PFCatalog.file_count
+
+    ############################################################
+    #
+    # update_count
+    #
+    @staticmethod
+    def update_count(conn):
+        """
+        Count the files in the catalog again, after files were added or
+        removed or found to be duplicates.
+        """
+        PFCatalog.file_count = conn.execute("SELECT COUNT(*) FROM files WHERE %s" %
+                (PFCatalog.get_unique_condition(),)).fetchone()[0]
+        with PFCatalog.lock:
+            PFCatalog.position_index = None
+
+    ############################################################
+    #
+    # get_unique_condition
+    #
+    @staticmethod
+    def get_unique_condition():
+        """
+        Get the SQL condition that leaves out all but the first of each
+        set of duplicate files.
+        """
+        if not PFSettings.hash_images:
+            return "1"
+        same = "other.hash = files.hash"
+        if PFSettings.perceptual_hash:
+            same = same + " OR other.phash = files.phash"
+        return "NOT EXISTS (SELECT 1 FROM files AS other WHERE (%s) AND other.id < files.id)" % \
+                (same,)
+
+    ############################################################
+    #
+    # get_next_file
+    #
+    @staticmethod
+    def get_next_file():
+        """
+        Yield the catalogued files, over and over, in catalog order or
+        shuffled.
+        """
+        if PFSettings.shuffle:
+            yield from PFCatalog.get_shuffled_file()
+        else:
+            yield from PFCatalog.get_ordered_file()
+
+    ############################################################
+    #
+    # get_ordered_file
+    #
+    @staticmethod
+    def get_ordered_file():
+        """
+        Yield the catalogued files in order, over and over, reading them
+        from the catalog a batch at a time.  Newly found files are
+        yielded first, and not again when the pass reaches them.  Files
+        removed after their batch was read are skipped.  If the catalog
+        is empty while the first scan is still running, wait for it to
+        find something.
+        """
+        conn = PFCatalog.get_conn()
+        unique = PFCatalog.get_unique_condition()
+        shown_early = set()
+        while True:
+            generation = PFCatalog.get_scan_generation()
+            image_file_count = 0
+            last_id = 0
+            while True:
+                # Anything removed before this read isn't in the batch.
+                with PFCatalog.lock:
+                    PFCatalog.removed.clear()
+                rows = conn.execute(
+                        "SELECT id, path FROM files WHERE id > ? AND %s ORDER BY id LIMIT ?" %
+                        (unique,), (last_id, PFCatalog.BATCH_SIZE)).fetchall()
+                if not rows:
+                    break
+                for file_id, path in rows:
+                    new_path = PFCatalog.pop_added()
+                    while new_path is not None:
+                        shown_early.add(new_path)
+                        image_file_count = image_file_count + 1
+                        yield new_path
+                        new_path = PFCatalog.pop_added()
+
+                    if path in shown_early:
+                        shown_early.discard(path)
+                        continue
+                    if PFCatalog.is_removed(path):
+                        continue
+                    image_file_count = image_file_count + 1
+                    yield path
+                last_id = rows[-1][0]
+
+            # New files get higher ids than any before them, so the pass
+            # has reached every one it showed early.
+            shown_early.clear()
+
+            if image_file_count == 0:
+                if PFCatalog.scanning:
+                    PFCatalog.wait_for_scan(generation, 1)
+                    continue
+
+                PFEnv.logger.error(f"No images found in {PFCatalog.get_roots()}, quitting")
+                raise NoImagesFoundException()
+
+    ############################################################
+    #
+    # get_shuffle_head
+    #
+    @staticmethod
+    def get_shuffle_head(seed, size, prev_seed, prev_size):
+        """
+        Get the file ids for the start of a shuffled cycle.  The first
+        2 * K positions are reordered so that none of the last K files
+        of the previous cycle are among its first K, where K is
+        shuffle_no_repeat (less for a small catalog).
+        """
+        no_repeat = min(PFSettings.shuffle_no_repeat, size // 2, prev_size)
+        recent = set()
+        for position in range(prev_size - no_repeat, prev_size):
+            recent.add(PFShuffle.permute(position, prev_size, prev_seed) + 1)
+
+        head = [PFShuffle.permute(position, size, seed) + 1
+                for position in range(min(2 * no_repeat, size))]
+        return [file_id for file_id in head if file_id not in recent] + \
+                [file_id for file_id in head if file_id in recent]
+
+    ############################################################
+    #
+    # get_shuffled_file
+    #
+    @staticmethod
+    def get_shuffled_file():
+        """
+        Yield the catalogued files in a random order that shows each
+        exactly once per cycle, then starts again in a new order.
+
+        A cycle covers the file ids up to the largest one when it
+        started, so no list of files is held in memory.  Ids of deleted
+        and duplicate files are skipped.  Files added during a cycle are
+        shown when they are found (see sync_dir()) and are part of the
+        next cycle.  The seed and position are saved in the catalog, so
+        the cycle carries on after a restart.
+        """
+        conn = PFCatalog.get_conn()
+        unique = PFCatalog.get_unique_condition()
+        seed = int(PFCatalog.get_state('shuffle_seed', 0))
+        size = int(PFCatalog.get_state('shuffle_size', 0))
+        position = int(PFCatalog.get_state('shuffle_position', 0))
+        prev_seed = int(PFCatalog.get_state('shuffle_prev_seed', 0))
+        prev_size = int(PFCatalog.get_state('shuffle_prev_size', 0))
+
+        while True:
+            if position >= size:
+                generation = PFCatalog.get_scan_generation()
+                max_id = conn.execute("SELECT MAX(id) FROM files").fetchone()[0]
+                if max_id is None:
+                    if PFCatalog.scanning:
+                        PFCatalog.wait_for_scan(generation, 1)
+                        continue
+                    PFEnv.logger.error(f"No images found in {PFCatalog.get_roots()}, quitting")
+                    raise NoImagesFoundException()
+
+                if size:
+                    prev_seed = seed
+                    prev_size = size
+                seed = random.getrandbits(63)
+                size = max_id
+                position = 0
+                for key, value in (('shuffle_prev_seed', prev_seed),
+                        ('shuffle_prev_size', prev_size), ('shuffle_seed', seed),
+                        ('shuffle_size', size), ('shuffle_position', position)):
+                    PFCatalog.set_state(key, value, conn)
+                PFEnv.logger.info("Shuffling %d files" % (PFCatalog.get_count(),))
+
+            head = PFCatalog.get_shuffle_head(seed, size, prev_seed, prev_size)
+            while position < size:
+                # Look up a batch of positions at a time, as many ids may
+                # be gone or duplicates.
+                file_ids = []
+                for batch_position in range(position, min(position + PFCatalog.BATCH_SIZE, size)):
+                    if batch_position < len(head):
+                        file_ids.append(head[batch_position])
+                    else:
+                        file_ids.append(PFShuffle.permute(batch_position, size, seed) + 1)
+                with PFCatalog.lock:
+                    PFCatalog.removed.clear()
+                paths = dict(conn.execute(
+                        "SELECT id, path FROM files WHERE id IN (%s) AND %s" %
+                        (",".join("?" * len(file_ids)), unique), file_ids))
+
+                for file_id in file_ids:
+                    new_path = PFCatalog.pop_added()
+                    while new_path is not None:
+                        yield new_path
+                        new_path = PFCatalog.pop_added()
+
+                    position = position + 1
+                    path = paths.get(file_id)
+                    if path is None or PFCatalog.is_removed(path):
+                        continue
+                    # Only saved when a file is shown, not for every id
+                    # skipped on the way.
+                    PFCatalog.set_state('shuffle_position', position, conn)
+                    yield path
+
+    ############################################################
+    #
+    # get_file
+    #
+    @staticmethod
+    def get_file(position):
+        """
+        Get the file at a position of the catalog order, leaving out
+        duplicates, or None if there are fewer files than that.  The
+        lookup seeks to the id of the nearest position in the
+        position index and counts on from there.
+        """
+        conn = PFCatalog.get_conn()
+        unique = PFCatalog.get_unique_condition()
+        with PFCatalog.lock:
+            position_index = PFCatalog.position_index
+        if position_index is None:
+            position_index = []
+            rows = conn.execute("SELECT id FROM files WHERE %s ORDER BY id" % (unique,))
+            for count, (file_id,) in enumerate(rows):
+                if count % PFCatalog.BATCH_SIZE == 0:
+                    position_index.append(file_id)
+            with PFCatalog.lock:
+                PFCatalog.position_index = position_index
+
+        start, offset = divmod(position, PFCatalog.BATCH_SIZE)
+        if start >= len(position_index):
+            return None
+        row = conn.execute(
+                "SELECT path FROM files WHERE id >= ? AND %s ORDER BY id LIMIT 1 OFFSET ?" %
+                (unique,), (position_index[start], offset)).fetchone()
+        return row[0] if row is not None else None
@@ -0,0 +1,294 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_decoder.py
+
+Decode images in a small pool of separate processes.  HEIC and AVIF
+decoding is slow and a bad file can hang the decoder, so those formats
+(or all of them, depending on the settings) are decoded and sized in a
+worker process with a time limit.  A worker that runs out of time is
+killed and replaced, and the file is skipped from then on, so the frame
+keeps going.
+
+The sized image is passed back through a shared memory block owned by
+this process rather than being pickled through the pipe.  The admission
+and resize counters the decode updated in the worker are passed back
+with it and added to this process's.
+"""
+
+import os
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from PIL import Image
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_admission import PFAdmission
+from picframe_resample import PFResample
+
+
+class PFDecoderWorker:
+    """
+    One decoder process, the pipe used to talk to it and the shared
+    memory block it writes sized images into.
+    """
+
+    ############################################################
+    #
+    # __init__
+    #
+    def __init__(self, decoder):
+        self.conn, child_conn = mp.Pipe()
+        self.process = mp.Process(target=PFDecoder.decoder_main,
+                args=(child_conn, decoder), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.shm = None
+
+    ############################################################
+    #
+    # get_shm
+    #
+    def get_shm(self, nbytes):
+        """
+        Return a shared memory block of at least nbytes, replacing the
+        current one if it is too small.
+        """
+        if self.shm is not None and self.shm.size < nbytes:
+            self.close_shm()
+        if self.shm is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        return self.shm
+
+    ############################################################
+    #
+    # close_shm
+    #
+    def close_shm(self):
+        """
+        Release the shared memory block.
+        """
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    ############################################################
+    #
+    # kill
+    #
+    def kill(self):
+        """
+        Stop the worker process, forcefully if it doesn't go quietly.
+        """
+        self.process.terminate()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.close_shm()
+
+
+class PFDecoder:
+    """
+    Hand image decodes to the worker processes and collect the results.
+    """
+    initialized = False
+    decoder = None
+    idle_workers = None
+    failed_files = set()
+    timeouts = 0
+
+    # Modes passed back as is.  Everything else is converted first so
+    # that no palette or other side information has to be passed back.
+    SHARED_MODES = ('L', 'RGB', 'RGBA')
+
+    ############################################################
+    #
+    # init
+    #
+    @staticmethod
+    def init(decoder):
+        """
+        Start the worker processes.
+        Inputs:
+            decoder: Function taking (image_file, width, height, stat) and
+                returning the sized PIL image.  It is run in the workers.
+        """
+        PFDecoder.decoder = decoder
+        PFDecoder.idle_workers = queue.Queue()
+        for i in range(PFSettings.decoder_processes):
+            PFDecoder.idle_workers.put(PFDecoderWorker(decoder))
+
+        PFDecoder.initialized = True
+
+    ############################################################
+    #
+    # is_isolated
+    #
+    @staticmethod
+    def is_isolated(file_extension):
+        """
+        Returns whether files with this extension are decoded in the
+        worker processes.
+        """
+        return PFDecoder.initialized and \
+            file_extension.lower() in PFSettings.isolated_decode_types
+
+    ############################################################
+    #
+    # decode
+    #
+    @staticmethod
+    def decode(image_file, width, height, stat):
+        """
+        Decode and size an image in a worker process.  Blocks until a
+        worker is free and the decode is done or has timed out.
+
+        Raises:
+            TimeoutError if the decode took more than decode_timeout
+            seconds, or the file timed out before.
+            ValueError or OSError if the worker could not read the file.
+        """
+        failed_key = (image_file, stat.st_size, stat.st_mtime_ns)
+        if failed_key in PFDecoder.failed_files:
+            raise TimeoutError("Skipping image that failed to decode before")
+
+        worker = PFDecoder.idle_workers.get()
+        try:
+            shm = worker.get_shm(width * height * 4)
+            worker.conn.send((image_file, width, height, stat, shm.name))
+
+            if not worker.conn.poll(PFSettings.decode_timeout):
+                PFDecoder.timeouts = PFDecoder.timeouts + 1
+                PFDecoder.failed_files.add(failed_key)
+                PFEnv.logger.error("Decoding '%s' took more than %d seconds, killing the decoder." %
+                        (image_file, PFSettings.decode_timeout))
+                worker.kill()
+                worker = PFDecoderWorker(PFDecoder.decoder)
+                raise TimeoutError("Decode timed out")
+
+            try:
+                result = worker.conn.recv()
+            except EOFError:
+                PFDecoder.failed_files.add(failed_key)
+                PFEnv.logger.error("Decoder process died on '%s', restarting it." % (image_file,))
+                worker.kill()
+                worker = PFDecoderWorker(PFDecoder.decoder)
+                raise OSError("Decoder process died")
+
+            status, value, counters = result
+            admission_counters, resample_counters = counters
+            PFAdmission.add_counters(admission_counters)
+            PFResample.add_counters(resample_counters)
+            if status == 'ValueError':
+                raise ValueError(value)
+            if status != 'ok':
+                raise OSError(value)
+
+            mode, size, nbytes, placeholder = value
+            with shm.buf[:nbytes] as view:
+                pil_img = Image.frombytes(mode, size, view)
+            if placeholder:
+                pil_img.info[PFEnv.PLACEHOLDER] = True
+            return pil_img
+        finally:
+            PFDecoder.idle_workers.put(worker)
+
+    ############################################################
+    #
+    # decoder_main
+    #
+    @staticmethod
+    def decoder_main(conn, decoder):
+        """
+        Worker process loop: decode each requested image and copy the
+        sized result into the shared memory block named in the request.
+        """
+        PFEnv.setup_logger()
+
+        # Drop any counts copied from the parent when it forked.
+        PFDecoder.take_counters()
+
+        while True:
+            try:
+                image_file, width, height, stat, shm_name = conn.recv()
+            except EOFError:
+                return
+
+            try:
+                pil_img = decoder(image_file, width, height, stat)
+                if pil_img.mode not in PFDecoder.SHARED_MODES:
+                    if 'A' in pil_img.getbands() or 'transparency' in pil_img.info:
+                        pil_img = pil_img.convert('RGBA')
+                    else:
+                        pil_img = pil_img.convert('RGB')
+
+                # The block belongs to the parent, which unlinks it.
+                shm = shared_memory.SharedMemory(name=shm_name)
+                data = pil_img.tobytes()
+                shm.buf[:len(data)] = data
+                shm.close()
+                placeholder = bool(pil_img.info.get(PFEnv.PLACEHOLDER))
+                conn.send(('ok', (pil_img.mode, pil_img.size, len(data), placeholder),
+                        PFDecoder.take_counters()))
+            except ValueError as exc:
+                conn.send(('ValueError', str(exc), PFDecoder.take_counters()))
+            except Exception as exc:
+                conn.send(('OSError', str(exc), PFDecoder.take_counters()))
+
+    ############################################################
+    #
+    # take_counters
+    #
+    @staticmethod
+    def take_counters():
+        """
+        Get the admission and resize counters updated in this process
+        since the last call, to send back with a result.
+        """
+        return (PFAdmission.take_counters(), PFResample.take_counters())
+
+    ############################################################
+    #
+    # shutdown
+    #
+    @staticmethod
+    def shutdown():
+        """
+        Stop all of the idle workers.
+        """
+        if not PFDecoder.initialized:
+            return
+
+        PFDecoder.initialized = False
+        while not PFDecoder.idle_workers.empty():
+            PFDecoder.idle_workers.get_nowait().kill()
+
+    ############################################################
+    #
+    # get_stats_str
+    #
+    @staticmethod
+    def get_stats_str():
+        """
+        Get a string of the decoder statistics.
+        """
+        if not PFDecoder.initialized:
+            return ''
+
+        outstr = \
+        ("%-20s: %s" % ("decode_timeouts", str(PFDecoder.timeouts))) + os.linesep + \
+        ("%-20s: %s" % ("failed_decodes", str(len(PFDecoder.failed_files)))) + os.linesep
+        return outstr
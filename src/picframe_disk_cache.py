@@ -0,0 +1,236 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_disk_cache.py
+
+Keep a directory of renditions: images that have already been oriented
+and sized for the screen.  The next time around the slideshow the
+rendition is read instead of decoding and resizing the original again.
+The directory survives restarts and is kept under a size limit by
+removing the least recently used renditions.
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+
+
+class PFDiskCache:
+    """
+    Persistent, size-bounded cache of screen-sized renditions.
+    """
+    initialized = False
+    cache_dir = None
+    entries = OrderedDict()
+    cache_bytes = 0
+    hits = 0
+    misses = 0
+    lock = threading.Lock()
+
+    # Suffix of renditions being written.  Anything with it left over
+    # from a crash is removed at startup.
+    TMP_SUFFIX = '.tmp'
+
+    ############################################################
+    #
+    # init
+    #
+    @staticmethod
+    def init():
+        """
+        Create the cache directory if needed and load the list of
+        renditions already in it, oldest use first.
+        """
+        PFDiskCache.cache_dir = PFEnv.path_to_platform(
+                os.path.expanduser(PFSettings.rendition_cache_dir))
+        os.makedirs(PFDiskCache.cache_dir, exist_ok=True)
+
+        found = []
+        with os.scandir(PFDiskCache.cache_dir) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith(PFDiskCache.TMP_SUFFIX):
+                    os.remove(entry.path)
+                    continue
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+
+        found.sort()
+        PFDiskCache.entries = OrderedDict()
+        PFDiskCache.cache_bytes = 0
+        for mtime, name, size in found:
+            PFDiskCache.entries[name] = size
+            PFDiskCache.cache_bytes += size
+
+        PFDiskCache.initialized = True
+        PFDiskCache.evict()
+        PFEnv.logger.info("Rendition cache %s: %d entries, %d bytes" %
+                (PFDiskCache.cache_dir, len(PFDiskCache.entries), PFDiskCache.cache_bytes))
+
+    ############################################################
+    #
+    # get_name
+    #
+    @staticmethod
+    def get_name(image_file, stat, width, height):
+        """
+        Get the rendition file name for an image file at a canvas size.
+        It changes whenever the source file's size or mtime, or the
+        settings that change the pixels (resampling profile, reduced
+        decoding and the decoding memory budget, which sets the decode
+        scale), change.
+        """
+        key = "%s|%d|%d|%dx%d|%s|%s|%d" % (image_file, stat.st_size, stat.st_mtime_ns,
+                width, height, PFSettings.resample_profile,
+                PFSettings.reduced_decode, PFSettings.max_decoded_image_bytes)
+        return hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    ############################################################
+    #
+    # contains
+    #
+    @staticmethod
+    def contains(image_file, stat, width, height):
+        """
+        Returns whether there is a rendition for an image file at a
+        canvas size.
+        """
+        name = PFDiskCache.get_name(image_file, stat, width, height)
+        with PFDiskCache.lock:
+            return name in PFDiskCache.entries
+
+    ############################################################
+    #
+    # get
+    #
+    @staticmethod
+    def get(image_file, stat, width, height):
+        """
+        Return the cached rendition as a loaded PIL image, or None if
+        there isn't one.
+        """
+        name = PFDiskCache.get_name(image_file, stat, width, height)
+        with PFDiskCache.lock:
+            if name not in PFDiskCache.entries:
+                PFDiskCache.misses = PFDiskCache.misses + 1
+                return None
+            PFDiskCache.entries.move_to_end(name)
+
+        path = os.path.join(PFDiskCache.cache_dir, name)
+        try:
+            pil_img = Image.open(path)
+            pil_img.load()
+            os.utime(path)
+        except (ValueError, OSError) as exc:
+            PFEnv.logger.warning("Dropping bad rendition %s for %s: %s" % (name, image_file, str(exc)))
+            PFDiskCache.remove(name)
+            with PFDiskCache.lock:
+                PFDiskCache.misses = PFDiskCache.misses + 1
+            return None
+
+        with PFDiskCache.lock:
+            PFDiskCache.hits = PFDiskCache.hits + 1
+        return pil_img
+
+    ############################################################
+    #
+    # put
+    #
+    @staticmethod
+    def put(image_file, stat, width, height, pil_img):
+        """
+        Save a rendition.  It is written to a temporary file and renamed
+        into place so a crash never leaves a partial rendition behind.
+        """
+        name = PFDiskCache.get_name(image_file, stat, width, height)
+        path = os.path.join(PFDiskCache.cache_dir, name)
+        tmp_path = "%s.%d.%d%s" % (path, os.getpid(), threading.get_ident(), PFDiskCache.TMP_SUFFIX)
+
+        try:
+            with open(tmp_path, 'wb') as tmp_file:
+                if pil_img.mode in ('RGB', 'L'):
+                    pil_img.save(tmp_file, 'JPEG', quality=92)
+                else:
+                    pil_img.save(tmp_file, 'PNG')
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, path)
+        except (ValueError, OSError) as exc:
+            PFEnv.logger.warning("Could not save rendition for %s: %s" % (image_file, str(exc)))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        size = os.path.getsize(path)
+        with PFDiskCache.lock:
+            PFDiskCache.cache_bytes += size - PFDiskCache.entries.pop(name, 0)
+            PFDiskCache.entries[name] = size
+        PFDiskCache.evict()
+
+    ############################################################
+    #
+    # remove
+    #
+    @staticmethod
+    def remove(name):
+        """
+        Remove a rendition from the cache.
+        """
+        with PFDiskCache.lock:
+            PFDiskCache.cache_bytes -= PFDiskCache.entries.pop(name, 0)
+        try:
+            os.remove(os.path.join(PFDiskCache.cache_dir, name))
+        except FileNotFoundError:
+            pass
+
+    ############################################################
+    #
+    # evict
+    #
+    @staticmethod
+    def evict():
+        """
+        Remove the least recently used renditions until the cache fits in
+        rendition_cache_bytes.
+        """
+        while True:
+            with PFDiskCache.lock:
+                if not PFDiskCache.entries or \
+                        PFDiskCache.cache_bytes <= PFSettings.rendition_cache_bytes:
+                    return
+                name = next(iter(PFDiskCache.entries))
+            PFDiskCache.remove(name)
+
+    ############################################################
+    #
+    # get_stats_str
+    #
+    @staticmethod
+    def get_stats_str():
+        """
+        Get a string of the cache statistics.
+        """
+        if not PFDiskCache.initialized:
+            return ''
+
+        outstr = \
+        ("%-20s: %s" % ("rendition_entries", str(len(PFDiskCache.entries)))) + os.linesep + \
+        ("%-20s: %s" % ("rendition_bytes", str(PFDiskCache.cache_bytes))) + os.linesep + \
+        ("%-20s: %s" % ("rendition_hits", str(PFDiskCache.hits))) + os.linesep + \
+        ("%-20s: %s" % ("rendition_misses", str(PFDiskCache.misses))) + os.linesep
+        return outstr
@@ -0,0 +1,350 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_drive_backend.py
+
+The calls PFDriveTree and PFGoogleDrive make to Google Drive, behind a
+small interface so the rest of the Drive code can be run against a
+local directory instead (PFFakeDriveBackend, see gdrive_fake_root).
+
+Drive items are passed around as node dicts:
+    {'id': , 'title': , 'parent': , 'folder': , 'md5': , 'size': }
+where parent is the id of the item's first parent and folder is
+whether it is a folder.
+"""
+
+import os
+import re
+import socket
+import shutil
+import hashlib
+import threading
+from PIL import Image
+
+
+class PFDriveBackend:
+    """
+    The Drive calls the Drive code needs.
+    """
+
+    FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+    def get_root_id(self):
+        """
+        Get the id of the top of the Drive ('My Drive').
+        """
+        raise NotImplementedError
+
+    def list_children(self, folder_id):
+        """
+        Yield the node dicts of the items in a folder, leaving out
+        trashed ones, a page (list) at a time.  May be called from
+        several threads at once.
+        """
+        raise NotImplementedError
+
+    def get_start_token(self):
+        """
+        Get a change token for changes made from now on.
+        """
+        raise NotImplementedError
+
+    def list_changes(self, token):
+        """
+        Get the changes made since a change token.
+
+        Returns:
+            (changes, token) where changes is a list of (id, node dict),
+            the node dict being None for an item that was deleted or
+            trashed.  None if the token is no longer valid, in which case
+            the Drive has to be crawled again.
+        """
+        raise NotImplementedError
+
+    def download(self, file_id, path):
+        """
+        Download a file's contents to a local path.  May be called from
+        several threads at once.
+        """
+        raise NotImplementedError
+
+    def download_rendition(self, file_id, path, size):
+        """
+        Download a copy of an image resized by Drive so its longest side
+        is size pixels, to a local path.  May be called from several
+        threads at once.
+
+        Returns:
+            Whether there was such a copy.  If not the original has to
+            be downloaded.
+        """
+        return False
+
+    def is_transient(self, exc):
+        """
+        Returns whether an error from a call may well go away if the call
+        is tried again.
+        """
+        return isinstance(exc, (ConnectionError, TimeoutError, socket.timeout))
+
+
+class PFPyDrive2Backend(PFDriveBackend):
+    """
+    Google Drive, through pydrive2's authorized Drive API v2 service.
+    Only the fields that go into a node dict are asked for.  Each thread
+    gets its own HTTP connection, as they can't be shared.
+    """
+
+    PAGE_SIZE = 1000
+    DOWNLOAD_CHUNK_BYTES = 4 * 1024 * 1024
+    TRANSIENT_STATUSES = (408, 429, 500, 502, 503, 504)
+    NODE_FIELDS = "id,title,mimeType,parents(id),md5Checksum,fileSize"
+    LIST_FIELDS = "nextPageToken,items(%s)" % (NODE_FIELDS,)
+    CHANGE_FIELDS = "nextPageToken,newStartPageToken," \
+            "items(fileId,deleted,file(%s,labels(trashed)))" % (NODE_FIELDS,)
+    THUMBNAIL_SIZE = re.compile(r'=s\d+[^=/]*$')
+
+    def __init__(self, drive):
+        self.drive = drive
+        self.local = threading.local()
+
+    def get_http(self):
+        """
+        Get this thread's authorized HTTP connection.
+        """
+        http = getattr(self.local, 'http', None)
+        if http is None:
+            http = self.drive.auth.Get_Http_Object()
+            self.local.http = http
+        return http
+
+    def get_node(self, item):
+        """
+        Get the node dict of a Drive v2 file resource.
+        """
+        parents = item.get('parents') or []
+        return {'id': item['id'],
+                'title': item['title'],
+                'parent': parents[0]['id'] if parents else None,
+                'folder': item['mimeType'] == PFDriveBackend.FOLDER_MIME,
+                'md5': item.get('md5Checksum'),
+                'size': int(item.get('fileSize') or 0)}
+
+    def get_root_id(self):
+        about = self.drive.auth.service.about().get(fields='rootFolderId')
+        return about.execute(http=self.get_http())['rootFolderId']
+
+    def list_children(self, folder_id):
+        service = self.drive.auth.service
+        params = {'q': "'%s' in parents and trashed=false" % (folder_id,),
+                'fields': PFPyDrive2Backend.LIST_FIELDS,
+                'maxResults': PFPyDrive2Backend.PAGE_SIZE}
+        while True:
+            response = service.files().list(**params).execute(http=self.get_http())
+            yield [self.get_node(item) for item in response.get('items', [])]
+            if 'nextPageToken' not in response:
+                return
+            params['pageToken'] = response['nextPageToken']
+
+    def get_start_token(self):
+        service = self.drive.auth.service
+        return service.changes().getStartPageToken().execute(
+                http=self.get_http())['startPageToken']
+
+    def list_changes(self, token):
+        # Imported here as only this backend needs the Google API client.
+        from googleapiclient.errors import HttpError
+
+        service = self.drive.auth.service
+        changes = []
+        while True:
+            try:
+                response = service.changes().list(pageToken=token, includeDeleted=True,
+                        fields=PFPyDrive2Backend.CHANGE_FIELDS,
+                        maxResults=PFPyDrive2Backend.PAGE_SIZE).execute(http=self.get_http())
+            except HttpError as exc:
+                if exc.resp.status in (400, 404, 410):
+                    return None
+                raise
+            for item in response.get('items', []):
+                resource = item.get('file')
+                if item.get('deleted') or resource is None or \
+                        resource.get('labels', {}).get('trashed'):
+                    changes.append((item['fileId'], None))
+                else:
+                    changes.append((item['fileId'], self.get_node(resource)))
+            if 'nextPageToken' in response:
+                token = response['nextPageToken']
+            else:
+                return changes, response['newStartPageToken']
+
+    def download(self, file_id, path):
+        from googleapiclient.http import MediaIoBaseDownload
+
+        request = self.drive.auth.service.files().get_media(fileId=file_id)
+        request.http = self.get_http()
+        with open(path, 'wb') as media_file:
+            downloader = MediaIoBaseDownload(media_file, request,
+                    chunksize=PFPyDrive2Backend.DOWNLOAD_CHUNK_BYTES)
+            done = False
+            while not done:
+                status, done = downloader.next_chunk()
+
+    def download_rendition(self, file_id, path, size):
+        from googleapiclient.errors import HttpError
+
+        # The thumbnail link is only good for a few hours, so it's asked
+        # for each time rather than kept in the tree.
+        item = self.drive.auth.service.files().get(fileId=file_id,
+                fields='thumbnailLink').execute(http=self.get_http())
+        link = item.get('thumbnailLink')
+        if not link:
+            return False
+
+        # The link ends with the size of its longest side, e.g. =s220.
+        url = PFPyDrive2Backend.THUMBNAIL_SIZE.sub('', link) + '=s%d' % (size,)
+        response, content = self.get_http().request(url)
+        if response.status == 404:
+            return False
+        if response.status >= 400:
+            raise HttpError(response, content, uri=url)
+        # A quota or sign-in page can come back as a 200, and a body can
+        # be cut short; those are retried rather than cached.
+        if response.status != 200:
+            raise ConnectionError("Resized copy of %s: status %d" % (file_id, response.status))
+        content_type = response.get('content-type', '')
+        if content_type.startswith('text/html'):
+            raise ConnectionError("Resized copy of %s: got a web page" % (file_id,))
+        if not content_type.startswith('image/'):
+            return False
+        length = response.get('content-length')
+        if length is not None and length.isdigit() and int(length) != len(content):
+            raise ConnectionError("Resized copy of %s: %d of %s bytes" %
+                    (file_id, len(content), length))
+        with open(path, 'wb') as media_file:
+            media_file.write(content)
+        return True
+
+    def is_transient(self, exc):
+        import httplib2
+        from googleapiclient.errors import HttpError
+
+        if isinstance(exc, HttpError):
+            return exc.resp.status in PFPyDrive2Backend.TRANSIENT_STATUSES
+        return isinstance(exc, httplib2.HttpLib2Error) or PFDriveBackend.is_transient(self, exc)
+
+
+class PFFakeDriveBackend(PFDriveBackend):
+    """
+    A local directory served as if it were a Drive, for trying out and
+    testing the Drive code without a Google account.  An item's id is
+    its path relative to the directory.  Changes are found by comparing
+    snapshots of the directory, so only the latest change token this
+    process handed out is valid.
+    """
+
+    ROOT_ID = 'root'
+    PAGE_SIZE = 100
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.snapshot_id = 0
+        self.snapshot = None
+        self.md5s = {}
+
+    def get_path(self, item_id):
+        if item_id == PFFakeDriveBackend.ROOT_ID:
+            return self.root
+        return os.path.join(self.root, item_id)
+
+    def get_md5(self, path, stat):
+        """
+        Get the md5 of a file, computing it only when the file changes.
+        """
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        md5 = self.md5s.get(key)
+        if md5 is None:
+            digest = hashlib.md5()
+            with open(path, 'rb') as image_file:
+                for data in iter(lambda: image_file.read(1024 * 1024), b''):
+                    digest.update(data)
+            md5 = digest.hexdigest()
+            self.md5s[key] = md5
+        return md5
+
+    def get_root_id(self):
+        return PFFakeDriveBackend.ROOT_ID
+
+    def list_children(self, folder_id):
+        nodes = []
+        with os.scandir(self.get_path(folder_id)) as entries:
+            for entry in entries:
+                item_id = os.path.relpath(entry.path, self.root)
+                stat = entry.stat()
+                folder = entry.is_dir()
+                nodes.append({'id': item_id,
+                        'title': entry.name,
+                        'parent': folder_id,
+                        'folder': folder,
+                        'md5': None if folder else self.get_md5(entry.path, stat),
+                        'size': 0 if folder else stat.st_size})
+        for start in range(0, len(nodes), PFFakeDriveBackend.PAGE_SIZE):
+            yield nodes[start:start + PFFakeDriveBackend.PAGE_SIZE]
+
+    def take_snapshot(self):
+        """
+        Get the node dict of everything in the directory, by id.
+        """
+        snapshot = {}
+        folders = [PFFakeDriveBackend.ROOT_ID]
+        while folders:
+            for page in self.list_children(folders.pop()):
+                for node in page:
+                    snapshot[node['id']] = node
+                    if node['folder']:
+                        folders.append(node['id'])
+        return snapshot
+
+    def get_start_token(self):
+        with self.lock:
+            self.snapshot = self.take_snapshot()
+            self.snapshot_id = self.snapshot_id + 1
+            return str(self.snapshot_id)
+
+    def list_changes(self, token):
+        with self.lock:
+            if self.snapshot is None or token != str(self.snapshot_id):
+                return None
+            old = self.snapshot
+            new = self.take_snapshot()
+            self.snapshot = new
+            self.snapshot_id = self.snapshot_id + 1
+            token = str(self.snapshot_id)
+
+        changes = [(item_id, None) for item_id in old if item_id not in new]
+        changes.extend((item_id, node) for item_id, node in new.items()
+                if old.get(item_id) != node)
+        return changes, token
+
+    def download(self, file_id, path):
+        shutil.copyfile(self.get_path(file_id), path)
+
+    def download_rendition(self, file_id, path, size):
+        try:
+            with Image.open(self.get_path(file_id)) as image:
+                image.thumbnail((size, size))
+                image.convert('RGB').save(path, 'JPEG')
+        except OSError:
+            # Not something PIL can read, so no copy.
+            return False
+        return True
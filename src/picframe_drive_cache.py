@@ -0,0 +1,522 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_drive_cache.py
+
+Download Google Drive photos ahead of display into a cache directory.
+
+The next gdrive_download_ahead photos are downloaded in parallel by a
+pool of gdrive_download_threads threads, each reusing its own HTTP
+connection, so the next photo is usually on disk before the timer asks
+for it.  Downloads that fail with what looks like a passing network or
+server problem are retried with exponential backoff.
+
+Photos are stored by their contents: a photo's file name is Drive's
+md5Checksum of it.  So the photos are only downloaded again when they
+change, not on every pass or after a restart, and a photo that is
+renamed, moved or copied is already there.  Downloads are checked
+against the checksum.
+
+With gdrive_thumbnails set, Drive is asked for a copy of each photo
+resized to fit the screen, which is a small part of the size of a
+camera original and much quicker to decode.  Photos Drive has no such
+copy of are downloaded whole.
+
+The directory is kept under gdrive_cache_bytes by removing the least
+recently used photos, instead of filling the disk with copies in the
+temp directory.  A photo that has been handed out is pinned, and not
+removed, until release() says it has been shown (or skipped).
+"""
+
+import os
+import glob
+import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_canvas import PFCanvas
+
+
+class PFDriveCache:
+    """
+    Size-bounded cache of downloaded Drive photos.
+    """
+    initialized = False
+    backend = None
+    cache_dir = None
+    pool = None
+    entries = OrderedDict()
+    cache_bytes = 0
+    pinned = {}
+    lock = threading.Lock()
+
+    # Ids of the photos Drive has no resized copy of.
+    no_rendition = set()
+
+    hits = 0
+    misses = 0
+    renditions = 0
+    retries = 0
+    failures = 0
+    bytes_downloaded = 0
+    download_seconds = 0.0
+
+    # Suffix of downloads in progress.  Anything with it left over from
+    # a crash is removed at startup.
+    TMP_SUFFIX = '.tmp'
+
+    # How many times a download is tried, and the wait before the first
+    # retry, doubled for each one after.
+    DOWNLOAD_ATTEMPTS = 5
+    BACKOFF_SECONDS = 1.0
+
+    ############################################################
+    #
+    # init
+    #
+    @staticmethod
+    def init(backend):
+        """
+        Create the cache directory if needed, load the list of photos
+        already in it, oldest use first, and start the download threads.
+        Photos left in the temp directory by earlier versions are
+        removed.
+        """
+        PFDriveCache.backend = backend
+        PFDriveCache.cache_dir = PFEnv.path_to_platform(
+                os.path.expanduser(PFSettings.gdrive_cache_dir))
+        os.makedirs(PFDriveCache.cache_dir, exist_ok=True)
+
+        if PFEnv.default_temp_file_path():
+            for path in glob.glob(glob.escape(PFEnv.default_temp_file_path()) + '*'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        found = []
+        with os.scandir(PFDriveCache.cache_dir) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith(PFDriveCache.TMP_SUFFIX):
+                    os.remove(entry.path)
+                    continue
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+
+        found.sort()
+        PFDriveCache.entries = OrderedDict()
+        PFDriveCache.cache_bytes = 0
+        for mtime, name, size in found:
+            PFDriveCache.entries[name] = size
+            PFDriveCache.cache_bytes += size
+
+        PFDriveCache.pool = ThreadPoolExecutor(max_workers=max(1, PFSettings.gdrive_download_threads),
+                thread_name_prefix="picframe_drive_download")
+        PFDriveCache.initialized = True
+        PFDriveCache.evict()
+        PFEnv.logger.info("Google Drive cache %s: %d photos, %d bytes" %
+                (PFDriveCache.cache_dir, len(PFDriveCache.entries), PFDriveCache.cache_bytes))
+
+    ############################################################
+    #
+    # get_name
+    #
+    @staticmethod
+    def get_name(file_id, title, md5, size=None):
+        """
+        Get the cache file name of a photo: its md5, or if Drive doesn't
+        have one a hash of its id.  It keeps the extension, which says
+        how to decode it.  A resized copy of size pixels is a JPEG.
+        """
+        filename, file_extension = os.path.splitext(title)
+        if md5 is None:
+            md5 = 'id-' + hashlib.sha1(file_id.encode('utf-8')).hexdigest()
+        if size is not None:
+            return "%s-s%d.jpg" % (md5, size)
+        return md5 + file_extension.lower()
+
+    ############################################################
+    #
+    # get_path
+    #
+    @staticmethod
+    def get_path(file_id, title, md5):
+        """
+        Get the full path a photo is cached at, as get() would return it.
+        """
+        size = PFDriveCache.get_rendition_size()
+        if file_id in PFDriveCache.no_rendition:
+            size = None
+        return os.path.join(PFDriveCache.cache_dir, PFDriveCache.get_name(file_id, title, md5, size))
+
+    ############################################################
+    #
+    # get_paths
+    #
+    @staticmethod
+    def get_paths(file_id, title, md5):
+        """
+        Get the full paths a photo may be cached at: the original, and
+        the resized copy if those are being used.
+        """
+        paths = [os.path.join(PFDriveCache.cache_dir, PFDriveCache.get_name(file_id, title, md5))]
+        size = PFDriveCache.get_rendition_size()
+        if size is not None:
+            paths.append(os.path.join(PFDriveCache.cache_dir,
+                    PFDriveCache.get_name(file_id, title, md5, size)))
+        return paths
+
+    ############################################################
+    #
+    # get_rendition_size
+    #
+    @staticmethod
+    def get_rendition_size():
+        """
+        Get the longest side, in pixels, of the resized copies to ask
+        Drive for, or None to download the originals.
+        """
+        if not PFSettings.gdrive_thumbnails:
+            return None
+        width = PFCanvas.width or PFEnv.screen_width
+        height = PFCanvas.height or PFEnv.screen_height
+        if not width or not height:
+            return None
+        return max(width, height)
+
+    ############################################################
+    #
+    # get_md5
+    #
+    @staticmethod
+    def get_md5(path):
+        """
+        Get the md5 of a file, a hex string.
+        """
+        digest = hashlib.md5()
+        with open(path, 'rb') as media_file:
+            for data in iter(lambda: media_file.read(1024 * 1024), b''):
+                digest.update(data)
+        return digest.hexdigest()
+
+    ############################################################
+    #
+    # download
+    #
+    @staticmethod
+    def download(file_id, path, md5, size=None):
+        """
+        Download a photo, or its resized copy of size pixels, to a path,
+        retrying with backoff on transient errors.
+
+        Returns:
+            False if there is no resized copy, otherwise True.
+        """
+        wait = PFDriveCache.BACKOFF_SECONDS
+        for attempt in range(PFDriveCache.DOWNLOAD_ATTEMPTS):
+            try:
+                if size is not None:
+                    return PFDriveCache.backend.download_rendition(file_id, path, size) and \
+                            PFDriveCache.check_rendition(file_id, path, size)
+                PFDriveCache.backend.download(file_id, path)
+                if md5 is not None and PFDriveCache.get_md5(path) != md5:
+                    # Cut short or garbled on the way, so worth trying
+                    # again.
+                    raise ConnectionError("checksum mismatch")
+                return True
+            except Exception as exc:
+                if attempt == PFDriveCache.DOWNLOAD_ATTEMPTS - 1 or \
+                        not PFDriveCache.backend.is_transient(exc):
+                    raise
+                PFEnv.logger.info("Retrying download of %s in %.1f seconds: %s" %
+                        (file_id, wait, str(exc)))
+                with PFDriveCache.lock:
+                    PFDriveCache.retries = PFDriveCache.retries + 1
+                time.sleep(wait * (1 + random.random() / 2))
+                wait = wait * 2
+
+    ############################################################
+    #
+    # check_rendition
+    #
+    @staticmethod
+    def check_rendition(file_id, path, size):
+        """
+        Returns whether a downloaded copy is an image that decodes and
+        is as large as asked for.  Its md5 is the original's, so can't
+        be checked, and Drive caps the size of its copies; a smaller
+        one would be scaled up for as long as it is cached.
+        """
+        try:
+            with Image.open(path) as pil_img:
+                pil_img.load()
+                copy_size = max(pil_img.size)
+        except (ValueError, OSError) as exc:
+            PFEnv.logger.info("Bad resized copy of %s: %s" % (file_id, str(exc)))
+            return False
+        if copy_size < size:
+            PFEnv.logger.info("Resized copy of %s is %d pixels, not %d" %
+                    (file_id, copy_size, size))
+            return False
+        return True
+
+    ############################################################
+    #
+    # get
+    #
+    @staticmethod
+    def get(file_id, title, md5, pin=False):
+        """
+        Get a photo from the cache, downloading it if it isn't there.
+        With gdrive_thumbnails set, that is the copy resized for the
+        screen if Drive has one.  With pin, it is kept in the cache
+        until release() is called with its path.
+
+        Returns:
+            The full path of the cached photo.
+        """
+        size = PFDriveCache.get_rendition_size()
+        if size is not None and file_id not in PFDriveCache.no_rendition:
+            path = PFDriveCache.fetch(file_id, PFDriveCache.get_name(file_id, title, md5, size),
+                    md5, pin, size)
+            if path is not None:
+                return path
+            PFEnv.logger.info("No resized copy of %s, downloading the original" % (title,))
+            with PFDriveCache.lock:
+                PFDriveCache.no_rendition.add(file_id)
+        return PFDriveCache.fetch(file_id, PFDriveCache.get_name(file_id, title, md5), md5, pin)
+
+    ############################################################
+    #
+    # fetch
+    #
+    @staticmethod
+    def fetch(file_id, name, md5, pin, size=None):
+        """
+        Get a cache file, downloading it if it isn't there.  It is
+        downloaded to a temporary file and renamed into place so the
+        cache never holds a partial photo.
+
+        Returns:
+            The full path of the cache file, or None if it is a resized
+            copy Drive doesn't have.
+        """
+        path = os.path.join(PFDriveCache.cache_dir, name)
+        with PFDriveCache.lock:
+            cached = name in PFDriveCache.entries
+            if cached:
+                PFDriveCache.entries.move_to_end(name)
+                if pin:
+                    PFDriveCache.pin(name)
+        if cached:
+            try:
+                os.utime(path)
+                with PFDriveCache.lock:
+                    PFDriveCache.hits = PFDriveCache.hits + 1
+                return path
+            except FileNotFoundError:
+                if pin:
+                    PFDriveCache.release(path)
+                PFDriveCache.remove(name)
+
+        tmp_path = "%s.%d%s" % (path, threading.get_ident(), PFDriveCache.TMP_SUFFIX)
+        start = time.monotonic()
+        try:
+            if not PFDriveCache.download(file_id, tmp_path, md5, size):
+                return None
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        elapsed = time.monotonic() - start
+
+        size_bytes = os.path.getsize(path)
+        with PFDriveCache.lock:
+            PFDriveCache.misses = PFDriveCache.misses + 1
+            if size is not None:
+                PFDriveCache.renditions = PFDriveCache.renditions + 1
+            PFDriveCache.bytes_downloaded = PFDriveCache.bytes_downloaded + size_bytes
+            PFDriveCache.download_seconds = PFDriveCache.download_seconds + elapsed
+            PFDriveCache.cache_bytes += size_bytes - PFDriveCache.entries.pop(name, 0)
+            PFDriveCache.entries[name] = size_bytes
+            if pin:
+                PFDriveCache.pin(name)
+        PFDriveCache.evict()
+        return path
+
+    ############################################################
+    #
+    # pin
+    #
+    @staticmethod
+    def pin(name):
+        """
+        Keep a cache file from being evicted.  Called with the lock held.
+        """
+        PFDriveCache.pinned[name] = PFDriveCache.pinned.get(name, 0) + 1
+
+    ############################################################
+    #
+    # release
+    #
+    @staticmethod
+    def release(path):
+        """
+        Unpin a photo get() returned, once it has been shown or skipped.
+        Paths that aren't pinned are ignored.
+        """
+        name = os.path.basename(path)
+        with PFDriveCache.lock:
+            count = PFDriveCache.pinned.get(name)
+            if count is None:
+                return
+            if count > 1:
+                PFDriveCache.pinned[name] = count - 1
+                return
+            del PFDriveCache.pinned[name]
+        # It may have been kept past gdrive_cache_bytes.
+        PFDriveCache.evict()
+
+    ############################################################
+    #
+    # get_result
+    #
+    @staticmethod
+    def get_result(future, file_id):
+        """
+        Wait for a download, returning the photo's path, or None if it
+        failed.
+        """
+        try:
+            return future.result()
+        except Exception as exc:
+            PFEnv.logger.warning("Could not download %s: %s" % (file_id, str(exc)))
+            with PFDriveCache.lock:
+                PFDriveCache.failures = PFDriveCache.failures + 1
+            return None
+
+    ############################################################
+    #
+    # get_ahead
+    #
+    @staticmethod
+    def get_ahead(photos):
+        """
+        Yield the path of each photo from an iterator of (id, title, md5),
+        with the next gdrive_download_ahead being downloaded in the
+        background.  Photos that can't be downloaded are skipped.  The
+        photos are pinned until release() is called with their paths,
+        so they aren't evicted while they wait to be shown.
+        """
+        pending = deque()
+        try:
+            for file_id, title, md5 in photos:
+                pending.append((file_id,
+                        PFDriveCache.pool.submit(PFDriveCache.get, file_id, title, md5, True)))
+                if len(pending) > PFSettings.gdrive_download_ahead:
+                    file_id, future = pending.popleft()
+                    path = PFDriveCache.get_result(future, file_id)
+                    if path is not None:
+                        yield path
+            while pending:
+                file_id, future = pending.popleft()
+                path = PFDriveCache.get_result(future, file_id)
+                if path is not None:
+                    yield path
+        finally:
+            for file_id, future in pending:
+                if not future.cancel():
+                    # Already downloading or downloaded, so unpin it when
+                    # it is done.
+                    future.add_done_callback(PFDriveCache.release_future)
+
+    ############################################################
+    #
+    # release_future
+    #
+    @staticmethod
+    def release_future(future):
+        """
+        Unpin the photo of a download nothing is waiting for.
+        """
+        if future.exception() is None and future.result() is not None:
+            PFDriveCache.release(future.result())
+
+    ############################################################
+    #
+    # remove
+    #
+    @staticmethod
+    def remove(name):
+        """
+        Remove a photo from the cache.
+        """
+        with PFDriveCache.lock:
+            PFDriveCache.cache_bytes -= PFDriveCache.entries.pop(name, 0)
+        try:
+            os.remove(os.path.join(PFDriveCache.cache_dir, name))
+        except FileNotFoundError:
+            pass
+
+    ############################################################
+    #
+    # evict
+    #
+    @staticmethod
+    def evict():
+        """
+        Remove the least recently used photos until the cache fits in
+        gdrive_cache_bytes, leaving the pinned ones.
+        """
+        while True:
+            with PFDriveCache.lock:
+                if PFDriveCache.cache_bytes <= PFSettings.gdrive_cache_bytes:
+                    return
+                name = next((name for name in PFDriveCache.entries
+                        if name not in PFDriveCache.pinned), None)
+                if name is None:
+                    return
+            PFDriveCache.remove(name)
+
+    ############################################################
+    #
+    # get_stats_str
+    #
+    @staticmethod
+    def get_stats_str():
+        """
+        Get a string of the download and cache statistics.
+        """
+        if not PFDriveCache.initialized:
+            return ''
+
+        with PFDriveCache.lock:
+            rate = PFDriveCache.bytes_downloaded / PFDriveCache.download_seconds / 1000000 \
+                    if PFDriveCache.download_seconds else 0.0
+            outstr = \
+            ("%-20s: %s" % ("gdrive_cached", str(len(PFDriveCache.entries)))) + os.linesep + \
+            ("%-20s: %s" % ("gdrive_cache_bytes", str(PFDriveCache.cache_bytes))) + os.linesep + \
+            ("%-20s: %s" % ("gdrive_hits", str(PFDriveCache.hits))) + os.linesep + \
+            ("%-20s: %s" % ("gdrive_downloads", str(PFDriveCache.misses))) + os.linesep + \
+            ("%-20s: %s" % ("gdrive_resized", str(PFDriveCache.renditions))) + os.linesep + \
+            ("%-20s: %.1f MB/s" % ("gdrive_download_rate", rate)) + os.linesep + \
+            ("%-20s: %s" % ("gdrive_retries", str(PFDriveCache.retries))) + os.linesep + \
+            ("%-20s: %s" % ("gdrive_failures", str(PFDriveCache.failures))) + os.linesep
+        return outstr
@@ -0,0 +1,636 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_drive_tree.py
+
+A local copy of the Google Drive folder tree under gdrive_root_folder,
+kept in an SQLite database at gdrive_tree_path, so that the Drive isn't
+listed folder by folder on every pass through the photos.
+
+The first time, the tree is crawled, having first asked Drive for a
+change token.  After that, each update asks Drive only for what has
+changed since the stored token and applies it to the tree, which is
+usually one small call.  If Drive no longer accepts the token, or the
+folder settings change, the tree is crawled again.
+
+A crawl runs in the background.  The first time, the photos can be read
+from the tree as they are found, so the first one is shown long before
+the crawl finishes.  A crawl of a tree that is already there marks the
+nodes it finds with a new crawl id and only removes the ones it didn't
+find, and replaces the change token, once it has finished, so until
+then and if it fails the old tree is still used.  A crawl that fails is
+tried again, waiting longer after each failure.
+
+Each folder listing already says which children are folders, so only
+folders are listed; up to gdrive_list_threads folders are listed at
+once, and large folders are read a page at a time.
+"""
+
+import os
+import time
+import contextlib
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_stats import PFStats
+
+
+class PFDriveTree:
+    """
+    The persisted Drive folder tree.
+    """
+    initialized = False
+    db_path = None
+    backend = None
+    on_change = None
+    local = threading.local()
+    photo_count = 0
+    crawler = None
+    crawling = False
+    filling = False
+    crawl_event = threading.Event()
+    crawl_id = 0
+    crawl_failures = 0
+    retry_time = 0
+
+    # The wait before trying a failed crawl again, doubled for each
+    # failure after the first up to CRAWL_RETRY_MAX_SECONDS.
+    CRAWL_RETRY_SECONDS = 30
+    CRAWL_RETRY_MAX_SECONDS = 3600
+
+    # How many rows to read or write at a time.
+    BATCH_SIZE = 500
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS nodes ("
+        " id TEXT PRIMARY KEY,"
+        " title TEXT NOT NULL,"
+        " parent TEXT,"
+        " folder INTEGER NOT NULL,"
+        " ext TEXT NOT NULL,"
+        " md5 TEXT,"
+        " size INTEGER NOT NULL,"
+        " crawl_id INTEGER NOT NULL DEFAULT 0)",
+        "CREATE INDEX IF NOT EXISTS nodes_parent ON nodes(parent)",
+        "CREATE INDEX IF NOT EXISTS nodes_md5 ON nodes(md5)",
+        # The folders whose photos are shown.
+        "CREATE TABLE IF NOT EXISTS photo_folders ("
+        " id TEXT PRIMARY KEY)",
+        "CREATE TABLE IF NOT EXISTS state ("
+        " key TEXT PRIMARY KEY,"
+        " value TEXT)",
+    )
+
+    ############################################################
+    #
+    # init
+    #
+    @staticmethod
+    def init(backend, on_change):
+        """
+        Open (creating if needed) the tree database.
+        Inputs:
+            backend: The PFDriveBackend to read the Drive with.
+            on_change: Function taking (added, removed), lists of the
+                (id, title, md5) of files, called when the tree changes.
+        """
+        PFDriveTree.backend = backend
+        PFDriveTree.on_change = on_change
+        PFDriveTree.db_path = PFEnv.path_to_platform(os.path.expanduser(PFSettings.gdrive_tree_path))
+        os.makedirs(os.path.dirname(PFDriveTree.db_path), exist_ok=True)
+
+        conn = PFDriveTree.get_conn()
+        with conn:
+            for statement in PFDriveTree.SCHEMA:
+                conn.execute(statement)
+            existing = set(row[1] for row in conn.execute("PRAGMA table_info(nodes)"))
+            if 'crawl_id' not in existing:
+                conn.execute("ALTER TABLE nodes ADD COLUMN crawl_id INTEGER NOT NULL DEFAULT 0")
+        PFDriveTree.crawl_id = int(PFDriveTree.get_state(conn, 'crawl_id', 0))
+        PFDriveTree.update_photo_count(conn)
+        PFDriveTree.initialized = True
+
+    ############################################################
+    #
+    # get_conn
+    #
+    @staticmethod
+    def get_conn():
+        """
+        Get this thread's connection to the tree database.
+        """
+        conn = getattr(PFDriveTree.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(PFDriveTree.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            PFDriveTree.local.conn = conn
+        return conn
+
+    ############################################################
+    #
+    # get_state
+    #
+    @staticmethod
+    def get_state(conn, key, default=None):
+        """
+        Get a value saved in the tree database.
+        """
+        row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    ############################################################
+    #
+    # set_state
+    #
+    @staticmethod
+    def set_state(conn, key, value):
+        """
+        Save a value in the tree database.
+        """
+        conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, str(value)))
+
+    ############################################################
+    #
+    # get_folder_settings
+    #
+    @staticmethod
+    def get_folder_settings():
+        """
+        Get the folder settings the tree was crawled for, as a string.
+        """
+        return "%s/%s" % (PFSettings.gdrive_root_folder, PFSettings.gdrive_photos_folder)
+
+    ############################################################
+    #
+    # is_top_folder
+    #
+    @staticmethod
+    def is_top_folder(node, root_id):
+        """
+        Returns whether a node is the gdrive_root_folder the tree starts
+        from.
+        """
+        return node['folder'] and node['parent'] == root_id and \
+                node['title'] == PFSettings.gdrive_root_folder
+
+    ############################################################
+    #
+    # add_nodes
+    #
+    @staticmethod
+    def add_nodes(conn, nodes):
+        """
+        Add or update nodes, marking them with the current crawl id.
+        """
+        rows = []
+        for node in nodes:
+            filename, file_extension = os.path.splitext(node['title'])
+            rows.append((node['id'], node['title'], node['parent'], 1 if node['folder'] else 0,
+                    '' if node['folder'] else file_extension.lower(), node['md5'], node['size'],
+                    PFDriveTree.crawl_id))
+        conn.executemany(
+                "INSERT INTO nodes (id, title, parent, folder, ext, md5, size, crawl_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET title = excluded.title, parent = excluded.parent, "
+                "folder = excluded.folder, ext = excluded.ext, md5 = excluded.md5, "
+                "size = excluded.size, crawl_id = excluded.crawl_id", rows)
+
+    ############################################################
+    #
+    # list_folder
+    #
+    @staticmethod
+    def list_folder(folder_id, results):
+        """
+        List a folder a page at a time onto the results queue, as
+        (folder_id, page), then (folder_id, None).  Runs in the listing
+        threads; an exception is put on the queue in place of a page.
+        """
+        try:
+            for page in PFDriveTree.backend.list_children(folder_id):
+                results.put((folder_id, page))
+            results.put((folder_id, None))
+        except Exception as exc:
+            results.put((folder_id, exc))
+
+    ############################################################
+    #
+    # crawl_folders
+    #
+    @staticmethod
+    def crawl_folders(conn, folders, added, commit=True):
+        """
+        Add everything under some folders to the tree, listing up to
+        gdrive_list_threads folders at once.  Each page is committed as
+        it comes in, so its photos can be read straight away.
+        Inputs:
+            folders: List of (folder id, whether its photos are shown).
+            added: List the (id, title, md5) of each file is appended to.
+            commit: False to leave the pages in the caller's transaction.
+        """
+        results = queue.Queue()
+        wanted = {}
+        pool = ThreadPoolExecutor(max_workers=max(1, PFSettings.gdrive_list_threads))
+
+        def submit(folder_id, folder_wanted):
+            wanted[folder_id] = folder_wanted
+            pool.submit(PFDriveTree.list_folder, folder_id, results)
+
+        try:
+            for folder_id, folder_wanted in folders:
+                submit(folder_id, folder_wanted)
+            while wanted:
+                folder_id, page = results.get()
+                if page is None:
+                    del wanted[folder_id]
+                    continue
+                if isinstance(page, Exception):
+                    raise page
+
+                # Inside a sync the caller commits, with the change token.
+                with conn if commit else contextlib.nullcontext():
+                    PFDriveTree.add_nodes(conn, page)
+                    for child in page:
+                        if child['folder']:
+                            child_wanted = wanted[folder_id] or \
+                                    child['title'] == PFSettings.gdrive_photos_folder
+                            if child_wanted:
+                                conn.execute("INSERT OR IGNORE INTO photo_folders (id) VALUES (?)",
+                                        (child['id'],))
+                            submit(child['id'], child_wanted)
+                        else:
+                            added.append((child['id'], child['title'], child['md5']))
+                            filename, file_extension = os.path.splitext(child['title'])
+                            if PFDriveTree.filling and wanted[folder_id] and \
+                                    file_extension.lower() in PFEnv.supported_types:
+                                PFDriveTree.photo_count = PFDriveTree.photo_count + 1
+                PFDriveTree.crawl_event.set()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    ############################################################
+    #
+    # crawl
+    #
+    @staticmethod
+    def crawl():
+        """
+        Crawl the Drive from scratch.  The change token is taken first,
+        so nothing that changes during the crawl is missed, and saved
+        last, so a crawl that doesn't finish is started again.  The
+        nodes of the tree being replaced are only removed once the crawl
+        has finished.
+        """
+        conn = PFDriveTree.get_conn()
+        start = time.monotonic()
+        crawl_id = int(PFDriveTree.get_state(conn, 'crawl_id', 0)) + 1
+        with conn:
+            PFDriveTree.set_state(conn, 'crawl_id', crawl_id)
+        PFDriveTree.crawl_id = crawl_id
+
+        token = PFDriveTree.backend.get_start_token()
+        root_id = PFDriveTree.backend.get_root_id()
+        old = {}
+        for file_id, title, md5 in conn.execute("SELECT id, title, md5 FROM nodes WHERE NOT folder"):
+            old[file_id] = (title, md5)
+
+        tops = []
+        for page in PFDriveTree.backend.list_children(root_id):
+            tops.extend(node for node in page if PFDriveTree.is_top_folder(node, root_id))
+
+        with conn:
+            PFDriveTree.set_state(conn, 'root_id', root_id)
+            PFDriveTree.add_nodes(conn, tops)
+            for node in tops:
+                if node['title'] == PFSettings.gdrive_photos_folder:
+                    conn.execute("INSERT OR IGNORE INTO photo_folders (id) VALUES (?)",
+                            (node['id'],))
+        if PFDriveTree.filling:
+            PFDriveTree.photo_count = 0
+
+        found = []
+        PFDriveTree.crawl_folders(conn, [(node['id'],
+                node['title'] == PFSettings.gdrive_photos_folder) for node in tops], found)
+        with conn:
+            conn.execute("DELETE FROM nodes WHERE crawl_id < ?", (crawl_id,))
+            PFDriveTree.set_state(conn, 'folders', PFDriveTree.get_folder_settings())
+            PFDriveTree.set_state(conn, 'change_token', token)
+        PFDriveTree.update_photo_folders(conn)
+        PFDriveTree.update_photo_count(conn)
+
+        # A file whose contents changed is both added and removed.
+        new = dict((file_id, md5) for file_id, title, md5 in found)
+        added = [(file_id, title, md5) for file_id, title, md5 in found
+                if file_id not in old or old[file_id][1] != md5]
+        removed = [(file_id, title, md5) for file_id, (title, md5) in old.items()
+                if file_id not in new or new[file_id] != md5]
+        PFDriveTree.on_change(added, removed)
+
+        elapsed = time.monotonic() - start
+        PFEnv.logger.info("Crawled Google Drive: %d files in %.1f seconds" % (len(found), elapsed))
+        PFStats.set_counter("gdrive_crawl", "%d files in %.1f s" % (len(found), elapsed))
+
+    ############################################################
+    #
+    # crawl_main
+    #
+    @staticmethod
+    def crawl_main():
+        """
+        Crawl the Drive in the background.  If the crawl fails, the
+        next one waits CRAWL_RETRY_SECONDS, twice as long after each
+        failure in a row.
+        """
+        PFEnv.setup_logger()
+        try:
+            PFDriveTree.crawl()
+            PFDriveTree.crawl_failures = 0
+        except Exception as exc:
+            PFDriveTree.crawl_failures = PFDriveTree.crawl_failures + 1
+            wait = min(PFDriveTree.CRAWL_RETRY_MAX_SECONDS,
+                    PFDriveTree.CRAWL_RETRY_SECONDS * 2 ** (PFDriveTree.crawl_failures - 1))
+            PFDriveTree.retry_time = time.monotonic() + wait
+            PFEnv.logger.error("Crawling Google Drive failed, trying again in %d seconds: %s" %
+                    (wait, str(exc)))
+        finally:
+            PFDriveTree.crawling = False
+            PFDriveTree.filling = False
+            PFDriveTree.crawl_event.set()
+
+    ############################################################
+    #
+    # start_crawl
+    #
+    @staticmethod
+    def start_crawl():
+        """
+        Start crawling the Drive in the background.
+        """
+        PFDriveTree.crawling = True
+        PFDriveTree.filling = not PFDriveTree.is_complete()
+        PFDriveTree.crawl_event.clear()
+        PFDriveTree.crawler = threading.Thread(target=PFDriveTree.crawl_main,
+                name="picframe_drive_crawl", daemon=True)
+        PFDriveTree.crawler.start()
+
+    ############################################################
+    #
+    # remove_node
+    #
+    @staticmethod
+    def remove_node(conn, node_id, removed):
+        """
+        Remove a node and, if it is a folder, everything under it,
+        appending the (id, title, md5) of each file to removed.
+        """
+        nodes = [node_id]
+        while nodes:
+            node_id = nodes.pop()
+            row = conn.execute("SELECT title, folder, md5 FROM nodes WHERE id = ?",
+                    (node_id,)).fetchone()
+            if row is None:
+                continue
+            title, folder, md5 = row
+            if folder:
+                nodes.extend(child[0] for child in
+                        conn.execute("SELECT id FROM nodes WHERE parent = ?", (node_id,)))
+            else:
+                removed.append((node_id, title, md5))
+            conn.execute("DELETE FROM nodes WHERE id = ?", (node_id,))
+
+    ############################################################
+    #
+    # apply_changes
+    #
+    @staticmethod
+    def apply_changes(conn, changes, root_id):
+        """
+        Apply the changes from Drive to the tree.  Items that aren't in,
+        or that moved out of, the part of the Drive the tree covers are
+        removed; folders that moved into it are crawled.  Nothing is
+        committed, so the caller can commit the changes and the new
+        change token together.
+
+        Returns:
+            (added, removed) lists of (id, title, md5) of files.  A
+            file whose contents changed is in both.
+        """
+        added = []
+        removed = []
+        for node_id, node in changes:
+            old = conn.execute("SELECT title, md5 FROM nodes WHERE id = ?",
+                    (node_id,)).fetchone()
+            in_tree = node is not None and (PFDriveTree.is_top_folder(node, root_id) or
+                    conn.execute("SELECT 1 FROM nodes WHERE id = ? AND folder",
+                    (node['parent'],)).fetchone() is not None)
+            if not in_tree:
+                if old is not None:
+                    PFDriveTree.remove_node(conn, node_id, removed)
+                continue
+
+            PFDriveTree.add_nodes(conn, [node])
+            if node['folder']:
+                if old is None:
+                    PFDriveTree.crawl_folders(conn, [(node_id, False)], added, commit=False)
+            elif old is None or old[1] != node['md5']:
+                if old is not None:
+                    removed.append((node_id, old[0], old[1]))
+                added.append((node_id, node['title'], node['md5']))
+        return added, removed
+
+    ############################################################
+    #
+    # sync
+    #
+    @staticmethod
+    def sync(conn):
+        """
+        Bring the tree up to date with the changes since the stored
+        change token, crawling again if Drive doesn't accept it.
+        """
+        token = PFDriveTree.get_state(conn, 'change_token')
+        result = PFDriveTree.backend.list_changes(token)
+        if result is None:
+            PFEnv.logger.info("Google Drive change token expired, crawling again")
+            PFDriveTree.start_crawl()
+            return
+
+        changes, token = result
+        root_id = PFDriveTree.get_state(conn, 'root_id')
+        with conn:
+            added, removed = PFDriveTree.apply_changes(conn, changes, root_id)
+            PFDriveTree.set_state(conn, 'change_token', token)
+        PFDriveTree.update_photo_folders(conn)
+        PFDriveTree.update_photo_count(conn)
+        if added or removed:
+            PFEnv.logger.info("Google Drive: %d files added, %d removed" %
+                    (len(added), len(removed)))
+            PFDriveTree.on_change(added, removed)
+
+    ############################################################
+    #
+    # update
+    #
+    @staticmethod
+    def update():
+        """
+        Bring the tree up to date with the Drive: start a crawl if it
+        has never been crawled, otherwise apply the changes.  Nothing is
+        done while a crawl is running, or until it is time to try a
+        failed one again.
+        """
+        if PFDriveTree.crawling or time.monotonic() < PFDriveTree.retry_time:
+            return
+        conn = PFDriveTree.get_conn()
+        if PFDriveTree.get_state(conn, 'change_token') is None or \
+                PFDriveTree.get_state(conn, 'folders') != PFDriveTree.get_folder_settings():
+            PFDriveTree.start_crawl()
+        else:
+            PFDriveTree.sync(conn)
+
+    ############################################################
+    #
+    # is_complete
+    #
+    @staticmethod
+    def is_complete():
+        """
+        Returns whether a crawl of the tree has ever finished, so it
+        holds everything and not just what a failed crawl found.
+        """
+        return PFDriveTree.get_state(PFDriveTree.get_conn(), 'change_token') is not None
+
+    ############################################################
+    #
+    # get_retry_wait
+    #
+    @staticmethod
+    def get_retry_wait():
+        """
+        Get the seconds until a failed crawl is tried again, at least
+        one.
+        """
+        return max(1.0, PFDriveTree.retry_time - time.monotonic())
+
+    ############################################################
+    #
+    # update_photo_folders
+    #
+    @staticmethod
+    def update_photo_folders(conn):
+        """
+        Work out which folders' photos are shown: those in a folder
+        named gdrive_photos_folder, or under one, inside the top
+        gdrive_root_folder.
+        """
+        root_id = PFDriveTree.get_state(conn, 'root_id')
+        with conn:
+            conn.execute("DELETE FROM photo_folders")
+            conn.execute(
+                    "INSERT OR IGNORE INTO photo_folders (id) "
+                    "WITH RECURSIVE walk(id, wanted) AS ("
+                    " SELECT id, title = :photos FROM nodes"
+                    "  WHERE parent = :root AND folder AND title = :top"
+                    " UNION ALL"
+                    " SELECT nodes.id, walk.wanted OR nodes.title = :photos"
+                    "  FROM nodes JOIN walk ON nodes.parent = walk.id WHERE nodes.folder)"
+                    "SELECT id FROM walk WHERE wanted",
+                    {'photos': PFSettings.gdrive_photos_folder, 'root': root_id,
+                    'top': PFSettings.gdrive_root_folder})
+
+    ############################################################
+    #
+    # get_photo_condition
+    #
+    @staticmethod
+    def get_photo_condition():
+        """
+        Get the SQL condition for a node being a photo that is shown.
+        """
+        types = ", ".join("'%s'" % (ext,) for ext in PFEnv.supported_types)
+        return "parent IN (SELECT id FROM photo_folders) AND NOT folder AND ext IN (%s)" % \
+                (types,)
+
+    ############################################################
+    #
+    # update_photo_count
+    #
+    @staticmethod
+    def update_photo_count(conn):
+        """
+        Count the photos that are shown.
+        """
+        PFDriveTree.photo_count = conn.execute("SELECT COUNT(*) FROM nodes WHERE %s" %
+                (PFDriveTree.get_photo_condition(),)).fetchone()[0]
+
+    ############################################################
+    #
+    # has_md5
+    #
+    @staticmethod
+    def has_md5(md5):
+        """
+        Returns whether any file in the tree has the given contents.
+        """
+        return PFDriveTree.get_conn().execute("SELECT 1 FROM nodes WHERE md5 = ? LIMIT 1",
+                (md5,)).fetchone() is not None
+
+    ############################################################
+    #
+    # get_photos
+    #
+    @staticmethod
+    def get_photos():
+        """
+        Yield the (id, title, md5) of each photo that is shown, reading them
+        from the tree a batch at a time.  While the first crawl is
+        running, wait for it to find more.
+        """
+        conn = PFDriveTree.get_conn()
+        condition = PFDriveTree.get_photo_condition()
+        last_rowid = 0
+        while True:
+            # Anything the crawl found before it finished is in the read
+            # that follows.
+            filling = PFDriveTree.filling
+            rows = conn.execute(
+                    "SELECT rowid, id, title, md5 FROM nodes WHERE rowid > ? AND %s "
+                    "ORDER BY rowid LIMIT ?" % (condition,),
+                    (last_rowid, PFDriveTree.BATCH_SIZE)).fetchall()
+            if not rows:
+                if not filling:
+                    return
+                PFDriveTree.crawl_event.clear()
+                PFDriveTree.crawl_event.wait(1)
+                continue
+            for rowid, file_id, title, md5 in rows:
+                yield file_id, title, md5
+            last_rowid = rows[-1][0]
+
+    ############################################################
+    #
+    # get_photo
+    #
+    @staticmethod
+    def get_photo(position):
+        """
+        Get the (id, title, md5) of the photo at a position, or None.
+        """
+        row = PFDriveTree.get_conn().execute(
+                "SELECT id, title, md5 FROM nodes WHERE %s ORDER BY rowid LIMIT 1 OFFSET ?" %
+                (PFDriveTree.get_photo_condition(),), (position,)).fetchone()
+        return tuple(row) if row is not None else None
@@ -0,0 +1,107 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_enhance.py
+
+Apply brightness, gamma and a warm night tint to an already sized image.
+All three are folded into one lookup table per color band so the image
+is only passed over once.
+"""
+
+from datetime import datetime
+
+from picframe_settings import PFSettings
+
+
+class PFEnhance:
+    """
+    Build and apply the point operation lookup tables.
+    """
+    luts = {}
+
+    # Don't let the table cache grow without bound while the brightness
+    # is being stepped up and down.
+    MAX_LUTS = 64
+
+    ############################################################
+    #
+    # get_warmth
+    #
+    @staticmethod
+    def get_warmth():
+        """
+        Return the warmth to use right now: PFSettings.night_warmth while
+        in the warmth window, otherwise 0.
+        """
+        if PFSettings.night_warmth <= 0:
+            return 0.0
+
+        hour = datetime.now().hour
+        start = PFSettings.night_warmth_start_hour
+        end = PFSettings.night_warmth_end_hour
+        if start <= end:
+            in_window = start <= hour < end
+        else:
+            in_window = hour >= start or hour < end
+
+        if in_window:
+            return PFSettings.night_warmth
+        return 0.0
+
+    ############################################################
+    #
+    # get_lut
+    #
+    @staticmethod
+    def get_lut(brightness, gamma, warmth):
+        """
+        Get the 768 entry (R, G, B) lookup table for the given values.
+        Inputs:
+            brightness: 1 leaves the image alone, 0 is black.
+            gamma: 1 leaves the image alone, more than 1 lifts the shadows.
+            warmth: 0 leaves the image alone, 1 is the strongest tint.
+        """
+        key = (round(brightness, 3), round(gamma, 3), round(warmth, 3))
+        lut = PFEnhance.luts.get(key)
+        if lut is not None:
+            return lut
+
+        base = [255.0 * ((i / 255.0) ** (1.0 / gamma)) * brightness for i in range(256)]
+
+        # Warmth keeps red and pulls down green a little and blue more.
+        lut = []
+        for scale in (1.0, 1.0 - 0.15 * warmth, 1.0 - 0.45 * warmth):
+            lut.extend(min(255, int(value * scale + 0.5)) for value in base)
+
+        if len(PFEnhance.luts) >= PFEnhance.MAX_LUTS:
+            PFEnhance.luts.clear()
+        PFEnhance.luts[key] = lut
+        return lut
+
+    ############################################################
+    #
+    # apply
+    #
+    @staticmethod
+    def apply(pil_img, brightness):
+        """
+        Apply the brightness, gamma and warmth to a sized image.
+        Returns the image itself if there is nothing to change.
+        """
+        gamma = PFSettings.gamma
+        warmth = PFEnhance.get_warmth()
+        if brightness == 1 and gamma == 1 and warmth == 0:
+            return pil_img
+
+        if pil_img.mode != 'RGB':
+            pil_img = pil_img.convert('RGB')
+        return pil_img.point(PFEnhance.get_lut(brightness, gamma, warmth))
@@ -53,16 +53,16 @@ class PFEnv:
     # Location of image used when the system is in sleep mode.
     black_image = '../images/black.png'
 
+    # Set in the info of the black image shown in place of one that
+    # can't be decoded, so it isn't cached or hashed as that image.
+    PLACEHOLDER = 'picframe_placeholder'
+
     # Format string for hour-minute-second dates
     HMS_FMT_STR = '%Y-%m-%dT%H:%M:%S'
 
     # Location of the log file.  This is set when the logger is initialized
     logfile = None
 
-    # What is the maximum imagefile size that will be allowed.  Too big
-    # have errors or hang.
-    max_image_size = 30000000
-
     ############################################################
     #
     # init_environment
@@ -73,13 +73,23 @@ class PFEnv:
         Initialize the os environment, the screen dimensions, and the
         supported image types.
         """
+        PFEnv.set_supported_types()
+        PFEnv.set_fullscreen_geom()
+
+    ############################################################
+    #
+    # set_supported_types
+    #
+    @staticmethod
+    def set_supported_types():
+        """
+        Set the image file types supported on this platform.
+        """
         if sys.platform in ("linux", "linux2"):
             PFEnv.supported_types = ('.avif', '.heic', '.png', '.tif', '.gif', '.jpg', '.jpeg')
         else:
             PFEnv.supported_types = ('.png', '.jpg', '.tif', '.gif', '.jpeg')
 
-        PFEnv.set_fullscreen_geom()
-
 
     ############################################################
     #
@@ -12,21 +12,31 @@
 """
 picframe_filesystem.py pulls new images from an ordinarily mounted Windows
 or linux filesystem.
+
+Implements PFImageSource.  With use_catalog the images come from
+PFCatalog; otherwise the image paths are walked on every pass.
 """
-import os
+import itertools
 
-from pathlib import Path
 from picframe_settings import PFSettings
 from picframe_env import PFEnv
 from picframe_env import NoImagesFoundException
 from picframe_message import PFMessage
-
-class PFFilesystem:
+from picframe_catalog import PFCatalog
+from picframe_walker import PFWalker
+from picframe_watcher import PFWatcher
+from picframe_hasher import PFHasher
+from picframe_metadata import PFMetadata
+from picframe_playlist import PFPlaylist
+from picframe_image_source import PFImageSource
+
+class PFFilesystem(PFImageSource):
     """
     If the user's photos are on the local filesystem, this class gets
     them.
     """
     initialized = False
+    image_file_count = 0
 
     ############################################################
     #
@@ -38,6 +48,14 @@ class PFFilesystem:
         Initialize static class variables.
         """
 
+        if PFSettings.use_catalog:
+            PFCatalog.init()
+            if PFSettings.watch_image_paths:
+                PFWatcher.init()
+            if PFSettings.hash_images:
+                PFHasher.init()
+            if PFSettings.extract_metadata and PFSettings.metadata_processes > 0:
+                PFMetadata.init()
         PFFilesystem.initialized = True
 
     ############################################################
@@ -74,59 +92,70 @@ class PFFilesystem:
                 format for the operating system and image source.
         """
 
+        if PFCatalog.initialized:
+            if PFSettings.playlist:
+                yield from PFPlaylist.get_next_file()
+            else:
+                yield from PFCatalog.get_next_file()
+            return
+
         # Traverse the recursive list of directories.
         PFEnv.logger.debug("Entering get_next_file()")
         while True:
             image_file_count = 0
-            for dirname in PFFilesystem.get_image_dirs():
-                if Path(dirname).is_file():
-                    if PFEnv.is_format_supported(dirname):
-                        image_file_count = image_file_count + 1
-                        PFEnv.logger.debug("Exiting get_next_file: %s" % (dirname,))
-                        yield dirname
-                else:
-                    for root, dirs, files in os.walk(dirname):
-                        path = root.split(os.sep)
-                        for file in files:
-                            pathdir = '/'.join(path) + '/' + file
-                            if PFEnv.is_format_supported(pathdir):
-                                image_file_count = image_file_count + 1
-                                PFEnv.logger.debug("Exiting get_next_file: %s" % (pathdir,))
-                                yield pathdir
+            for entry in PFWalker.walk_roots(PFFilesystem.get_image_dirs()):
+                image_file_count = image_file_count + 1
+                yield entry.path
             if image_file_count == 0:
                 PFEnv.logger.error(f"No images found in {PFFilesystem.get_image_dirs()}, quitting")
 
                 raise NoImagesFoundException()
+            PFFilesystem.image_file_count = image_file_count
 
 
     ############################################################
     #
-    # get_file_list
+    # get_count
     #
     @staticmethod
-    def get_file_list():
+    def get_count():
         """
-        Get the list of supported image files from the list of filesystem
-        directories given for pictures to display.
-
-        Inputs: None
+        Get the number of images.  Without the catalog, this is how many
+        the last full pass over the image paths found.
+        """
+        if PFCatalog.initialized:
+            return PFCatalog.get_count()
+        return PFFilesystem.image_file_count
 
-        Returns: List of fully qualified paths in the right
-                format for the operating system and image source.
+    ############################################################
+    #
+    # get_file
+    #
+    @staticmethod
+    def get_file(position):
+        """
+        Get the image at a position of the catalog order.  Without the
+        catalog, the image paths are walked up to the position.
         """
-        image_file_list = []
+        if PFCatalog.initialized:
+            return PFCatalog.get_file(position)
 
-        # Traverse the recursive list of directories.
-        for dirname in PFFilesystem.get_image_dirs():
-            if Path(dirname).is_file():
-                if PFEnv.is_format_supported(dirname):
-                    image_file_list.append(dirname)
-            else:
-                for root, dirs, files in os.walk(dirname):
-                    path = root.split(os.sep)
-                    for file in files:
-                        pathdir = '/'.join(path) + '/' + file
-                        if PFEnv.is_format_supported(pathdir):
-                            image_file_list.append(pathdir)
-
-        return image_file_list
+        entries = PFWalker.walk_roots(PFFilesystem.get_image_dirs(), report=False)
+        try:
+            for entry in itertools.islice(entries, position, None):
+                return entry.path
+        finally:
+            entries.close()
+        return None
+
+    ############################################################
+    #
+    # get_changes
+    #
+    @staticmethod
+    def get_changes(token):
+        """
+        Get the images added and removed since the token.  Without the
+        catalog nothing is watched, so there are never any.
+        """
+        return PFCatalog.changes.get_changes(token)
@@ -16,25 +16,32 @@ This file implements the code necessary to pull files from google drive.
 It uses a generator so only one file (rather than all at once) can be
 pulled.
 
+Implements PFImageSource.  The folder tree is kept locally by
+PFDriveTree and brought up to date from Drive's changes at the start of
+each pass, so a pass doesn't list the Drive again.
 """
 
+import time
 from pydrive2.auth import GoogleAuth
 from pydrive2.drive import GoogleDrive
 from picframe_settings import PFSettings
 from picframe_env import PFEnv, NoImagesFoundException
 from picframe_message import PFMessage
+from picframe_image_source import PFImageSource, PFChangeLog
+from picframe_drive_backend import PFPyDrive2Backend, PFFakeDriveBackend
+from picframe_drive_tree import PFDriveTree
+from picframe_drive_cache import PFDriveCache
 
 
-class PFGoogleDrive:
+class PFGoogleDrive(PFImageSource):
     """
     If the user's photos are on google drive, this class finds them,
     downloads them, and makes them available.
     """
     initialized = False
     drive = None
-    full_id_list_style = False
-    id_list = []
-    image_file_count = 0
+    backend = None
+    changes = PFChangeLog()
 
     ############################################################
     #
@@ -47,7 +54,14 @@ class PFGoogleDrive:
         """
 
         if not PFGoogleDrive.initialized:
-            PFGoogleDrive.drive = PFGoogleDrive.gdrive_authorize()
+            if PFSettings.gdrive_fake_root:
+                PFGoogleDrive.backend = PFFakeDriveBackend(
+                        PFEnv.path_to_platform(PFSettings.gdrive_fake_root))
+            else:
+                PFGoogleDrive.drive = PFGoogleDrive.gdrive_authorize()
+                PFGoogleDrive.backend = PFPyDrive2Backend(PFGoogleDrive.drive)
+            PFDriveTree.init(PFGoogleDrive.backend, PFGoogleDrive.record_changes)
+            PFDriveCache.init(PFGoogleDrive.backend)
 
         PFGoogleDrive.initialized = True
 
@@ -81,95 +95,85 @@ class PFGoogleDrive:
         drive = GoogleDrive(gauth)
         return drive
 
-
-
     ############################################################
     #
-    # get_children
+    # record_changes
     #
     @staticmethod
-    def get_children(parent_id):
+    def record_changes(added, removed):
         """
-        Get the list of children from a parent node.
-        Inputs:
-            parent_id: The parent folder to look at to get the children.
-
-        Returns:
-            List of children.
+        Note the files added to and removed from the folder tree.  The
+        photos are known by their contents, so a removed file whose
+        contents are still in the tree isn't noted.
         """
-
-        c_str = "\'" + parent_id + "\'" + " in parents and trashed=false"
-        children = PFGoogleDrive.drive.ListFile({'q': c_str}).GetList()
-        return children
+        PFGoogleDrive.changes.record(
+                [PFDriveCache.get_path(file_id, title, md5) for file_id, title, md5 in added],
+                [path for file_id, title, md5 in removed
+                if md5 is None or not PFDriveTree.has_md5(md5)
+                for path in PFDriveCache.get_paths(file_id, title, md5)])
 
     ############################################################
     #
-    # process_children
+    # get_next_file
     #
     @staticmethod
-    def process_children(in_desired_folder, parent_name, parent_id):
+    def get_next_file():
         """
-        Recursively walk the directory hierarchy to get the next photo
-        Use a generator (yield and yield from) to return files as they
-        are found, otherwise very large google drives will be way too
-        slow and unwieldy.
+        Get the photos from a google drive folder hierarchy, over and
+        over.
         """
-        children = PFGoogleDrive.get_children(parent_id)
-
-        # If there are no children, then at a leaf, so see if it should
-        # be added to the list
-        if len(children) <= 0:
-            if PFEnv.is_format_supported(parent_name) and in_desired_folder:
-                PFEnv.logger.debug("Returning %s" % (parent_name,))
-                if PFGoogleDrive.full_id_list_style:
-                    PFGoogleDrive.id_list.append(parent_name)
-                else:
-                    # Here download the file and put it into the right
-                    # location as stored in PFEnv (/tmp/ for linux,
-                    # C:\temp for windows, then return the full path.
-                    filepath = PFEnv.default_temp_file_path() + parent_name
-                    new_file = PFGoogleDrive.drive.CreateFile({'id': parent_id})
-                    new_file.GetContentFile(filepath)
-                    PFGoogleDrive.image_file_count = PFGoogleDrive.image_file_count + 1
-                    yield filepath
-
-
-        # Otherwise go through the list of subdirectories of this directory
-        for child in children:
-            child_name = child['title']
-            child_id = child['id']
-            PFEnv.logger.debug('title: %s, id: %s' % (child_name, child_id))
-
-            if child_name == PFSettings.gdrive_photos_folder or in_desired_folder:
-                yield from PFGoogleDrive.process_children(True, child_name, child_id)
-            else:
-                yield from PFGoogleDrive.process_children(False, child_name, child_id)
+        while True:
+            PFDriveTree.update()
+            image_file_count = 0
+            for filepath in PFDriveCache.get_ahead(PFDriveTree.get_photos()):
+                PFEnv.logger.debug("Returning %s" % (filepath,))
+                image_file_count = image_file_count + 1
+                yield filepath
+
+            if image_file_count == 0:
+                if not PFDriveTree.is_complete():
+                    # The crawl failed before it found any photos, so
+                    # wait for it to be tried again.
+                    time.sleep(PFDriveTree.get_retry_wait())
+                    continue
+                PFEnv.logger.error("No images found in Google Drive folder '%s', quitting" %
+                        (PFSettings.gdrive_photos_folder,))
 
+                raise NoImagesFoundException()
 
     ############################################################
     #
-    # get_next_photo
+    # get_count
     #
     @staticmethod
-    def get_next_photo():
+    def get_count():
         """
-        Get the list of photos from a google drive folder hierarchy.
+        Get the number of photos in the folder tree.
         """
+        return PFDriveTree.photo_count
 
-        in_desired_folder = False
-
-        # List files in Google Drive
-        while True:
-            PFGoogleDrive.image_file_count = 0
-            file_list = PFGoogleDrive.drive.ListFile({'q': "'root' in parents and trashed=false"}).GetList()
-            for file in file_list:
-                title = file['title']
-                file_id = file['id']
-                if title == PFSettings.gdrive_root_folder:
-                    if title == PFSettings.gdrive_photos_folder:
-                        in_desired_folder = True
-                    yield from PFGoogleDrive.process_children(in_desired_folder, title, file_id)
-            if PFGoogleDrive.image_file_count == 0:
-                PFEnv.logger.error(f"No images found in {file_list}, quitting")
+    ############################################################
+    #
+    # get_file
+    #
+    @staticmethod
+    def get_file(position):
+        """
+        Download the photo at a position of the folder tree.
+        """
+        photo = PFDriveTree.get_photo(position)
+        if photo is None:
+            return None
+        file_id, title, md5 = photo
+        return PFDriveCache.get(file_id, title, md5)
 
-                raise NoImagesFoundException()
+    ############################################################
+    #
+    # get_changes
+    #
+    @staticmethod
+    def get_changes(token):
+        """
+        Get the photos added to and removed from the folder tree.
+        """
+        return PFGoogleDrive.changes.get_changes(token)
@@ -0,0 +1,259 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_hasher.py
+
+Find copies of the same photo in different places (a phone backup, an
+export, an edited folder) so the slideshow shows it only once.
+
+A background thread gives every catalogued file a content hash.  To be
+quick on large files and network mounts it doesn't read the whole file:
+it hashes the size and three 64KB samples from the start, middle and end
+of the file, which is plenty to tell photos apart.  The thread runs at
+the lowest CPU priority, which on linux also lowers its I/O priority,
+and reads at most hash_read_rate bytes a second.
+
+With perceptual_hash, each image also gets a 64 bit difference hash of
+its screen-sized rendition when it is first shown, so the same photo
+saved at a different size or quality is also found.  Resaving can flip
+a few bits of the hash, so a hash within PHASH_DISTANCE bits of one
+already in the catalog is saved as that one, and equal hashes in the
+catalog mean similar images.
+
+The hashes are kept in the catalog and cleared when a file's size or
+mtime changes, so each version of a file is hashed once.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from PIL import Image
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_catalog import PFCatalog
+from picframe_stats import PFStats
+
+
+class PFHasher:
+    """
+    Background content hashing for duplicate detection.
+    """
+    initialized = False
+    hasher = None
+    hashed = 0
+
+    # Size of each sample of the file that is hashed.
+    SAMPLE_BYTES = 64 * 1024
+
+    # How long to wait before looking for unhashed files again.
+    IDLE_SECONDS = 60
+
+    # How many bits two perceptual hashes can differ by and still be
+    # taken as the same photo.
+    PHASH_DISTANCE = 4
+
+    ############################################################
+    #
+    # init
+    #
+    @staticmethod
+    def init():
+        """
+        Start the hashing thread.
+        """
+        PFHasher.initialized = True
+        PFHasher.hasher = threading.Thread(target=PFHasher.hash_main,
+                name="picframe_hasher", daemon=True)
+        PFHasher.hasher.start()
+
+    ############################################################
+    #
+    # get_content_hash
+    #
+    @staticmethod
+    def get_content_hash(path, size):
+        """
+        Get the content hash of a file, a hex string.  Files up to three
+        samples long are hashed whole.
+
+        Returns:
+            (hash, bytes read)
+        """
+        digest = hashlib.blake2b(b"%d:" % (size,), digest_size=16)
+        sample = PFHasher.SAMPLE_BYTES
+        read = 0
+        with open(path, 'rb') as image_file:
+            if size <= 3 * sample:
+                data = image_file.read()
+                digest.update(data)
+                read = len(data)
+            else:
+                for offset in (0, (size - sample) // 2, size - sample):
+                    image_file.seek(offset)
+                    data = image_file.read(sample)
+                    digest.update(data)
+                    read = read + len(data)
+        return digest.hexdigest(), read
+
+    ############################################################
+    #
+    # get_perceptual_hash
+    #
+    @staticmethod
+    def get_perceptual_hash(pil_img):
+        """
+        Get the difference hash of an image, a hex string: one bit for
+        each pair of horizontally adjacent pixels of a 9x8 grey copy,
+        set where the left is brighter.
+        """
+        small = pil_img.convert('L').resize((9, 8), Image.BILINEAR)
+        pixels = list(small.getdata())
+        value = 0
+        for row in range(8):
+            for col in range(8):
+                left = pixels[row * 9 + col]
+                right = pixels[row * 9 + col + 1]
+                value = (value << 1) | (1 if left > right else 0)
+        return "%016x" % (value,)
+
+    ############################################################
+    #
+    # find_similar_hash
+    #
+    @staticmethod
+    def find_similar_hash(conn, phash):
+        """
+        Get the perceptual hash in the catalog closest to phash, if it
+        is within PHASH_DISTANCE bits, else phash itself.
+        """
+        value = int(phash, 16)
+        best = phash
+        best_distance = PFHasher.PHASH_DISTANCE + 1
+        for (other,) in conn.execute("SELECT DISTINCT phash FROM files WHERE phash IS NOT NULL"):
+            distance = bin(value ^ int(other, 16)).count('1')
+            if distance < best_distance:
+                best = other
+                best_distance = distance
+                if distance == 0:
+                    break
+        return best
+
+    ############################################################
+    #
+    # add_perceptual_hash
+    #
+    @staticmethod
+    def add_perceptual_hash(image_file, stat, pil_img):
+        """
+        Save the perceptual hash of a rendition, if perceptual hashing
+        is on and the file doesn't have one yet.
+        """
+        if not PFSettings.perceptual_hash:
+            return
+        conn = PFCatalog.get_conn()
+        try:
+            row = conn.execute("SELECT phash FROM files WHERE path = ? AND size = ? AND mtime = ?",
+                    (image_file, stat.st_size, stat.st_mtime_ns)).fetchone()
+            if row is None or row[0] is not None:
+                return
+            phash = PFHasher.find_similar_hash(conn, PFHasher.get_perceptual_hash(pil_img))
+            with conn:
+                conn.execute("UPDATE files SET phash = ? WHERE path = ? AND size = ? AND mtime = ?",
+                        (phash, image_file, stat.st_size, stat.st_mtime_ns))
+        except sqlite3.Error as exc:
+            PFEnv.logger.warning("Could not save perceptual hash of %s: %s" % (image_file, str(exc)))
+
+    ############################################################
+    #
+    # set_low_priority
+    #
+    @staticmethod
+    def set_low_priority():
+        """
+        Lower this thread's CPU priority, and with it (with linux's CFQ
+        and BFQ I/O schedulers) its I/O priority.
+        """
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError) as exc:
+            PFEnv.logger.debug("Could not lower hashing priority: %s" % (str(exc),))
+
+    ############################################################
+    #
+    # hash_batch
+    #
+    @staticmethod
+    def hash_batch(conn, last_id):
+        """
+        Hash the next batch of files that don't have a hash.  A file that
+        changed while it was hashed is left for the next time around.
+
+        Returns:
+            The id of the last file in the batch, or None if there are no
+            more.
+        """
+        rows = conn.execute(
+                "SELECT id, path, size, mtime FROM files WHERE hash IS NULL AND id > ? "
+                "ORDER BY id LIMIT ?", (last_id, PFCatalog.BATCH_SIZE)).fetchall()
+        if not rows:
+            return None
+
+        for file_id, path, size, mtime in rows:
+            start = time.monotonic()
+            try:
+                content_hash, read = PFHasher.get_content_hash(path, size)
+            except OSError as exc:
+                PFEnv.logger.debug("Could not hash %s: %s" % (path, str(exc)))
+                continue
+
+            with conn:
+                conn.execute("UPDATE files SET hash = ? WHERE id = ? AND size = ? AND mtime = ?",
+                        (content_hash, file_id, size, mtime))
+            PFHasher.hashed = PFHasher.hashed + 1
+
+            # Keep to hash_read_rate.
+            wait = read / PFSettings.hash_read_rate - (time.monotonic() - start)
+            if wait > 0:
+                time.sleep(wait)
+
+        PFStats.set_counter("hashed_files", PFHasher.hashed)
+        return rows[-1][0]
+
+    ############################################################
+    #
+    # hash_main
+    #
+    @staticmethod
+    def hash_main():
+        """
+        Hash files as they are catalogued.
+        """
+        PFEnv.setup_logger()
+        PFHasher.set_low_priority()
+        conn = PFCatalog.get_conn()
+        while True:
+            generation = PFCatalog.get_scan_generation()
+            last_id = 0
+            try:
+                while last_id is not None:
+                    last_id = PFHasher.hash_batch(conn, last_id)
+                duplicates = conn.execute("SELECT COUNT(*) FROM files WHERE NOT %s" %
+                        (PFCatalog.get_unique_condition(),)).fetchone()[0]
+                PFStats.set_counter("duplicate_files", duplicates)
+                PFCatalog.update_count(conn)
+            except sqlite3.Error as exc:
+                PFEnv.logger.error("Hashing failed: %s" % (str(exc),))
+
+            PFCatalog.wait_for_scan(generation, PFHasher.IDLE_SECONDS)
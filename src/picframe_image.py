@@ -21,13 +21,24 @@ import sys
 import os
 from datetime import datetime
 from tkinter import NW
-from PIL import ImageTk, Image, ImageOps, ImageEnhance
+from PIL import ImageTk, Image, ImageOps
 
 from picframe_settings import PFSettings
 from picframe_env import PFEnv, NoImagesFoundException
 from picframe_gdrive import PFGoogleDrive
 from picframe_filesystem import PFFilesystem
 from picframe_canvas import PFCanvas
+from picframe_prefetch import PFPrefetch
+from picframe_image_cache import PFImageCache
+from picframe_disk_cache import PFDiskCache
+from picframe_enhance import PFEnhance
+from picframe_decoder import PFDecoder
+from picframe_admission import PFAdmission
+from picframe_resample import PFResample
+from picframe_stats import PFStats
+from picframe_hasher import PFHasher
+from picframe_staging import PFStaging
+from picframe_drive_cache import PFDriveCache
 
 if sys.platform in ("linux", "linux2"):
     import pyheif
@@ -38,14 +49,20 @@ class PFImage:
     Get, load, and display images.
     """
 
+    image_source = None
+    change_token = None
     image_file_gen = None
     current_image = None
     previous_image = None
     image_id = None
     displayed_img = None
+    displayed_pil_img = None
     brightness = 1
     text = None
 
+    # The file types decode_image_local() knows how to decode.
+    DECODE_TYPES = ('.jpeg', '.tif', '.gif', '.jpg', '.png', '.heic', '.avif')
+
     ############################################################
     #
     # init
@@ -60,13 +77,24 @@ class PFImage:
 
         # Initialize the data source
         if PFSettings.image_source == "Filesystem":
-            PFFilesystem.init()
+            PFImage.image_source = PFFilesystem
         elif PFSettings.image_source == "Google Drive":
-            PFGoogleDrive.init()
+            PFImage.image_source = PFGoogleDrive
         else:
             raise Exception(f"Image source from settings file: '{PFSettings.image_source}' is not supported.")
+        PFImage.image_source.init()
+        PFImage.change_token, added, removed = PFImage.image_source.get_changes(None)
+
+        if PFSettings.use_rendition_cache:
+            PFDiskCache.init()
+        if PFSettings.decoder_processes > 0:
+            PFDecoder.init(PFImage.decode_image_local)
 
-        PFImage.image_file_gen = PFImage.get_next_image_file()
+        PFImage.image_file_gen = PFImage.image_source.get_next_file()
+        if PFSettings.image_source == "Filesystem" and PFSettings.staging_files > 0:
+            PFImage.image_file_gen = PFStaging.init(PFImage.image_file_gen)
+        if PFSettings.prefetch_depth > 0:
+            PFPrefetch.init(PFImage.image_file_gen, PFImage.load_image)
 
     ############################################################
     #
@@ -85,26 +113,36 @@ class PFImage:
 
     ############################################################
     #
-    # get_image_file_list
+    # get_stats_str
     #
     @staticmethod
-    def get_image_file_list():
+    def get_stats_str():
         """
-        Get the list of supported image files from the list of directories
-        given for pictures to display.
-
-        Inputs: None
-
-        Returns: List of fully qualified paths in the right
-                format for the operating system and image source.
+        Get a string of the image pipeline statistics for the details
+        screen.
         """
+        return PFStats.get_stats_str() + \
+            PFImageCache.get_stats_str() + \
+            PFDiskCache.get_stats_str() + \
+            PFStaging.get_stats_str() + \
+            PFDriveCache.get_stats_str() + \
+            PFDecoder.get_stats_str() + \
+            PFAdmission.get_stats_str() + \
+            PFResample.get_stats_str()
 
-        if PFSettings.image_source == "Filesystem":
-            pfilesystem = PFFilesystem()
-            return pfilesystem.get_file_list()
-        else:
-            gdrive = PFGoogleDrive()
-            return gdrive.id_list
+    ############################################################
+    #
+    # get_removed_files
+    #
+    @staticmethod
+    def get_removed_files():
+        """
+        Get the set of image files the source has removed since the last
+        call.
+        """
+        PFImage.change_token, added, removed = \
+                PFImage.image_source.get_changes(PFImage.change_token)
+        return set(removed or ())
 
     ############################################################
     #
@@ -113,110 +151,318 @@ class PFImage:
     @staticmethod
     def adjust_brightness(direction):
         """
-        Adjust the brightness of the displayed image.
+        Adjust the brightness of the displayed image.  The image on the
+        screen is redrawn from the sized image already in memory.
+        Inputs:
+            direction: 'up', 'down' or 'default'
         """
 
-        if direction == 'down':
+        if direction == 'default':
+            PFImage.brightness = 1
+        elif direction == 'down':
             if PFImage.brightness > 0.1:
                 PFImage.brightness = PFImage.brightness - 0.05
         else:
             if PFImage.brightness < 2.0:
                 PFImage.brightness = PFImage.brightness + 0.05
 
-        PFImage.display_current_image()
+        if PFImage.displayed_pil_img is None:
+            PFImage.display_current_image()
+        else:
+            PFImage.display_pil_image(PFImage.displayed_pil_img)
 
     ############################################################
     #
-    # get_next_image_file
+    # get_image
     #
     @staticmethod
-    def get_next_image_file():
+    def get_image(image_file):
         """
-        Get the next supported image files from the list of directories
-        given for pictures to display.
+        Get the image from an image file, converting whatever needs to be
+        converted to get it into PhotoImage format.  Often need to convert formats
+        using the PIL library
+            - JPG to PNG
 
-        Inputs: None
+        Inputs:
+            image_file: The image
 
-        Returns: List of fully qualified paths in the right
-                format for the operating system and image source.
+        Returns:
+            img
         """
 
-        if PFSettings.image_source == "Filesystem":
-            yield from PFFilesystem.get_next_file()
+        pil_img = PFImage.load_image(image_file, PFCanvas.width, PFCanvas.height)
+        return PFImage.get_photo_image(pil_img)
+
+    ############################################################
+    #
+    # load_image
+    #
+    @staticmethod
+    def load_image(image_file, width, height):
+        """
+        Read an image file, orient it, and size it to fit in width x height.
+        This does not touch tkinter so it is safe to call from the
+        prefetch thread.
+
+        Inputs:
+            image_file: The image
+            width, height: The size of the area to fit the image into.
+
+        Returns:
+            The sized PIL image
+        """
+
+        staged = None
+        if PFStaging.initialized:
+            staged = PFStaging.get(image_file)
+        if staged is not None:
+            # The original was stat'ed when it was staged.
+            source_file, stat = staged
+            PFStats.set('staged', True)
+        else:
+            source_file = image_file
+            with PFStats.stage('stat'):
+                stat = os.stat(image_file)
+        PFStats.set('bytes', stat.st_size)
+
+        key = PFImageCache.get_key(image_file, width, height, stat)
+        pil_img = PFImageCache.get(key)
+        if pil_img is not None:
+            PFStats.set('cache', 'memory')
+            return pil_img
+
+        if PFDiskCache.initialized:
+            with PFStats.stage('rendition_read'):
+                pil_img = PFDiskCache.get(image_file, stat, width, height)
+        if pil_img is not None:
+            PFStats.set('cache', 'disk')
         else:
-            yield from PFGoogleDrive.get_next_photo()
+            PFStats.set('cache', 'miss')
+            if PFStaging.initialized:
+                PFStaging.count_read(staged is not None)
+            try:
+                pil_img = PFImage.decode_image(source_file, width, height, stat)
+            except OSError:
+                # A showing of the same file that wasn't counted when it
+                # was staged can release the copy early.
+                if staged is None or os.path.exists(source_file):
+                    raise
+                pil_img = PFImage.decode_image(image_file, width, height, stat)
+            # The black image isn't kept or hashed as this file.
+            if pil_img.info.get(PFEnv.PLACEHOLDER) or \
+                    image_file == PFEnv.get_black_image():
+                return pil_img
+            if PFDiskCache.initialized:
+                with PFStats.stage('rendition_write'):
+                    PFDiskCache.put(image_file, stat, width, height, pil_img)
+        PFImageCache.put(key, pil_img)
+        if PFHasher.initialized:
+            PFHasher.add_perceptual_hash(image_file, stat, pil_img)
+
+        return pil_img
 
     ############################################################
     #
-    # get_image
+    # decode_image
     #
     @staticmethod
-    def get_image(image_file):
+    def decode_image(image_file, width, height, stat):
         """
-        Get the image from an image file, converting whatever needs to be
-        converted to get it into PhotoImage format.  Often need to convert formats
-        using the PIL library
-            - JPG to PNG
+        Decode an image file, orient it, and size it to fit in
+        width x height, in a decoder process if the format is set up to
+        be decoded in isolation.
 
         Inputs:
             image_file: The image
+            width, height: The size of the area to fit the image into.
+            stat: The os.stat of the image file.
 
         Returns:
-            img
+            The sized PIL image
+        """
+        filename, file_extension = os.path.splitext(image_file)
+        if PFDecoder.is_isolated(file_extension):
+            with PFStats.stage('decode'):
+                return PFDecoder.decode(image_file, width, height, stat)
+
+        return PFImage.decode_image_local(image_file, width, height, stat)
+
+    ############################################################
+    #
+    # decode_image_local
+    #
+    @staticmethod
+    def decode_image_local(image_file, width, height, stat):
+        """
+        Decode an image file, orient it, and size it to fit in
+        width x height, in this process.
+
+        Inputs:
+            image_file: The image
+            width, height: The size of the area to fit the image into.
+            stat: The os.stat of the image file.
+
+        Returns:
+            The sized PIL image
         """
 
         # Need PIL library to handle JPG files.
 
         filename, file_extension = os.path.splitext(image_file)
-        img = None
 
-        filesize = os.path.getsize(image_file)
-        if filesize > PFEnv.max_image_size:
+        # Check from the header that the decoded image will fit in
+        # memory, and whether it needs to be decoded at a reduced size.
+        decode_scale = 1
+        drafted = False
+        placeholder = False
+        if file_extension.lower() in PFImage.DECODE_TYPES:
+            with PFStats.stage('header'):
+                decode_scale = PFAdmission.get_decode_scale(image_file, stat, file_extension)
+
+        if decode_scale is None:
             pil_img = Image.open(PFEnv.get_black_image())
-            PFEnv.logger.warning("'%s' Image file size too large." % (image_file,))
+            placeholder = True
+            PFEnv.logger.warning("'%s' Image too large to decode." % (image_file,))
 
         elif file_extension.lower() in ('.jpeg', '.tif', '.gif', '.jpg', '.png'):
-            pil_img = Image.open(image_file)
+            with PFStats.stage('open'):
+                pil_img = Image.open(image_file)
+                source_size = pil_img.size
+                PFStats.set('source_size', list(source_size))
+                if PFSettings.reduced_decode or decode_scale > 1:
+                    PFImage.set_draft(pil_img, width, height, decode_scale)
+            with PFStats.stage('decode'):
+                pil_img.load()
+            drafted = pil_img.size != source_size
 
             # Use the exif information to properly orient the image.
-            pil_img = ImageOps.exif_transpose(pil_img)
+            with PFStats.stage('transpose'):
+                pil_img = ImageOps.exif_transpose(pil_img)
 
 
         elif file_extension.lower() in ('.heic', '.avif'):
             if sys.platform not in ("linux", "linux2"):
                 raise TypeError("HEIC files are not supported on Windows.")
 
-            heif_img = pyheif.read_heif(image_file)
-            pil_img = Image.frombytes(
-                heif_img.mode, heif_img.size, heif_img.data,
-                "raw", heif_img.mode, heif_img.stride,)
+            with PFStats.stage('decode'):
+                heif_img = pyheif.read_heif(image_file)
+                pil_img = Image.frombytes(
+                    heif_img.mode, heif_img.size, heif_img.data,
+                    "raw", heif_img.mode, heif_img.stride,)
+            PFStats.set('source_size', list(pil_img.size))
 
         else:
             pil_img = Image.open(PFEnv.get_black_image())
+            placeholder = True
             PFEnv.logger.warning("'%s' Unexpected error in get_image(). Format is not supported." % (image_file,))
 
+        with PFStats.stage('resize'):
+            pil_img = PFImage.resize_image(pil_img, width, height, drafted=drafted)
+        if placeholder:
+            pil_img.info[PFEnv.PLACEHOLDER] = True
+        return pil_img
+
+    ############################################################
+    #
+    # resize_image
+    #
+    @staticmethod
+    def resize_image(pil_img, width, height, profile=None, drafted=False):
+        """
+        Resize a decoded, oriented image to fit in width x height.
+        Inputs:
+            profile: The resampling profile, defaults to
+                PFSettings.resample_profile.
+            drafted: The image was already reduced while decoding.
+        """
+        actual_width, actual_height = PFImage.fit_size(pil_img.width, pil_img.height, width, height)
+        return PFResample.resize(pil_img, (actual_width, actual_height), profile, drafted)
+
+    ############################################################
+    #
+    # fit_size
+    #
+    @staticmethod
+    def fit_size(image_width, image_height, width, height):
+        """
+        Calculate the size to scale an image to so that it fills as much
+        of width x height as possible while keeping its proportions.
+
+        Returns:
+            (actual_width, actual_height)
+        """
         # Calculate the image width/height ratio and use it
         # based on the width of the screen
-        height_ratio = PFCanvas.height/pil_img.height
-        width_ratio = PFCanvas.width/pil_img.width
+        height_ratio = height/image_height
+        width_ratio = width/image_width
 
         actual_width = None
         actual_height = None
         if height_ratio > width_ratio:
-            actual_height = int(width_ratio * pil_img.height)
-            actual_width = int(width_ratio * pil_img.width)
+            actual_height = int(width_ratio * image_height)
+            actual_width = int(width_ratio * image_width)
         else:
-            actual_height = int(height_ratio * pil_img.height)
-            actual_width = int(height_ratio * pil_img.width)
+            actual_height = int(height_ratio * image_height)
+            actual_width = int(height_ratio * image_width)
 
-        pil_img = pil_img.resize((actual_width, actual_height), Image.ANTIALIAS)
-        if PFImage.brightness != 1:
-            pil_img = pil_img.convert('RGB')
-            abx()
-            enhancer = ImageEnhance.Brightness(pil_img)
-            pil_img = enhancer.enhance(PFImage.brightness)
+        return max(actual_width, 1), max(actual_height, 1)
 
-        img = ImageTk.PhotoImage(pil_img)
+    ############################################################
+    #
+    # set_draft
+    #
+    @staticmethod
+    def set_draft(pil_img, width, height, decode_scale=1):
+        """
+        Ask the JPEG decoder to decode at the smallest DCT scale (1/2, 1/4
+        or 1/8) that is still at least as large as the image will be when
+        it is sized to fit width x height.  This has to be called before
+        the image is loaded.
+        Inputs:
+            pil_img: The just-opened, not yet loaded image.
+            width, height: The size of the area the image will be fit into.
+            decode_scale: Reduce by at least this factor, whatever the
+                size it will be fit into, to stay in the memory budget.
+        """
+        if pil_img.format != 'JPEG':
+            return
+
+        image_width, image_height = pil_img.size
+        if PFSettings.reduced_decode:
+            # The draft size is in the stored orientation, which for
+            # orientations 5 through 8 is rotated relative to the screen.
+            orientation = pil_img.getexif().get(0x0112, 1)
+            if orientation in (5, 6, 7, 8):
+                width, height = height, width
+            draft_width, draft_height = PFImage.fit_size(image_width, image_height, width, height)
+        else:
+            draft_width, draft_height = image_width, image_height
+
+        draft_width = min(draft_width, image_width // decode_scale)
+        draft_height = min(draft_height, image_height // decode_scale)
+        pil_img.draft(pil_img.mode, (draft_width, draft_height))
+
+    ############################################################
+    #
+    # get_photo_image
+    #
+    @staticmethod
+    def get_photo_image(pil_img):
+        """
+        Apply the current brightness, gamma and warmth to a sized PIL
+        image and turn it into a PhotoImage.  This must run on the tkinter thread.
+
+        Inputs:
+            pil_img: The sized PIL image
+
+        Returns:
+            img
+        """
+
+        with PFStats.stage('enhance'):
+            pil_img = PFEnhance.apply(pil_img, PFImage.brightness)
+        with PFStats.stage('photoimage'):
+            img = ImageTk.PhotoImage(pil_img)
 
         return img
 
@@ -233,25 +479,63 @@ class PFImage:
         """
 
         PFEnv.logger.debug("Entering display_image(%s)." % (filepath,))
-        if filepath is None:
-            PFImage.displayed_img = PFImage.get_image(PFEnv.get_black_image())
-        else:
-            try:
-                PFImage.displayed_img = PFImage.get_image(filepath)
-            except ValueError as exc:
-                PFEnv.logger.warning("Image error %s: %s." % (str(exc), filepath))
-                PFImage.displayed_img = PFImage.get_image(PFEnv.get_black_image())
-            except OSError as exc:
-                PFEnv.logger.warning("Image error %s: %s." % (str(exc), filepath))
-                PFImage.displayed_img = PFImage.get_image(PFEnv.get_black_image())
-                
-        top = (PFCanvas.height - PFImage.displayed_img.height())/2
-        left = (PFCanvas.width - PFImage.displayed_img.width())/2
-        PFCanvas.canvas.itemconfig(PFImage.image_id, image=PFImage.displayed_img)
-        PFCanvas.canvas.coords(PFImage.image_id, (left, top))
-        PFCanvas.canvas.focus_set()
+        own_record = not PFStats.is_active()
+        if own_record:
+            PFStats.begin(filepath)
+
+        try:
+            black_image = PFEnv.get_black_image()
+            if filepath is None:
+                pil_img = PFImage.load_image(black_image, PFCanvas.width, PFCanvas.height)
+            else:
+                try:
+                    pil_img = PFImage.load_image(filepath, PFCanvas.width, PFCanvas.height)
+                except ValueError as exc:
+                    PFEnv.logger.warning("Image error %s: %s." % (str(exc), filepath))
+                    pil_img = PFImage.load_image(black_image, PFCanvas.width, PFCanvas.height)
+                except OSError as exc:
+                    PFEnv.logger.warning("Image error %s: %s." % (str(exc), filepath))
+                    pil_img = PFImage.load_image(black_image, PFCanvas.width, PFCanvas.height)
+
+            PFImage.display_pil_image(pil_img)
+            if own_record:
+                PFStats.finish()
+        finally:
+            # If it failed, don't leave the record for the next image.
+            if own_record:
+                PFStats.detach()
         PFEnv.logger.debug("Exiting display_image(%s)." % (filepath,))
 
+    ############################################################
+    #
+    # display_pil_image
+    #
+    @staticmethod
+    def display_pil_image(pil_img):
+        """
+        Display a sized PIL image on the screen, keeping it so brightness
+        changes can be redrawn from it without reading the file again.
+        """
+        PFImage.displayed_pil_img = pil_img
+        PFImage.displayed_img = PFImage.get_photo_image(pil_img)
+        PFImage.place_displayed_image()
+
+    ############################################################
+    #
+    # place_displayed_image
+    #
+    @staticmethod
+    def place_displayed_image():
+        """
+        Put PFImage.displayed_img on the canvas, centered.
+        """
+        with PFStats.stage('canvas'):
+            top = (PFCanvas.height - PFImage.displayed_img.height())/2
+            left = (PFCanvas.width - PFImage.displayed_img.width())/2
+            PFCanvas.canvas.itemconfig(PFImage.image_id, image=PFImage.displayed_img)
+            PFCanvas.canvas.coords(PFImage.image_id, (left, top))
+            PFCanvas.canvas.focus_set()
+
     ############################################################
     #
     # display_first_image
@@ -282,23 +566,52 @@ class PFImage:
         interface to this class.
         """
         try:
-            image_file = next(PFImage.image_file_gen)
+            if PFSettings.prefetch_depth <= 0:
+                PFStats.begin()
+                with PFStats.stage('discover'):
+                    image_file = next(PFImage.image_file_gen)
+                    while not PFEnv.is_format_supported(image_file) or \
+                            not os.path.exists(image_file):
+                        image_file = next(PFImage.image_file_gen)
+                PFStats.set('path', image_file)
+                pil_img = None
+            else:
+                image_file, pil_img = PFPrefetch.get_next()
+                removed = PFImage.get_removed_files()
+                while image_file in removed:
+                    # Deleted while it waited in the prefetch queue.
+                    PFEnv.logger.info("Image removed: %s." % (image_file,))
+                    PFStats.detach()
+                    if PFStaging.initialized:
+                        PFStaging.release(image_file)
+                    if PFDriveCache.initialized:
+                        PFDriveCache.release(image_file)
+                    image_file, pil_img = PFPrefetch.get_next()
+                    removed.update(PFImage.get_removed_files())
+            PFStats.set_counter("image_count", PFImage.image_source.get_count())
 
             PFEnv.logger.info(f"Next image: {image_file}")
             PFImage.previous_image = PFImage.current_image
             PFImage.current_image = image_file
-    
-            filename, file_extension = os.path.splitext(image_file)
-            while file_extension.lower() not in PFEnv.supported_types:
-                print(f"WARNING: File type '{file_extension}' is not supported.")
-                image_file = next(PFImage.image_file_gen)
-                filename, file_extension = os.path.splitext(image_file)
-
-            PFImage.display_image(image_file)
+
+            if pil_img is None:
+                PFImage.display_image(image_file)
+            else:
+                PFImage.display_pil_image(pil_img)
+            if PFStaging.initialized:
+                PFStaging.release(image_file)
+            if PFDriveCache.initialized:
+                PFDriveCache.release(image_file)
+            PFStats.finish()
         except NoImagesFoundException as exc:
+            PFStats.detach()
             PFImage.show_info("Error message", "ERROR: No images found.")
             PFEnv.logger.error("No images found.")
             raise(exc)
+        finally:
+            # Tk carries on after a callback raises, so whatever went
+            # wrong, don't leave the record for the next image.
+            PFStats.detach()
 
 
     ############################################################
@@ -360,7 +673,7 @@ class PFImage:
             if info_type == "help":
                 PFCanvas.text = PFCanvas.canvas.create_text(10,10, anchor=NW, text=PFEnv.get_help_str(), fill="white", font=('Helvetica', str(font_size)))
             elif info_type == "details":
-                PFCanvas.text = PFCanvas.canvas.create_text(10,10, anchor=NW, text=PFEnv.get_settings_str() + PFEnv.get_environment_str(), fill="white", font=('Helvetica', str(font_size)))
+                PFCanvas.text = PFCanvas.canvas.create_text(10,10, anchor=NW, text=PFEnv.get_settings_str() + PFImage.get_stats_str() + PFEnv.get_environment_str(), fill="white", font=('Helvetica', str(font_size)))
             else:
                 PFCanvas.text = PFCanvas.canvas.create_text(10,10, anchor=NW, text=errmsg + os.linesep + datestr + os.linesep + PFEnv.get_settings_str() + PFEnv.get_environment_str(), fill="white", font=('Helvetica', str(font_size)))
 
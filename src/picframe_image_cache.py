@@ -0,0 +1,139 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_image_cache.py
+
+Keep recently displayed images in memory, already sized for the canvas,
+so showing the same picture again (brightness changes, coming out of
+blackout, etc.) does not have to read and decode the file again.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from picframe_settings import PFSettings
+
+
+class PFImageCache:
+    """
+    Least recently used cache of sized PIL images, keyed by
+    (path, mtime, width, height) and bounded by image_cache_bytes.
+    """
+    cache = OrderedDict()
+    cache_bytes = 0
+    hits = 0
+    misses = 0
+    lock = threading.Lock()
+
+    ############################################################
+    #
+    # get_key
+    #
+    @staticmethod
+    def get_key(image_file, width, height, stat=None):
+        """
+        Get the cache key for an image file at a given canvas size.
+        Inputs:
+            image_file: The image file path.
+            width, height: The canvas size the image is sized for.
+            stat: The os.stat of the file if the caller already has it.
+        """
+        if stat is None:
+            stat = os.stat(image_file)
+        return (image_file, stat.st_mtime_ns, width, height)
+
+    ############################################################
+    #
+    # image_bytes
+    #
+    @staticmethod
+    def image_bytes(pil_img):
+        """
+        Approximate the memory used by the pixels of a PIL image.
+        """
+        return pil_img.width * pil_img.height * len(pil_img.getbands())
+
+    ############################################################
+    #
+    # get
+    #
+    @staticmethod
+    def get(key):
+        """
+        Return the cached image for key, or None if it is not cached.
+        """
+        with PFImageCache.lock:
+            pil_img = PFImageCache.cache.get(key)
+            if pil_img is None:
+                PFImageCache.misses = PFImageCache.misses + 1
+                return None
+
+            PFImageCache.cache.move_to_end(key)
+            PFImageCache.hits = PFImageCache.hits + 1
+            return pil_img
+
+    ############################################################
+    #
+    # put
+    #
+    @staticmethod
+    def put(key, pil_img):
+        """
+        Add an image to the cache, evicting the least recently used
+        images until it fits in image_cache_bytes.
+        """
+        nbytes = PFImageCache.image_bytes(pil_img)
+        if nbytes > PFSettings.image_cache_bytes:
+            return
+
+        with PFImageCache.lock:
+            if key in PFImageCache.cache:
+                old_img = PFImageCache.cache.pop(key)
+                PFImageCache.cache_bytes -= PFImageCache.image_bytes(old_img)
+
+            while PFImageCache.cache and \
+                    PFImageCache.cache_bytes + nbytes > PFSettings.image_cache_bytes:
+                old_key, old_img = PFImageCache.cache.popitem(last=False)
+                PFImageCache.cache_bytes -= PFImageCache.image_bytes(old_img)
+
+            PFImageCache.cache[key] = pil_img
+            PFImageCache.cache_bytes += nbytes
+
+    ############################################################
+    #
+    # clear
+    #
+    @staticmethod
+    def clear():
+        """
+        Empty the cache.
+        """
+        with PFImageCache.lock:
+            PFImageCache.cache.clear()
+            PFImageCache.cache_bytes = 0
+
+    ############################################################
+    #
+    # get_stats_str
+    #
+    @staticmethod
+    def get_stats_str():
+        """
+        Get a string of the cache statistics.
+        """
+        outstr = \
+        ("%-20s: %s" % ("image_cache_entries", str(len(PFImageCache.cache)))) + os.linesep + \
+        ("%-20s: %s" % ("image_cache_bytes", str(PFImageCache.cache_bytes))) + os.linesep + \
+        ("%-20s: %s" % ("image_cache_hits", str(PFImageCache.hits))) + os.linesep + \
+        ("%-20s: %s" % ("image_cache_misses", str(PFImageCache.misses))) + os.linesep
+        return outstr
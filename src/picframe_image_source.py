@@ -0,0 +1,160 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_image_source.py
+
+The interface every image source (PFFilesystem, PFGoogleDrive)
+implements, and the only way PFImage gets at the images:
+
+    init()                 Set up the source.
+    get_next_file()        Generator yielding the local path of each image
+                           to show, over and over, without listing them
+                           all first.
+    get_count()            How many images there are, without counting
+                           them.
+    get_file(position)     The image at a position, 0 to get_count() - 1.
+    get_changes(token)     The images added and removed since the token.
+
+PFChangeLog keeps the recent changes for get_changes().
+"""
+
+import threading
+from collections import deque
+
+
+class PFImageSource:
+    """
+    Base class of the image sources.  The methods are all static; the
+    source in use is the class itself.
+    """
+
+    ############################################################
+    #
+    # init
+    #
+    @staticmethod
+    def init():
+        """
+        Set up the source, starting any background work.
+        """
+        raise NotImplementedError
+
+    ############################################################
+    #
+    # get_next_file
+    #
+    @staticmethod
+    def get_next_file():
+        """
+        Yield the local path of each image to show, over and over.
+        Raises NoImagesFoundException if there are none.
+        """
+        raise NotImplementedError
+
+    ############################################################
+    #
+    # get_count
+    #
+    @staticmethod
+    def get_count():
+        """
+        Get the number of images, as last counted.  This doesn't go
+        through the images, so is cheap to call often.
+        """
+        raise NotImplementedError
+
+    ############################################################
+    #
+    # get_file
+    #
+    @staticmethod
+    def get_file(position):
+        """
+        Get the local path of the image at a position, 0 to
+        get_count() - 1, or None if there isn't one there (any more).
+        """
+        raise NotImplementedError
+
+    ############################################################
+    #
+    # get_changes
+    #
+    @staticmethod
+    def get_changes(token):
+        """
+        Get the images added and removed since an earlier call.
+        Inputs:
+            token: What the earlier call returned, or None to start.
+
+        Returns:
+            (token, added, removed) where added and removed are lists of
+            local paths, or None if too much has changed since the token
+            to say what.
+        """
+        raise NotImplementedError
+
+
+class PFChangeLog:
+    """
+    The most recent additions and removals of an image source, for
+    get_changes().
+    """
+
+    # How many changes are kept.
+    SIZE = 10000
+
+    def __init__(self, size=SIZE):
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.changes = deque(maxlen=size)
+
+    ############################################################
+    #
+    # record
+    #
+    def record(self, added, removed):
+        """
+        Record lists of paths that were added and removed.
+        """
+        with self.lock:
+            for path in added:
+                self.seq = self.seq + 1
+                self.changes.append((self.seq, True, path))
+            for path in removed:
+                self.seq = self.seq + 1
+                self.changes.append((self.seq, False, path))
+
+    ############################################################
+    #
+    # get_changes
+    #
+    def get_changes(self, token):
+        """
+        Get the changes since a token.  See PFImageSource.get_changes().
+        """
+        with self.lock:
+            if token is None:
+                return self.seq, [], []
+            if self.changes and self.changes[0][0] > token + 1:
+                # Some have dropped off the front.
+                return self.seq, None, None
+
+            added = []
+            removed = []
+            for seq, is_added, path in self.changes:
+                if seq <= token:
+                    continue
+                if is_added:
+                    added.append(path)
+                else:
+                    removed.append(path)
+            return self.seq, added, removed
@@ -0,0 +1,257 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_metadata.py
+
+Read when each catalogued photo was taken and its size as displayed
+(after EXIF rotation) ahead of time, so that playlists can choose by
+date and orientation without opening the files.
+
+A pool of metadata_processes worker processes, at the lowest CPU
+priority, reads just the header and EXIF data of each file; the pixels
+are never decoded.  HEIC and AVIF files are read with pyheif.  The
+results go into the catalog as they come in, so the work carries on
+after a restart, and a file is only read again if its size or mtime
+changes.
+"""
+
+import sys
+import os
+import time
+import sqlite3
+import calendar
+import threading
+import multiprocessing
+from PIL import Image
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_catalog import PFCatalog
+from picframe_stats import PFStats
+
+if sys.platform in ("linux", "linux2"):
+    import pyheif
+
+
+class PFMetadata:
+    """
+    Background EXIF and header reading for the catalog.
+    """
+    initialized = False
+    reader = None
+    files_read = 0
+
+    # EXIF tags.
+    ORIENTATION_TAG = 0x0112
+    DATETIME_TAG = 0x0132
+    EXIF_IFD_TAG = 0x8769
+    DATETIME_ORIGINAL_TAG = 0x9003
+    DATETIME_DIGITIZED_TAG = 0x9004
+
+    EXIF_DATE_FORMAT = '%Y:%m:%d %H:%M:%S'
+
+    # How long to wait before looking for unread files again.
+    IDLE_SECONDS = 60
+
+    ############################################################
+    #
+    # init
+    #
+    @staticmethod
+    def init():
+        """
+        Start the thread that hands files to the worker processes.
+        """
+        PFMetadata.initialized = True
+        PFMetadata.reader = threading.Thread(target=PFMetadata.metadata_main,
+                name="picframe_metadata", daemon=True)
+        PFMetadata.reader.start()
+
+    ############################################################
+    #
+    # get_context
+    #
+    @staticmethod
+    def get_context():
+        """
+        Get the multiprocessing context to start the workers with.  The
+        pool is made in the metadata thread while other threads hold
+        locks, so the workers aren't forked from this process: a fork
+        copies those locks held and they are never released.
+        """
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            return multiprocessing.get_context('forkserver')
+        return multiprocessing.get_context('spawn')
+
+    ############################################################
+    #
+    # init_worker
+    #
+    @staticmethod
+    def init_worker():
+        """
+        Run the worker processes at the lowest priority.
+        """
+        try:
+            os.nice(19)
+        except (AttributeError, OSError):
+            pass
+
+    ############################################################
+    #
+    # get_taken
+    #
+    @staticmethod
+    def get_taken(exif):
+        """
+        Get when a photo was taken from its EXIF data, in seconds since
+        1970 of the camera's local time, or None.
+        """
+        exif_ifd = exif.get_ifd(PFMetadata.EXIF_IFD_TAG)
+        for value in (exif_ifd.get(PFMetadata.DATETIME_ORIGINAL_TAG),
+                exif_ifd.get(PFMetadata.DATETIME_DIGITIZED_TAG),
+                exif.get(PFMetadata.DATETIME_TAG)):
+            if not isinstance(value, str):
+                continue
+            try:
+                return calendar.timegm(time.strptime(value.strip('\x00 ')[:19],
+                        PFMetadata.EXIF_DATE_FORMAT))
+            except (ValueError, OverflowError):
+                continue
+        return None
+
+    ############################################################
+    #
+    # read_heif_metadata
+    #
+    @staticmethod
+    def read_heif_metadata(image_file):
+        """
+        Read a HEIC or AVIF file's size and EXIF date.  libheif applies
+        the rotation itself, so the size is already as displayed.
+        """
+        heif_file = pyheif.open(image_file)
+        width, height = heif_file.size
+        taken = None
+        for block in heif_file.metadata or ():
+            if block.get('type') != 'Exif':
+                continue
+            data = block['data']
+            start = data.find(b'Exif\x00\x00')
+            data = data[start + 6:] if start >= 0 else data[4:]
+            exif = Image.Exif()
+            exif.load(data)
+            taken = PFMetadata.get_taken(exif)
+            break
+        return (taken, width, height)
+
+    ############################################################
+    #
+    # read_metadata
+    #
+    @staticmethod
+    def read_metadata(image_file):
+        """
+        Read an image file's metadata.  Runs in a worker process.
+
+        Returns:
+            (taken, width, height), with None for whatever couldn't be
+            found, or None if the file couldn't be read at all (e.g. the
+            mount is down) and should be tried again later.
+        """
+        filename, file_extension = os.path.splitext(image_file)
+        try:
+            if file_extension.lower() in ('.heic', '.avif'):
+                return PFMetadata.read_heif_metadata(image_file)
+
+            with Image.open(image_file) as pil_img:
+                width, height = pil_img.size
+                exif = pil_img.getexif()
+            if exif.get(PFMetadata.ORIENTATION_TAG) in (5, 6, 7, 8):
+                width, height = height, width
+            return (PFMetadata.get_taken(exif), width, height)
+        except OSError as exc:
+            # An error from the system, rather than from PIL not liking
+            # the file, may well go away.
+            if exc.errno is not None:
+                return None
+            return (None, None, None)
+        except Exception:
+            # Anything else wrong with the file won't change until the
+            # file does.
+            return (None, None, None)
+
+    ############################################################
+    #
+    # read_batch
+    #
+    @staticmethod
+    def read_batch(pool, conn, last_id):
+        """
+        Read the metadata of the next batch of unread files.  A file
+        that changed while it was read is left for the next time around.
+
+        Returns:
+            The id of the last file in the batch, or None if there are no
+            more.
+        """
+        rows = conn.execute(
+                "SELECT id, path, size, mtime FROM files WHERE meta IS NULL AND id > ? "
+                "ORDER BY id LIMIT ?", (last_id, PFCatalog.BATCH_SIZE)).fetchall()
+        if not rows:
+            return None
+
+        start = time.monotonic()
+        results = pool.map(PFMetadata.read_metadata, [row[1] for row in rows], chunksize=16)
+        updates = []
+        for (file_id, path, size, mtime), result in zip(rows, results):
+            if result is not None:
+                taken, width, height = result
+                updates.append((taken, width, height, file_id, size, mtime))
+        with conn:
+            conn.executemany("UPDATE files SET taken = ?, width = ?, height = ?, meta = 1 "
+                    "WHERE id = ? AND size = ? AND mtime = ?", updates)
+
+        elapsed = max(time.monotonic() - start, 0.001)
+        PFMetadata.files_read = PFMetadata.files_read + len(updates)
+        PFStats.set_counter("metadata_read", PFMetadata.files_read)
+        PFStats.set_counter("metadata_rate", "%.0f files/s" % (len(rows) / elapsed,))
+        return rows[-1][0]
+
+    ############################################################
+    #
+    # metadata_main
+    #
+    @staticmethod
+    def metadata_main():
+        """
+        Read metadata for files as they are catalogued.
+        """
+        PFEnv.setup_logger()
+        pool = PFMetadata.get_context().Pool(PFSettings.metadata_processes,
+                initializer=PFMetadata.init_worker)
+        conn = PFCatalog.get_conn()
+        while True:
+            generation = PFCatalog.get_scan_generation()
+            last_id = 0
+            start = time.monotonic()
+            files_read = PFMetadata.files_read
+            try:
+                while last_id is not None:
+                    last_id = PFMetadata.read_batch(pool, conn, last_id)
+            except sqlite3.Error as exc:
+                PFEnv.logger.error("Reading metadata failed: %s" % (str(exc),))
+
+            if PFMetadata.files_read > files_read:
+                PFEnv.logger.info("Read metadata of %d files in %.1f seconds" %
+                        (PFMetadata.files_read - files_read, time.monotonic() - start))
+            PFCatalog.wait_for_scan(generation, PFMetadata.IDLE_SECONDS)
@@ -0,0 +1,338 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_playlist.py
+
+Show only the catalogued images that match PFSettings.playlist, e.g.
+photos taken on this day in past years, in a date range, or from some
+folders, optionally favouring recent folders.
+
+The playlist is turned into an SQL query over the catalog's indexed
+columns.  At the start of each time through, the ids of the matching
+files are put in a temporary table, numbered by position, and the
+images are then read from it one at a time; the directories are never
+walked.  See PFSettings.playlist for the query keys.
+"""
+
+import os
+import time
+import random
+import calendar
+from datetime import date, datetime, timedelta
+from collections import deque
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv, NoImagesFoundException
+from picframe_canvas import PFCanvas
+from picframe_catalog import PFCatalog
+from picframe_shuffle import PFShuffle
+
+
+class PFPlaylist:
+    """
+    Query-driven playlists over the catalog.
+    """
+
+    QUERY_KEYS = ('taken_after', 'taken_before', 'on_this_day', 'include_folders',
+            'exclude_folders', 'orientation', 'recent_half_life')
+
+    TMP_SCHEMA = (
+        "CREATE TEMP TABLE IF NOT EXISTS playlist ("
+        " pos INTEGER PRIMARY KEY,"
+        " file_id INTEGER NOT NULL,"
+        " dir TEXT NOT NULL,"
+        " taken INTEGER NOT NULL)",
+    )
+
+    ############################################################
+    #
+    # get_day_seconds
+    #
+    @staticmethod
+    def get_day_seconds(day):
+        """
+        Get a date, or a 'YYYY-MM-DD' string, as seconds since 1970 in
+        the same local time as the catalog's taken column.
+        """
+        if isinstance(day, str):
+            day = datetime.strptime(day, '%Y-%m-%d').date()
+        return calendar.timegm(day.timetuple())
+
+    ############################################################
+    #
+    # get_nearby_days
+    #
+    @staticmethod
+    def get_nearby_days(day, window):
+        """
+        Get the 'MM-DD' of each date within window days of a date.  In a
+        year without a Feb 29, photos from one are shown with Feb 28.
+        """
+        window = min(max(window, 0), 183)
+        days = set()
+        for offset in range(-window, window + 1):
+            days.add((day + timedelta(days=offset)).strftime('%m-%d'))
+        if '02-28' in days and not calendar.isleap(day.year):
+            days.add('02-29')
+        return sorted(days)
+
+    ############################################################
+    #
+    # get_folder_condition
+    #
+    @staticmethod
+    def get_folder_condition(folders, params):
+        """
+        Get the condition for a file being in any of the folders or
+        under them.
+        """
+        conditions = []
+        for folder in folders:
+            folder = os.path.normpath(PFEnv.path_to_platform(folder))
+            prefix = os.path.join(folder, '')
+            conditions.append("(dir = ? OR substr(dir, 1, ?) = ?)")
+            params.extend([folder, len(prefix), prefix])
+        return "(" + " OR ".join(conditions) + ")"
+
+    ############################################################
+    #
+    # compile
+    #
+    @staticmethod
+    def compile(query):
+        """
+        Turn a playlist query into an SQL condition on the files table.
+
+        Returns:
+            (condition, params)
+        """
+        for key in query:
+            if key not in PFPlaylist.QUERY_KEYS:
+                PFEnv.logger.error("Unknown playlist key '%s' ignored" % (key,))
+
+        conditions = [PFCatalog.get_unique_condition()]
+        params = []
+
+        if query.get('taken_after') is not None:
+            conditions.append("%s >= ?" % (PFCatalog.TAKEN_EXPR,))
+            params.append(PFPlaylist.get_day_seconds(query['taken_after']))
+        if query.get('taken_before') is not None:
+            conditions.append("%s < ?" % (PFCatalog.TAKEN_EXPR,))
+            params.append(PFPlaylist.get_day_seconds(query['taken_before']) + 86400)
+
+        if query.get('on_this_day') is not None:
+            # Within on_this_day days of today's date, in an earlier year.
+            # Matching on month and day wraps around the new year and
+            # doesn't shift after Feb 29.
+            today = date.today()
+            days = PFPlaylist.get_nearby_days(today, int(query['on_this_day']))
+            conditions.append("%s IN (%s)" % (PFCatalog.DAY_EXPR, ", ".join("?" * len(days))))
+            params.extend(days)
+            conditions.append("%s < ?" % (PFCatalog.TAKEN_EXPR,))
+            params.append(PFPlaylist.get_day_seconds(date(today.year, 1, 1)))
+
+        if query.get('include_folders'):
+            conditions.append(PFPlaylist.get_folder_condition(query['include_folders'], params))
+        if query.get('exclude_folders'):
+            conditions.append("NOT " +
+                    PFPlaylist.get_folder_condition(query['exclude_folders'], params))
+
+        # Files whose size isn't known yet are included.
+        orientation = query.get('orientation')
+        if orientation == 'screen':
+            orientation = 'landscape' if PFCanvas.width >= PFCanvas.height else 'portrait'
+        if orientation == 'landscape':
+            conditions.append("(width IS NULL OR width >= height)")
+        elif orientation == 'portrait':
+            conditions.append("(width IS NULL OR width < height)")
+        elif orientation is not None:
+            PFEnv.logger.error("Unknown playlist orientation '%s' ignored" % (orientation,))
+
+        return " AND ".join(conditions), params
+
+    ############################################################
+    #
+    # build
+    #
+    @staticmethod
+    def build(conn, condition, params):
+        """
+        Fill the playlist table with the matching files, grouped by
+        directory.
+
+        Returns:
+            The number of files in the playlist.
+        """
+        start = time.monotonic()
+        with conn:
+            for statement in PFPlaylist.TMP_SCHEMA:
+                conn.execute(statement)
+            conn.execute("DELETE FROM playlist")
+            conn.execute("INSERT INTO playlist (file_id, dir, taken) "
+                    "SELECT id, dir, %s FROM files WHERE %s ORDER BY dir, id" %
+                    (PFCatalog.TAKEN_EXPR, condition), params)
+        count = conn.execute("SELECT COUNT(*) FROM playlist").fetchone()[0]
+        PFEnv.logger.info("Playlist of %d files built in %.3f seconds" %
+                (count, time.monotonic() - start))
+        return count
+
+    ############################################################
+    #
+    # get_folder_weights
+    #
+    @staticmethod
+    def get_folder_weights(conn, half_life_days):
+        """
+        Weight each directory in the playlist by its number of files,
+        halved for every half_life_days its newest photo is older than
+        today.
+
+        Returns:
+            (folders, total) where folders is a list of
+            (cumulative weight, first position, count).
+        """
+        now = PFPlaylist.get_day_seconds(date.today())
+        folders = []
+        total = 0.0
+        for dir_name, first, count, newest in conn.execute(
+                "SELECT dir, MIN(pos), COUNT(*), MAX(taken) FROM playlist GROUP BY dir"):
+            age_days = max(0.0, (now - newest) / 86400.0)
+            total = total + count * 0.5 ** (age_days / half_life_days)
+            folders.append((total, first, count))
+        return folders, total
+
+    ############################################################
+    #
+    # get_weighted_position
+    #
+    @staticmethod
+    def get_weighted_position(folders, total):
+        """
+        Pick a directory by weight, and a position in it at random.
+        """
+        target = random.random() * total
+        low = 0
+        high = len(folders) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if folders[middle][0] < target:
+                low = middle + 1
+            else:
+                high = middle
+        cumulative, first, count = folders[low]
+        return first + random.randrange(count)
+
+    ############################################################
+    #
+    # get_row
+    #
+    @staticmethod
+    def get_row(conn, position):
+        """
+        Get the (file id, path) at a position of the playlist, or None if
+        the file has since been removed.
+        """
+        return conn.execute("SELECT files.id, files.path FROM playlist JOIN files "
+                "ON files.id = playlist.file_id WHERE playlist.pos = ?", (position,)).fetchone()
+
+    ############################################################
+    #
+    # matches
+    #
+    @staticmethod
+    def matches(conn, path, condition, params):
+        """
+        Returns whether a newly found file is in the playlist.
+        """
+        row = conn.execute("SELECT 1 FROM files WHERE path = ? AND %s" % (condition,),
+                [path] + params).fetchone()
+        return row is not None
+
+    ############################################################
+    #
+    # get_next_file
+    #
+    @staticmethod
+    def get_next_file():
+        """
+        Yield the files in the playlist, over and over: by directory, or
+        shuffled with PFSettings.shuffle, or picked at random weighted
+        toward recent directories with recent_half_life.  The playlist
+        is rebuilt each time through, so it follows the catalog and the
+        date.
+        """
+        conn = PFCatalog.get_conn()
+        query = PFSettings.playlist
+        half_life = query.get('recent_half_life')
+        recent = deque(maxlen=max(1, PFSettings.shuffle_no_repeat))
+        falling_back = False
+
+        while True:
+            generation = PFCatalog.get_scan_generation()
+            condition, params = PFPlaylist.compile(query)
+            count = PFPlaylist.build(conn, condition, params)
+            fallback_day = None
+            if count == 0:
+                if PFCatalog.scanning:
+                    PFCatalog.wait_for_scan(generation, 1)
+                    continue
+
+                # A playlist like on_this_day can match nothing today and
+                # something tomorrow, so rather than quit show all of the
+                # images until the day changes, then try it again.
+                if not falling_back:
+                    PFEnv.logger.warning("No images match the playlist %s, showing all images" %
+                            (str(query),))
+                    falling_back = True
+                condition, params = PFPlaylist.compile({})
+                count = PFPlaylist.build(conn, condition, params)
+                fallback_day = date.today()
+                if count == 0:
+                    PFEnv.logger.error("No images in the catalog, quitting")
+                    raise NoImagesFoundException()
+            else:
+                falling_back = False
+
+            folders = None
+            if half_life:
+                folders, total = PFPlaylist.get_folder_weights(conn, half_life)
+            seed = random.getrandbits(63)
+
+            for index in range(count):
+                if fallback_day is not None and date.today() != fallback_day:
+                    break
+
+                new_path = PFCatalog.pop_added()
+                while new_path is not None:
+                    if PFPlaylist.matches(conn, new_path, condition, params):
+                        yield new_path
+                    new_path = PFCatalog.pop_added()
+
+                with PFCatalog.lock:
+                    PFCatalog.removed.clear()
+                if folders is not None:
+                    # Don't pick one of the last few again if it can be
+                    # helped.
+                    for attempt in range(10):
+                        row = PFPlaylist.get_row(conn,
+                                PFPlaylist.get_weighted_position(folders, total))
+                        if row is None or row[0] not in recent or count <= len(recent):
+                            break
+                    if row is not None:
+                        recent.append(row[0])
+                elif PFSettings.shuffle:
+                    row = PFPlaylist.get_row(conn, PFShuffle.permute(index, count, seed) + 1)
+                else:
+                    row = PFPlaylist.get_row(conn, index + 1)
+
+                if row is not None:
+                    yield row[1]
@@ -0,0 +1,156 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_prefetch.py
+
+Decode the next few images in a background thread so that when the timer
+asks for the next image it is already read, oriented and sized for the
+canvas.  The tkinter main loop then only has to turn it into a
+PhotoImage and put it on the canvas.
+"""
+
+import os
+import time
+import threading
+import queue
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_canvas import PFCanvas
+from picframe_stats import PFStats
+from picframe_staging import PFStaging
+from picframe_drive_cache import PFDriveCache
+
+
+class PFPrefetch:
+    """
+    Keep a bounded queue of decoded, screen-sized images ready to display.
+    """
+    prefetch_q = None
+    worker = None
+    loader = None
+
+    ############################################################
+    #
+    # init
+    #
+    @staticmethod
+    def init(image_file_gen, loader):
+        """
+        Start the prefetch worker.
+        Inputs:
+            image_file_gen: The generator yielding the image files to show.
+            loader: Function taking (image_file, width, height) and
+                returning a sized PIL image.
+        """
+        PFPrefetch.loader = loader
+        PFPrefetch.prefetch_q = queue.Queue(maxsize=PFSettings.prefetch_depth)
+        PFPrefetch.worker = threading.Thread(target=PFPrefetch.prefetch_main,
+                args=(image_file_gen,), name="picframe_prefetch", daemon=True)
+        PFPrefetch.worker.start()
+
+    ############################################################
+    #
+    # prefetch_main
+    #
+    @staticmethod
+    def prefetch_main(image_file_gen):
+        """
+        Continually pull the next image file and decode it, blocking when
+        the queue holds prefetch_depth images.
+
+        Queue entries are (image_file, pil_img, geometry, record, exc).
+        pil_img is None if the file could not be read, in which case the
+        black image gets displayed.  record holds the stage timings so
+        far.  An image that fails to decode in any other way is logged
+        and skipped.  If the generator fails the worker stops, and its
+        last entry is (None, None, None, record, exc) with the exception
+        to raise on the main thread.
+        """
+        while True:
+            PFStats.begin()
+            try:
+                with PFStats.stage('discover'):
+                    image_file = next(image_file_gen)
+                    while not PFEnv.is_format_supported(image_file) or \
+                            not os.path.exists(image_file):
+                        image_file = next(image_file_gen)
+            except Exception as exc:
+                PFPrefetch.prefetch_q.put((None, None, None, PFStats.detach(), exc))
+                return
+
+            PFStats.set('path', image_file)
+            geometry = (PFCanvas.width, PFCanvas.height)
+            pil_img = None
+            try:
+                pil_img = PFPrefetch.loader(image_file, geometry[0], geometry[1])
+            except FileNotFoundError:
+                # Deleted since it was found; skip it rather than show
+                # the black image.
+                PFEnv.logger.info("Image removed: %s." % (image_file,))
+                if PFStaging.initialized:
+                    PFStaging.release(image_file)
+                if PFDriveCache.initialized:
+                    PFDriveCache.release(image_file)
+                continue
+            except (ValueError, OSError) as exc:
+                PFEnv.logger.warning("Image error %s: %s." % (str(exc), image_file))
+            except Exception as exc:
+                # e.g. a HEIF decoder error; only this image is lost.
+                PFEnv.logger.error("Image error %s: %s, skipping it." % (repr(exc), image_file))
+                PFStats.detach()
+                if PFStaging.initialized:
+                    PFStaging.release(image_file)
+                if PFDriveCache.initialized:
+                    PFDriveCache.release(image_file)
+                continue
+
+            PFPrefetch.prefetch_q.put((image_file, pil_img, geometry, PFStats.detach(), None))
+
+    ############################################################
+    #
+    # get_next
+    #
+    @staticmethod
+    def get_next():
+        """
+        Get the next decoded image, waiting for the worker if it has not
+        caught up.  If the canvas has changed size since the image was
+        decoded, decode it again at the new size.
+
+        The image's timing record is continued in this thread.  Once the
+        worker has stopped because the image files ran out or failed,
+        every call raises its exception.
+
+        Returns:
+            (image_file, pil_img) where pil_img is None if the image
+            could not be read.
+        """
+        start = time.monotonic()
+        entry = PFPrefetch.prefetch_q.get()
+        image_file, pil_img, geometry, record, exc = entry
+        if exc is not None:
+            # Leave it for the next call; nothing else will come.
+            PFPrefetch.prefetch_q.put_nowait(entry)
+            raise exc
+        PFStats.resume(record)
+        PFStats.add_stage('queue_wait', time.monotonic() - start)
+
+        if pil_img is not None and geometry != (PFCanvas.width, PFCanvas.height):
+            PFEnv.logger.debug("Canvas size changed, reloading %s" % (image_file,))
+            try:
+                pil_img = PFPrefetch.loader(image_file, PFCanvas.width, PFCanvas.height)
+            except (ValueError, OSError) as exc:
+                PFEnv.logger.warning("Image error %s: %s." % (str(exc), image_file))
+                pil_img = None
+
+        return image_file, pil_img
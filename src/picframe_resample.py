@@ -0,0 +1,150 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_resample.py
+
+Resize images to fit the screen using one of several named profiles
+that trade quality for speed.  Resizing is the most expensive step on a
+Raspberry Pi Zero, so slow devices can pick a cheaper filter.
+"""
+
+import os
+import time
+import threading
+from PIL import Image
+
+from picframe_settings import PFSettings
+
+
+class PFResample:
+    """
+    Named resampling profiles and the time spent in each.
+    """
+
+    # Each profile is (filter, reducing_gap).  With a reducing_gap, the
+    # image is first shrunk by an integer factor with a fast box filter
+    # until it is within reducing_gap times the final size, and the
+    # profile's filter is only run over that last step.  A smaller gap
+    # is faster and softer.
+    PROFILES = {
+        'fast': (Image.BILINEAR, 1.5),
+        'balanced': (Image.BICUBIC, 2.0),
+        'best': (Image.LANCZOS, 3.0),
+    }
+
+    # The 'auto' profile picks by how much the image is shrunk: beyond
+    # these factors the detail lost to the smaller screen hides the
+    # difference between the filters.
+    AUTO_FAST_FACTOR = 4.0
+    AUTO_BALANCED_FACTOR = 2.0
+
+    PROFILE_NAMES = ('fast', 'balanced', 'best', 'auto')
+
+    timings = {}
+    lock = threading.Lock()
+
+    ############################################################
+    #
+    # get_profile
+    #
+    @staticmethod
+    def get_profile(pil_img, size, profile=None):
+        """
+        Get the name of the profile to use for this resize, resolving
+        'auto' by the scale factor.
+        """
+        if profile is None:
+            profile = PFSettings.resample_profile
+        if profile != 'auto':
+            return profile
+
+        factor = max(pil_img.width / size[0], pil_img.height / size[1])
+        if factor >= PFResample.AUTO_FAST_FACTOR:
+            return 'fast'
+        if factor >= PFResample.AUTO_BALANCED_FACTOR:
+            return 'balanced'
+        return 'best'
+
+    ############################################################
+    #
+    # resize
+    #
+    @staticmethod
+    def resize(pil_img, size, profile=None, drafted=False):
+        """
+        Resize an image to size using a resampling profile.
+        Inputs:
+            pil_img: The image to resize.
+            size: (width, height) to resize to.
+            profile: Profile name, defaults to PFSettings.resample_profile.
+            drafted: The image was already reduced while decoding (JPEG
+                draft), so the profile's box reduction isn't done again.
+        """
+        profile = PFResample.get_profile(pil_img, size, profile)
+        resample, reducing_gap = PFResample.PROFILES[profile]
+        if drafted:
+            reducing_gap = None
+
+        start = time.monotonic()
+        pil_img = pil_img.resize(size, resample, reducing_gap=reducing_gap)
+        elapsed = time.monotonic() - start
+
+        with PFResample.lock:
+            count, total = PFResample.timings.get(profile, (0, 0.0))
+            PFResample.timings[profile] = (count + 1, total + elapsed)
+
+        return pil_img
+
+    ############################################################
+    #
+    # take_counters
+    #
+    @staticmethod
+    def take_counters():
+        """
+        Get the timings since the last call, and start again from zero.
+        Used to pass a decoder process's timings back.
+        """
+        with PFResample.lock:
+            timings = PFResample.timings
+            PFResample.timings = {}
+        return timings
+
+    ############################################################
+    #
+    # add_counters
+    #
+    @staticmethod
+    def add_counters(timings):
+        """
+        Add timings returned by take_counters() in another process.
+        """
+        with PFResample.lock:
+            for profile, (count, total) in timings.items():
+                old_count, old_total = PFResample.timings.get(profile, (0, 0.0))
+                PFResample.timings[profile] = (old_count + count, old_total + total)
+
+    ############################################################
+    #
+    # get_stats_str
+    #
+    @staticmethod
+    def get_stats_str():
+        """
+        Get a string of the average resize time for each profile used.
+        """
+        outstr = ''
+        with PFResample.lock:
+            for profile, (count, total) in sorted(PFResample.timings.items()):
+                outstr = outstr + ("%-20s: %d, %.1f ms avg" %
+                        ("resize_" + profile, count, total * 1000 / count)) + os.linesep
+        return outstr
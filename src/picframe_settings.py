@@ -103,6 +103,34 @@ class PFSettings:
     # ROOT_FOLDER_TITLE
     gdrive_photos_folder = "PicFrame"
 
+    # The Google Drive folder tree is kept in a database at
+    # gdrive_tree_path, and updated from Drive's list of changes rather
+    # than listed again on every pass.  The first time, up to
+    # gdrive_list_threads folders are listed at once.
+    # With gdrive_fake_root set to a local directory, that directory is
+    # shown as if it were the Drive, for trying things out without a
+    # Google account.
+    gdrive_tree_path = '~/.cache/picframe/gdrive.db'
+    gdrive_list_threads = 4
+    gdrive_fake_root = None
+
+    # The next gdrive_download_ahead photos are downloaded at once, on
+    # gdrive_download_threads threads, into gdrive_cache_dir.  Photos
+    # are kept there by their contents, so are only downloaded again if
+    # they change.  It is kept under gdrive_cache_bytes by removing the
+    # least recently shown photos.
+    gdrive_cache_dir = '~/.cache/picframe/gdrive'
+    gdrive_cache_bytes = 500000000
+    gdrive_download_threads = 3
+    gdrive_download_ahead = 4
+
+    # With gdrive_thumbnails set, Drive's copy of each photo resized to
+    # fit the screen is downloaded instead of the original, which is
+    # much smaller and quicker to show, e.g. over slow Wi-Fi.  Photos
+    # Drive has no such copy of are downloaded whole.  Leave it unset
+    # for full quality.
+    gdrive_thumbnails = False
+
     ############################################################
     ############################################################
     #
@@ -132,3 +160,215 @@ class PFSettings:
     # TIMER_STEP is the amount of time in seconds to increase or decrease
     # the display time by when the keyboard toggle is used.
     timer_step = 10
+
+    ############################################################
+    #
+    # Image pipeline settings:
+    #
+    # prefetch_depth is how many upcoming images are read and sized
+    # in the background ahead of the timer.  Each one holds a
+    # screen-sized image in memory.  Setting it to 0 reads each image
+    # only when it is about to be displayed.
+    # default:
+    #   prefetch_depth = 3
+    prefetch_depth = 3
+
+    # image_cache_bytes is how much memory (in bytes) to use for keeping
+    # recently shown images, already sized for the screen, so showing
+    # them again does not need to read the file.  A 1920x1080 image
+    # takes about 6MB.
+    # default:
+    #   image_cache_bytes = 64000000
+    image_cache_bytes = 64000000
+
+    # reduced_decode lets large JPEGs be decoded directly at a reduced
+    # size (1/2, 1/4 or 1/8) that is still at least the screen size.
+    # This is much faster and uses much less memory on a Raspberry Pi.  Set it to False to always decode at full size,
+    # for example to compare the output quality.
+    # default:
+    #   reduced_decode = True
+    reduced_decode = True
+
+    # The rendition cache keeps a copy of each image, already oriented
+    # and sized for the screen, in rendition_cache_dir so that the next
+    # time around the slideshow it does not need to be decoded and
+    # resized again.  rendition_cache_bytes is the most disk space it
+    # will use; the least recently shown images are removed first.
+    # default:
+    #   use_rendition_cache = True
+    #   rendition_cache_dir = '~/.cache/picframe/renditions'
+    #   rendition_cache_bytes = 500000000
+    use_rendition_cache = True
+    rendition_cache_dir = '~/.cache/picframe/renditions'
+    rendition_cache_bytes = 500000000
+
+    # gamma is applied along with the brightness.  1.0 leaves the image
+    # alone, larger values lift the shadows, smaller values darken them.
+    # default:
+    #   gamma = 1.0
+    gamma = 1.0
+
+    # night_warmth gives the image a warm (less blue) tint between
+    # night_warmth_start_hour and night_warmth_end_hour, on a 24 hour
+    # clock.  0.0 turns it off, 1.0 is the strongest tint.
+    # default:
+    #   night_warmth = 0.0
+    #   night_warmth_start_hour = 20
+    #   night_warmth_end_hour = 7
+    night_warmth = 0.0
+    night_warmth_start_hour = 20
+    night_warmth_end_hour = 7
+
+    # Images with an extension in isolated_decode_types are decoded in
+    # one of decoder_processes separate processes.  If a decode takes
+    # longer than decode_timeout seconds the process is killed, the
+    # image is skipped, and the frame moves on.  HEIC and AVIF are the
+    # slowest formats and the most likely to hang; add the other
+    # extensions to decode everything this way.  Setting
+    # decoder_processes to 0 decodes everything in the main process.
+    # default:
+    #   decoder_processes = 1
+    #   isolated_decode_types = ('.heic', '.avif')
+    #   decode_timeout = 20
+    decoder_processes = 1
+    isolated_decode_types = ('.heic', '.avif')
+    decode_timeout = 20
+
+    # max_decoded_image_bytes is the most memory one decoded image may
+    # use.  It is checked from the image header before decoding, so the
+    # file size doesn't matter.  A JPEG that is too large is decoded at
+    # 1/2, 1/4 or 1/8 size instead; other images that are too large are
+    # skipped.  A 12 megapixel photo needs about 48MB.  200MB is safe
+    # on a 1GB Raspberry Pi.
+    # default:
+    #   max_decoded_image_bytes = 200000000
+    max_decoded_image_bytes = 200000000
+
+    # resample_profile picks the filter used to resize images to the
+    # screen, trading quality for speed:
+    #   'fast'      bilinear after a box filter reduce; for a Pi Zero.
+    #   'balanced'  bicubic.
+    #   'best'      lanczos; the sharpest and slowest.
+    #   'auto'      'fast' when shrinking by 4x or more, 'balanced' for
+    #               2x to 4x, 'best' otherwise.
+    # The average time of each profile used is on the details screen.
+    # It can also be set on the command line with -r.
+    # default:
+    #   resample_profile = 'auto'
+    resample_profile = 'auto'
+
+    # stats_window is how many of the most recent images the timing
+    # percentiles on the details screen are calculated over.
+    # default:
+    #   stats_window = 200
+    stats_window = 200
+
+    ############################################################
+    #
+    # Filesystem catalog settings:
+    #
+    # With use_catalog, the list of images found under image_paths is
+    # kept in a database at catalog_path.  On startup the slideshow
+    # starts from the catalog right away while the directories are
+    # walked again in the background to pick up changes.  They are
+    # walked again every catalog_rescan_interval seconds; None only
+    # walks them at startup.
+    #
+    # With watch_image_paths, new and deleted images show up within
+    # seconds instead of at the next rescan.  Local disks are watched
+    # with inotify.  On network mounts the directories are checked for
+    # changes every catalog_poll_interval seconds instead.  There an
+    # image overwritten in place under the same name is only noticed
+    # within seconds if its directory changed in the last week;
+    # otherwise it waits for the next rescan.
+    # default:
+    #   use_catalog = True
+    #   catalog_path = '~/.cache/picframe/catalog.db'
+    #   catalog_rescan_interval = 86400
+    #   watch_image_paths = True
+    #   catalog_poll_interval = 30
+    use_catalog = True
+    catalog_path = '~/.cache/picframe/catalog.db'
+    catalog_rescan_interval = 86400
+    watch_image_paths = True
+    catalog_poll_interval = 30
+
+    # With shuffle, the catalogued images are shown in a random order,
+    # each once before any is shown again, and in a new order each time
+    # through.  The last shuffle_no_repeat images of one time through
+    # are kept out of the first shuffle_no_repeat of the next.  The
+    # place in the order is kept across restarts.
+    # default:
+    #   shuffle = False
+    #   shuffle_no_repeat = 20
+    shuffle = False
+    shuffle_no_repeat = 20
+
+    # walker_threads is how many directories are listed at once when
+    # looking for images.  The image paths are walked side by side, so
+    # a slow network share doesn't hold up a local disk, and the
+    # directories of a slow share are listed in parallel.  How many
+    # entries per second each path was walked at is on the details
+    # screen.
+    # default:
+    #   walker_threads = 4
+    walker_threads = 4
+
+    # With hash_images, every catalogued image is hashed in the
+    # background and copies of the same photo in different places are
+    # shown only once.  Hashing reads at most hash_read_rate bytes a
+    # second.  perceptual_hash also finds copies saved at another size
+    # or quality, once each has been shown.
+    # default:
+    #   hash_images = True
+    #   hash_read_rate = 20000000
+    #   perceptual_hash = False
+    hash_images = True
+    hash_read_rate = 20000000
+    perceptual_hash = False
+
+    # With extract_metadata, when each catalogued photo was taken and
+    # its size are read from its EXIF data in the background, for
+    # playlists, by metadata_processes worker processes at the lowest
+    # priority.  Only the headers are read.
+    # default:
+    #   extract_metadata = True
+    #   metadata_processes = 2
+    extract_metadata = True
+    metadata_processes = 2
+
+    # The next staging_files images are copied from image_paths to
+    # staging_dir ahead of time, so a USB disk spinning up or a busy NAS
+    # doesn't delay the next image.  The copies are removed once shown
+    # and take at most staging_bytes.  staging_dir should be on a RAM
+    # disk or fast local disk.  0 staging_files turns this off.
+    # default:
+    #   staging_files = 4
+    #   staging_bytes = 200000000
+    #   staging_dir = '/dev/shm/picframe_staging'
+    staging_files = 4
+    staging_bytes = 200000000
+    staging_dir = '/dev/shm/picframe_staging'
+
+    # A playlist shows only the catalogued images that match all of its
+    # keys.  When a photo was taken comes from its EXIF data, or if it
+    # has none from the file's modification time.
+    #   'taken_after': 'YYYY-MM-DD'    Taken on or after the day.
+    #   'taken_before': 'YYYY-MM-DD'   Taken on or before the day.
+    #   'on_this_day': days            Taken in an earlier year within
+    #                                  this many days of today's date.
+    #   'include_folders': [paths]     Only in these folders.
+    #   'exclude_folders': [paths]     Not in these folders.
+    #   'orientation': 'landscape', 'portrait' or 'screen' (the same as
+    #                                  the screen).
+    #   'recent_half_life': days       Pick images at random, favouring
+    #                                  folders with recent photos: a
+    #                                  folder's chance halves for every
+    #                                  this many days old it is.
+    # Otherwise the images are shown by folder, or shuffled if shuffle
+    # is set.  None shows everything, as does a playlist that matches
+    # nothing (until the next day).  For example:
+    #   playlist = {'on_this_day': 3, 'orientation': 'screen'}
+    # default:
+    #   playlist = None
+    playlist = None
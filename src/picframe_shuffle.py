@@ -0,0 +1,77 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_shuffle.py
+
+A random order over positions 0..size-1 that needs no memory: position
+p of the order is computed from p, size and a seed.  Shuffling a list of
+every file instead costs hundreds of MB on a large library.
+
+The order is a small Feistel network, keyed by the seed, over the
+smallest power of four at least size.  That is a permutation of the
+larger range; positions that land outside 0..size-1 are put through it
+again ("cycle walking") until they land inside, which keeps it a
+permutation of 0..size-1.  On average that takes at most four passes.
+"""
+
+import hashlib
+
+
+class PFShuffle:
+    """
+    Seeded, constant memory permutations.
+    """
+
+    ROUNDS = 4
+
+    ############################################################
+    #
+    # round_value
+    #
+    @staticmethod
+    def round_value(key, round_num, value, mask):
+        """
+        The Feistel round function.
+        """
+        digest = hashlib.blake2b(b"%d:%d" % (round_num, value), digest_size=8, key=key).digest()
+        return int.from_bytes(digest, 'little') & mask
+
+    ############################################################
+    #
+    # permute
+    #
+    @staticmethod
+    def permute(position, size, seed):
+        """
+        Get the value at a position of the shuffled order.
+        Inputs:
+            position: 0 to size - 1.
+            size: The number of values in the order.
+            seed: Non-negative integer choosing the order.
+
+        Returns:
+            An integer 0 to size - 1.  Each is returned for exactly one
+            position.
+        """
+        half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        mask = (1 << half_bits) - 1
+        key = seed.to_bytes(8, 'little')
+
+        value = position
+        while True:
+            left = value >> half_bits
+            right = value & mask
+            for round_num in range(PFShuffle.ROUNDS):
+                left, right = right, left ^ PFShuffle.round_value(key, round_num, right, mask)
+            value = (left << half_bits) | right
+            if value < size:
+                return value
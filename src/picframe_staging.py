@@ -0,0 +1,256 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_staging.py
+
+Copy the next few image files from the image paths to a local directory
+(by default in RAM) ahead of time, so a USB disk spinning up or a busy
+NAS doesn't hold up the next image.  Each file is copied with large
+sequential reads, the decoder reads the local copy, and the copy is
+removed once the image has been displayed.  A file that comes up again
+before its copy is removed shares the copy, which is kept until every
+showing of it is done.
+
+Files that already have a rendition in the disk cache aren't copied,
+as the original won't be read.  The staging directory is kept under
+staging_bytes; a file that doesn't fit is read from the image path as
+before.
+"""
+
+import os
+import queue
+import shutil
+import hashlib
+import threading
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_canvas import PFCanvas
+from picframe_disk_cache import PFDiskCache
+
+
+class PFStaging:
+    """
+    Read-ahead copies of the next image files.
+    """
+    initialized = False
+    staging_dir = None
+    stager = None
+    staged_q = None
+    staged = {}
+    staged_bytes = 0
+    # How many times each staged file is queued to be shown.
+    refs = {}
+    lock = threading.Lock()
+
+    hits = 0
+    misses = 0
+    files_copied = 0
+    bytes_copied = 0
+
+    # Size of each read when copying.
+    COPY_BUFFER_BYTES = 1024 * 1024
+
+    TMP_SUFFIX = '.tmp'
+
+    ############################################################
+    #
+    # init
+    #
+    @staticmethod
+    def init(image_file_gen):
+        """
+        Empty the staging directory and start staging files from the
+        generator.
+
+        Returns:
+            A generator yielding the same files, each once it is staged.
+        """
+        PFStaging.staging_dir = PFEnv.path_to_platform(os.path.expanduser(PFSettings.staging_dir))
+        try:
+            shutil.rmtree(PFStaging.staging_dir, ignore_errors=True)
+            os.makedirs(PFStaging.staging_dir)
+        except OSError as exc:
+            PFEnv.logger.warning("Not staging images, could not create %s: %s" %
+                    (PFStaging.staging_dir, str(exc)))
+            return image_file_gen
+
+        PFStaging.staged_q = queue.Queue(maxsize=PFSettings.staging_files)
+        PFStaging.stager = threading.Thread(target=PFStaging.stage_main,
+                args=(image_file_gen,), name="picframe_staging", daemon=True)
+        PFStaging.stager.start()
+        PFStaging.initialized = True
+        return PFStaging.get_next_file()
+
+    ############################################################
+    #
+    # stage_main
+    #
+    @staticmethod
+    def stage_main(image_file_gen):
+        """
+        Stage each file from the generator, blocking when staging_files
+        are waiting to be read.  Queue entries are (image_file, exc), exc
+        being set if the generator raised.
+        """
+        PFEnv.setup_logger()
+        while True:
+            try:
+                image_file = next(image_file_gen)
+            except Exception as exc:
+                PFStaging.staged_q.put((None, exc))
+                return
+
+            if PFEnv.is_format_supported(image_file):
+                PFStaging.stage_file(image_file)
+            PFStaging.staged_q.put((image_file, None))
+
+    ############################################################
+    #
+    # get_next_file
+    #
+    @staticmethod
+    def get_next_file():
+        """
+        Yield the staged files in the order the generator gave them.
+        """
+        while True:
+            image_file, exc = PFStaging.staged_q.get()
+            if exc is not None:
+                raise exc
+            yield image_file
+
+    ############################################################
+    #
+    # stage_file
+    #
+    @staticmethod
+    def stage_file(image_file):
+        """
+        Copy an image file to the staging directory, unless it has a
+        rendition already or there isn't room for it.
+        """
+        try:
+            stat = os.stat(image_file)
+        except OSError:
+            return
+
+        if PFDiskCache.initialized and \
+                PFDiskCache.contains(image_file, stat, PFCanvas.width, PFCanvas.height):
+            return
+        with PFStaging.lock:
+            if image_file in PFStaging.staged:
+                PFStaging.refs[image_file] = PFStaging.refs[image_file] + 1
+                return
+            if PFStaging.staged_bytes + stat.st_size > PFSettings.staging_bytes:
+                return
+
+        name = hashlib.sha1(image_file.encode('utf-8', 'surrogateescape')).hexdigest()
+        filename, file_extension = os.path.splitext(image_file)
+        staged_path = os.path.join(PFStaging.staging_dir, name + file_extension.lower())
+        tmp_path = staged_path + PFStaging.TMP_SUFFIX
+        try:
+            with open(image_file, 'rb') as src, open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, PFStaging.COPY_BUFFER_BYTES)
+            os.replace(tmp_path, staged_path)
+        except OSError as exc:
+            PFEnv.logger.warning("Could not stage %s: %s" % (image_file, str(exc)))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with PFStaging.lock:
+            PFStaging.staged[image_file] = (staged_path, stat)
+            PFStaging.refs[image_file] = 1
+            PFStaging.staged_bytes = PFStaging.staged_bytes + stat.st_size
+            PFStaging.files_copied = PFStaging.files_copied + 1
+            PFStaging.bytes_copied = PFStaging.bytes_copied + stat.st_size
+
+    ############################################################
+    #
+    # get
+    #
+    @staticmethod
+    def get(image_file):
+        """
+        Get the staged copy of an image file.
+
+        Returns:
+            (staged_path, stat of the original when it was staged), or
+            None if it isn't staged.
+        """
+        with PFStaging.lock:
+            return PFStaging.staged.get(image_file)
+
+    ############################################################
+    #
+    # count_read
+    #
+    @staticmethod
+    def count_read(staged):
+        """
+        Count an image file being read from its staged copy or not.
+        """
+        with PFStaging.lock:
+            if staged:
+                PFStaging.hits = PFStaging.hits + 1
+            else:
+                PFStaging.misses = PFStaging.misses + 1
+
+    ############################################################
+    #
+    # release
+    #
+    @staticmethod
+    def release(image_file):
+        """
+        Remove the staged copy of an image file once it has been shown
+        as many times as it was queued.  Files that aren't staged are
+        ignored.
+        """
+        with PFStaging.lock:
+            count = PFStaging.refs.get(image_file)
+            if count is None:
+                return
+            if count > 1:
+                PFStaging.refs[image_file] = count - 1
+                return
+            del PFStaging.refs[image_file]
+            staged = PFStaging.staged.pop(image_file)
+            staged_path, stat = staged
+            PFStaging.staged_bytes = PFStaging.staged_bytes - stat.st_size
+        try:
+            os.remove(staged_path)
+        except FileNotFoundError:
+            pass
+
+    ############################################################
+    #
+    # get_stats_str
+    #
+    @staticmethod
+    def get_stats_str():
+        """
+        Get a string of the staging statistics.
+        """
+        if not PFStaging.initialized:
+            return ''
+
+        with PFStaging.lock:
+            lookups = PFStaging.hits + PFStaging.misses
+            hit_rate = 100.0 * PFStaging.hits / lookups if lookups else 0.0
+            outstr = \
+            ("%-20s: %s" % ("staged_files", str(len(PFStaging.staged)))) + os.linesep + \
+            ("%-20s: %.1f%%" % ("staging_hit_rate", hit_rate)) + os.linesep + \
+            ("%-20s: %s" % ("staging_copied", str(PFStaging.files_copied))) + os.linesep + \
+            ("%-20s: %s" % ("staging_bytes", str(PFStaging.bytes_copied))) + os.linesep
+        return outstr
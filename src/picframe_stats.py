@@ -0,0 +1,228 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_stats.py
+
+Time each stage of getting an image onto the screen.  Every displayed
+image produces one record (path, bytes, source size and milliseconds per
+stage) which is logged, and the last stats_window values of each stage
+are kept to report the 50th, 95th and 99th percentiles.
+
+A record follows the image from the thread that finds and decodes it
+to the tkinter thread that displays it.
+
+Counters hold figures that aren't per image, such as how fast each image
+path was walked.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+
+
+class PFStats:
+    """
+    Per-image stage timings and their rolling percentiles.
+    """
+    local = threading.local()
+    windows = OrderedDict()
+    counters = OrderedDict()
+    images = 0
+    lock = threading.Lock()
+
+    PERCENTILES = (50, 95, 99)
+
+    ############################################################
+    #
+    # begin
+    #
+    @staticmethod
+    def begin(path=None):
+        """
+        Start a new record for this thread.
+        """
+        PFStats.local.record = {'path': path, 'bytes': None,
+                'source_size': None, 'stages': OrderedDict()}
+        return PFStats.local.record
+
+    ############################################################
+    #
+    # is_active
+    #
+    @staticmethod
+    def is_active():
+        """
+        Returns whether this thread has a record started.
+        """
+        return getattr(PFStats.local, 'record', None) is not None
+
+    ############################################################
+    #
+    # resume
+    #
+    @staticmethod
+    def resume(record):
+        """
+        Continue a record started in another thread.
+        """
+        PFStats.local.record = record
+
+    ############################################################
+    #
+    # detach
+    #
+    @staticmethod
+    def detach():
+        """
+        Stop recording in this thread, returning the record so it can be
+        handed to another thread.
+        """
+        record = getattr(PFStats.local, 'record', None)
+        PFStats.local.record = None
+        return record
+
+    ############################################################
+    #
+    # set
+    #
+    @staticmethod
+    def set(name, value):
+        """
+        Set a field of this thread's record, if there is one.
+        """
+        record = getattr(PFStats.local, 'record', None)
+        if record is not None:
+            record[name] = value
+
+    ############################################################
+    #
+    # add_stage
+    #
+    @staticmethod
+    def add_stage(name, seconds):
+        """
+        Add time to a stage of this thread's record, if there is one.
+        """
+        record = getattr(PFStats.local, 'record', None)
+        if record is not None:
+            stages = record['stages']
+            stages[name] = round(stages.get(name, 0.0) + seconds * 1000, 3)
+
+    ############################################################
+    #
+    # stage
+    #
+    @staticmethod
+    @contextmanager
+    def stage(name):
+        """
+        Time the enclosed block as a stage:
+            with PFStats.stage('decode'):
+                ...
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            PFStats.add_stage(name, time.monotonic() - start)
+
+    ############################################################
+    #
+    # finish
+    #
+    @staticmethod
+    def finish():
+        """
+        Finish this thread's record: log it and add its stages to the
+        rolling windows.
+        """
+        record = PFStats.detach()
+        if record is None:
+            return
+
+        # queue_wait overlaps the prefetch thread's stages, so it is not
+        # part of the total work done for the image.
+        stages = record['stages']
+        stages['total'] = round(sum(msecs for name, msecs in stages.items()
+                if name != 'queue_wait'), 3)
+        with PFStats.lock:
+            PFStats.images = PFStats.images + 1
+            for name, msecs in stages.items():
+                if name not in PFStats.windows:
+                    PFStats.windows[name] = deque(maxlen=PFSettings.stats_window)
+                PFStats.windows[name].append(msecs)
+
+        PFEnv.logger.info(json.dumps(record))
+
+    ############################################################
+    #
+    # set_counter
+    #
+    @staticmethod
+    def set_counter(name, value):
+        """
+        Set a counter shown with the stage timings.
+        """
+        with PFStats.lock:
+            PFStats.counters[name] = value
+
+    ############################################################
+    #
+    # get_percentiles
+    #
+    @staticmethod
+    def get_percentiles(name):
+        """
+        Get the (p50, p95, p99) of a stage's recent values in ms.
+        """
+        with PFStats.lock:
+            values = sorted(PFStats.windows.get(name, ()))
+        if not values:
+            return None
+
+        result = []
+        for percentile in PFStats.PERCENTILES:
+            index = min(len(values) - 1, (len(values) * percentile) // 100)
+            result.append(values[index])
+        return tuple(result)
+
+    ############################################################
+    #
+    # get_stats_str
+    #
+    @staticmethod
+    def get_stats_str():
+        """
+        Get a string of the p50/p95/p99 of each stage, in ms, and the
+        counters.
+        """
+        outstr = \
+        ("%-20s: %s" % ("images_timed", str(PFStats.images))) + os.linesep + \
+        ("%-20s: %s" % ("stage", "p50 / p95 / p99")) + os.linesep
+        with PFStats.lock:
+            names = list(PFStats.windows.keys())
+
+        for name in names:
+            p50, p95, p99 = PFStats.get_percentiles(name)
+            outstr = outstr + ("%-20s: %.1f / %.1f / %.1f ms" % (name, p50, p95, p99)) + os.linesep
+
+        with PFStats.lock:
+            counters = list(PFStats.counters.items())
+        for name, value in counters:
+            outstr = outstr + ("%-20s: %s" % (name, str(value))) + os.linesep
+        return outstr
@@ -0,0 +1,347 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_walker.py
+
+Walk the image directories with os.scandir, yielding the supported image
+files as they are found.  The file type comes from the directory entry,
+so no file is stat'ed just to find out whether it is a directory, and
+the extension is checked against a set instead of calling
+PFEnv.is_format_supported() for every file.  Unsupported files (e.g.
+.xmp sidecars) are logged once per directory as a count, rather than
+once per file on every pass.
+
+walk_roots() walks several image paths at once with a small pool of
+threads, so a slow network share doesn't hold up a fast local disk,
+and merges what they find into one stream that takes from each path in
+turn.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_stats import PFStats
+
+
+class PFWalker:
+    """
+    Streaming directory walker for the filesystem image source.
+    """
+    extensions = frozenset()
+    extensions_from = None
+    reported_dirs = set()
+    lock = threading.Lock()
+
+    # How many entries walk_roots() buffers for each image path before
+    # its threads wait for the reader to catch up.
+    MAX_BUFFERED = 1000
+
+    ############################################################
+    #
+    # get_extensions
+    #
+    @staticmethod
+    def get_extensions():
+        """
+        Get the set of supported extensions, lower case with the dot.
+        """
+        if PFWalker.extensions_from is not PFEnv.supported_types:
+            PFWalker.extensions = frozenset(ext.lower() for ext in PFEnv.supported_types)
+            PFWalker.extensions_from = PFEnv.supported_types
+        return PFWalker.extensions
+
+    ############################################################
+    #
+    # is_supported_name
+    #
+    @staticmethod
+    def is_supported_name(name, extensions):
+        """
+        Returns whether a file name has a supported extension.  Like
+        os.path.splitext, a leading dot doesn't start an extension.
+        """
+        dot = name.rfind('.')
+        return dot > 0 and name[dot:].lower() in extensions
+
+    ############################################################
+    #
+    # report_unsupported
+    #
+    @staticmethod
+    def report_unsupported(dirpath, count):
+        """
+        Log the number of unsupported files in a directory, the first
+        time the directory is walked.
+        """
+        with PFWalker.lock:
+            if dirpath in PFWalker.reported_dirs:
+                return
+            PFWalker.reported_dirs.add(dirpath)
+        PFEnv.logger.warning("%d files with unsupported formats in '%s'." % (count, dirpath))
+
+    ############################################################
+    #
+    # list_dir
+    #
+    @staticmethod
+    def list_dir(dirpath):
+        """
+        List one directory.
+        Returns:
+            (files, subdirs) where files are the DirEntry of each
+            supported image file and subdirs are the subdirectory paths.
+        Raises:
+            OSError if the directory can't be read.
+        """
+        extensions = PFWalker.get_extensions()
+        files = []
+        subdirs = []
+        unsupported = 0
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                try:
+                    # Like os.walk, don't follow symlinks to directories.
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                if PFWalker.is_supported_name(entry.name, extensions):
+                    files.append(entry)
+                else:
+                    unsupported = unsupported + 1
+
+        if unsupported:
+            PFWalker.report_unsupported(dirpath, unsupported)
+        return files, subdirs
+
+    ############################################################
+    #
+    # walk
+    #
+    @staticmethod
+    def walk(root, on_dir=None):
+        """
+        Yield a DirEntry for each supported image file under root,
+        depth first, a directory at a time.  root may also be a single
+        file.  Directories that can't be read are logged and skipped.
+        Inputs:
+            root: The directory (or file) to walk.
+            on_dir: Optional function called with each directory's path
+                just before it is listed.
+        """
+        if os.path.isfile(root):
+            if PFWalker.is_supported_name(os.path.basename(root), PFWalker.get_extensions()):
+                yield PFWalkerFile(root)
+            else:
+                PFWalker.report_unsupported(root, 1)
+            return
+
+        pending = [root]
+        while pending:
+            dirpath = pending.pop()
+            if on_dir is not None:
+                on_dir(dirpath)
+            try:
+                files, subdirs = PFWalker.list_dir(dirpath)
+            except OSError as exc:
+                PFEnv.logger.warning("Could not read directory '%s': %s" % (dirpath, str(exc)))
+                continue
+
+            yield from files
+
+            # Reversed so that the stack visits subdirectories in the
+            # order scandir returned them.
+            pending.extend(reversed(subdirs))
+
+
+    ############################################################
+    #
+    # walk_roots
+    #
+    @staticmethod
+    def walk_roots(roots, on_dir=None, report=True):
+        """
+        Walk several image paths at once with walker_threads threads,
+        yielding a DirEntry for each supported image file.  The entries
+        are taken from each path in turn, so every path gets its share
+        of the stream while any are still being walked.  The threads
+        also split up the subdirectories of a single path.  on_dir is as
+        for walk(), but is called from the walker threads.
+
+        With report, the entries per second found under each path are
+        logged and kept as a PFStats counter.
+        """
+        walk = PFWalkerPool(roots, on_dir, report)
+        try:
+            yield from walk.entries()
+        finally:
+            walk.stop()
+
+
+class PFWalkerFile:
+    """
+    Stands in for a DirEntry when an image path is a single file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+
+    def stat(self):
+        return os.stat(self.path)
+
+
+class PFWalkerPool:
+    """
+    The state of one walk_roots() walk, shared by its threads.
+    """
+
+    def __init__(self, roots, on_dir, report):
+        self.roots = list(roots)
+        self.on_dir = on_dir
+        self.report_speed = report
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.busy = {}
+        self.found = {}
+        self.entry_count = {}
+        self.finished = set()
+        self.next_root = 0
+        self.next_out = 0
+        self.stopped = False
+        self.start = time.monotonic()
+
+        for root in self.roots:
+            self.pending[root] = []
+            self.busy[root] = 0
+            self.found[root] = deque()
+            self.entry_count[root] = 0
+            if os.path.isfile(root):
+                self.found[root].extend(PFWalker.walk(root))
+                self.entry_count[root] = len(self.found[root])
+            else:
+                self.pending[root].append(root)
+
+        self.threads = []
+        for i in range(max(1, PFSettings.walker_threads)):
+            thread = threading.Thread(target=self.walk_main,
+                    name="picframe_walker", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def is_done(self, root):
+        """
+        Returns whether a path has been walked.  Call with cond held.
+        """
+        return not self.pending[root] and self.busy[root] == 0
+
+    def pick_root(self):
+        """
+        Pick the next path with a directory to list and room in its
+        buffer, going round them in turn.  Call with cond held.
+        """
+        for i in range(len(self.roots)):
+            root = self.roots[(self.next_root + i) % len(self.roots)]
+            if self.pending[root] and len(self.found[root]) < PFWalker.MAX_BUFFERED:
+                self.next_root = (self.next_root + i + 1) % len(self.roots)
+                return root
+        return None
+
+    def walk_main(self):
+        """
+        List directories until every path has been walked.
+        """
+        while True:
+            with self.cond:
+                while True:
+                    if self.stopped:
+                        return
+                    root = self.pick_root()
+                    if root is not None:
+                        break
+                    if all(self.is_done(root) for root in self.roots):
+                        return
+                    self.cond.wait()
+                dirpath = self.pending[root].pop()
+                self.busy[root] = self.busy[root] + 1
+
+            files = []
+            subdirs = []
+            try:
+                if self.on_dir is not None:
+                    self.on_dir(dirpath)
+                files, subdirs = PFWalker.list_dir(dirpath)
+            except OSError as exc:
+                PFEnv.logger.warning("Could not read directory '%s': %s" % (dirpath, str(exc)))
+
+            with self.cond:
+                self.pending[root].extend(reversed(subdirs))
+                self.found[root].extend(files)
+                self.entry_count[root] = self.entry_count[root] + len(files) + len(subdirs)
+                self.busy[root] = self.busy[root] - 1
+                if self.report_speed and self.is_done(root):
+                    self.report(root)
+                self.cond.notify_all()
+
+    def report(self, root):
+        """
+        Log and count how fast a path was walked.  Call with cond held.
+        """
+        if root in self.finished:
+            return
+        self.finished.add(root)
+        elapsed = max(time.monotonic() - self.start, 0.001)
+        count = self.entry_count[root]
+        PFEnv.logger.info("Walked '%s': %d entries in %.1f seconds, %.0f/s" %
+                (root, count, elapsed, count / elapsed))
+        PFStats.set_counter("walk " + root, "%.0f entries/s" % (count / elapsed,))
+
+    def entries(self):
+        """
+        Yield the entries found, taking from each path in turn.
+        """
+        while True:
+            with self.cond:
+                while True:
+                    root = None
+                    for i in range(len(self.roots)):
+                        index = (self.next_out + i) % len(self.roots)
+                        if self.found[self.roots[index]]:
+                            root = self.roots[index]
+                            self.next_out = (index + 1) % len(self.roots)
+                            break
+                    if root is not None:
+                        break
+                    if all(self.is_done(root) for root in self.roots):
+                        return
+                    self.cond.wait()
+
+                entry = self.found[root].popleft()
+                # Wake the threads if they were waiting for room.
+                if len(self.found[root]) == PFWalker.MAX_BUFFERED - 1:
+                    self.cond.notify_all()
+            yield entry
+
+    def stop(self):
+        """
+        Stop the threads, e.g. when the reader stops early.
+        """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
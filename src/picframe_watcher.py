@@ -0,0 +1,347 @@
+# Project Picframe
+# Copyright 2021, Alef Solutions, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+picframe_watcher.py
+
+Notice changes under the image paths within seconds, without walking
+them all again, and bring just the changed directories up to date in
+the catalog.
+
+On local disks this uses linux inotify.  inotify doesn't see changes
+made by other machines to a network mount, so on NFS, SMB and the like
+(and on other platforms) the mtime of every catalogued directory is
+checked every catalog_poll_interval seconds instead.  Adding, removing
+or renaming a file changes its directory's mtime.  Overwriting a file
+in place doesn't, so the files of directories that changed in the last
+POLL_RECENT_SECONDS are checked as well.  An overwrite in an older
+directory is left for the full rescan.
+"""
+
+import os
+import re
+import sys
+import time
+import errno
+import select
+import sqlite3
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_catalog import PFCatalog
+
+
+class PFWatcher:
+    """
+    Watch the image paths and pass changed directories to
+    PFCatalog.sync_dir().
+    """
+    initialized = False
+    watcher = None
+    libc = None
+    inotify_fd = None
+    watches = {}
+    inotify_roots = []
+    poll_roots = []
+    dirty = set()
+    last_event = 0.0
+
+    # File systems where inotify doesn't see changes from other hosts.
+    NETWORK_FS_TYPES = frozenset(('nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'ncpfs',
+            'afs', 'ceph', 'glusterfs', '9p', 'davfs', 'sshfs'))
+
+    # inotify event bits, from <sys/inotify.h>.
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+            IN_DELETE | IN_ONLYDIR
+
+    EVENT_HEADER = struct.Struct('iIII')
+
+    # Photos are usually copied in a batch, so wait until a directory
+    # has been quiet this many seconds before syncing it.
+    SETTLE_SECONDS = 2.0
+
+    # When polling, the files themselves are only checked in
+    # directories whose mtime is this recent, as that is where photos
+    # are still being added and edited.  Statting every file on a
+    # network mount each poll would be too slow.
+    POLL_RECENT_SECONDS = 7 * 24 * 3600
+
+    ############################################################
+    #
+    # init
+    #
+    @staticmethod
+    def init():
+        """
+        Sort the image paths into watched and polled, and start the
+        watcher thread.
+        """
+        for root in PFCatalog.get_roots():
+            if PFWatcher.can_inotify(root):
+                PFWatcher.inotify_roots.append(root)
+            else:
+                PFWatcher.poll_roots.append(root)
+
+        if PFWatcher.inotify_roots:
+            PFWatcher.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            PFWatcher.inotify_fd = PFWatcher.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if PFWatcher.inotify_fd < 0:
+                PFEnv.logger.warning("inotify not available: %s, polling instead" %
+                        (os.strerror(ctypes.get_errno()),))
+                PFWatcher.inotify_fd = None
+                PFWatcher.poll_roots.extend(PFWatcher.inotify_roots)
+                PFWatcher.inotify_roots = []
+
+        PFEnv.logger.info("Watching %s, polling %s for changes" %
+                (str(PFWatcher.inotify_roots), str(PFWatcher.poll_roots)))
+        PFWatcher.initialized = True
+        PFWatcher.watcher = threading.Thread(target=PFWatcher.watch_main,
+                name="picframe_watcher", daemon=True)
+        PFWatcher.watcher.start()
+
+    ############################################################
+    #
+    # get_fs_type
+    #
+    @staticmethod
+    def get_fs_type(path):
+        """
+        Get the type of the file system path is on, from /proc/mounts,
+        or None if it can't be found.
+        """
+        path = os.path.realpath(path)
+        fs_type = None
+        mount_len = -1
+        try:
+            with open('/proc/mounts') as mounts:
+                for line in mounts:
+                    fields = line.split()
+                    if len(fields) < 3:
+                        continue
+                    # Spaces and the like are written as octal escapes.
+                    mount_point = re.sub(r'\\([0-7]{3})',
+                            lambda match: chr(int(match.group(1), 8)), fields[1])
+                    if path == mount_point or \
+                            path.startswith(os.path.join(mount_point, '')):
+                        if len(mount_point) > mount_len:
+                            fs_type = fields[2]
+                            mount_len = len(mount_point)
+        except OSError:
+            return None
+        return fs_type
+
+    ############################################################
+    #
+    # can_inotify
+    #
+    @staticmethod
+    def can_inotify(root):
+        """
+        Returns whether changes under root can be watched with inotify.
+        """
+        if sys.platform not in ("linux", "linux2"):
+            return False
+        fs_type = PFWatcher.get_fs_type(root)
+        if fs_type is None:
+            return False
+        return fs_type not in PFWatcher.NETWORK_FS_TYPES and not fs_type.startswith('fuse.')
+
+    ############################################################
+    #
+    # add_watch
+    #
+    @staticmethod
+    def add_watch(dirpath):
+        """
+        Start watching a directory.  Returns False if it couldn't be
+        watched, e.g. because fs.inotify.max_user_watches was reached.
+        """
+        wd = PFWatcher.libc.inotify_add_watch(PFWatcher.inotify_fd,
+                os.fsencode(dirpath), PFWatcher.WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOENT:
+                return True
+            PFEnv.logger.warning("Could not watch '%s': %s" % (dirpath, os.strerror(err)))
+            return False
+        PFWatcher.watches[wd] = dirpath
+        return True
+
+    ############################################################
+    #
+    # start_watches
+    #
+    @staticmethod
+    def start_watches():
+        """
+        Watch every catalogued directory under the inotify roots.  Any
+        directory that changed between the scan and its watch being
+        added is synced.  A root that can't be fully watched is polled
+        instead.
+        """
+        for root in list(PFWatcher.inotify_roots):
+            for dirpath, mtime in PFCatalog.get_dirs(root):
+                if not PFWatcher.add_watch(dirpath):
+                    PFEnv.logger.warning("Polling '%s' instead of watching it" % (root,))
+                    PFWatcher.inotify_roots.remove(root)
+                    PFWatcher.poll_roots.append(root)
+                    break
+                try:
+                    if os.stat(dirpath).st_mtime_ns != mtime:
+                        PFWatcher.dirty.add(dirpath)
+                except OSError:
+                    pass
+
+    ############################################################
+    #
+    # read_events
+    #
+    @staticmethod
+    def read_events():
+        """
+        Read the pending inotify events, marking the directories they
+        happened in as dirty.
+        """
+        try:
+            data = os.read(PFWatcher.inotify_fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset + PFWatcher.EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, name_len = PFWatcher.EVENT_HEADER.unpack_from(data, offset)
+            offset = offset + PFWatcher.EVENT_HEADER.size + name_len
+
+            if mask & PFWatcher.IN_Q_OVERFLOW:
+                PFEnv.logger.warning("Too many changes to watch, rescanning")
+                PFCatalog.request_rescan()
+            elif mask & PFWatcher.IN_IGNORED:
+                PFWatcher.watches.pop(wd, None)
+            elif wd in PFWatcher.watches:
+                PFWatcher.dirty.add(PFWatcher.watches[wd])
+                PFWatcher.last_event = time.monotonic()
+
+    ############################################################
+    #
+    # sync_dirty
+    #
+    @staticmethod
+    def sync_dirty():
+        """
+        Sync the dirty directories and watch any new ones.  A new
+        directory is synced again once it is watched, in case files
+        arrived before the watch did.
+        """
+        dirty = PFWatcher.dirty
+        PFWatcher.dirty = set()
+        for dirpath in dirty:
+            new_dirs = PFCatalog.sync_dir(dirpath)
+            if PFWatcher.inotify_fd is None:
+                continue
+            for new_dir in new_dirs:
+                if PFWatcher.add_watch(new_dir):
+                    PFWatcher.dirty.add(new_dir)
+
+    ############################################################
+    #
+    # poll
+    #
+    @staticmethod
+    def poll():
+        """
+        Sync the directories under the polled roots whose mtime changed,
+        or that changed recently and have a file that was overwritten.
+        A root that can't be reached, e.g. a mount that is down, is
+        skipped.
+        """
+        recent_ns = (time.time() - PFWatcher.POLL_RECENT_SECONDS) * 1e9
+        for root in PFWatcher.poll_roots:
+            if not os.path.isdir(root):
+                continue
+            for dirpath, mtime in PFCatalog.get_dirs(root):
+                try:
+                    if os.stat(dirpath).st_mtime_ns == mtime:
+                        if mtime is None or mtime < recent_ns or \
+                                not PFWatcher.files_changed(dirpath):
+                            continue
+                except FileNotFoundError:
+                    # Its parent's mtime has changed too.
+                    continue
+                except OSError:
+                    continue
+                PFCatalog.sync_dir(dirpath)
+
+    ############################################################
+    #
+    # files_changed
+    #
+    @staticmethod
+    def files_changed(dirpath):
+        """
+        Returns whether any catalogued file in dirpath has a different
+        size or mtime than the catalog has for it.  A file that is gone
+        changes the directory's mtime, so it isn't looked for here.
+        """
+        for path, size, mtime in PFCatalog.get_dir_files(dirpath):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                return True
+        return False
+
+    ############################################################
+    #
+    # watch_main
+    #
+    @staticmethod
+    def watch_main():
+        """
+        Wait for the first catalog scan, then watch and poll for
+        changes.
+        """
+        PFEnv.setup_logger()
+        PFCatalog.first_scan_done.wait()
+        if PFWatcher.inotify_fd is not None:
+            PFWatcher.start_watches()
+
+        next_poll = time.monotonic() + PFSettings.catalog_poll_interval
+        while True:
+            timeout = 1.0
+            if PFWatcher.inotify_fd is not None:
+                ready, unused, unused = select.select([PFWatcher.inotify_fd], [], [], timeout)
+                if ready:
+                    PFWatcher.read_events()
+            else:
+                time.sleep(timeout)
+
+            now = time.monotonic()
+            try:
+                if PFWatcher.dirty and now - PFWatcher.last_event >= PFWatcher.SETTLE_SECONDS:
+                    PFWatcher.sync_dirty()
+                if PFWatcher.poll_roots and now >= next_poll:
+                    PFWatcher.poll()
+                    next_poll = time.monotonic() + PFSettings.catalog_poll_interval
+            except (OSError, sqlite3.Error) as exc:
+                PFEnv.logger.error("Catalog update failed: %s" % (str(exc),))
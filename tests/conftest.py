@@ -0,0 +1,45 @@
+import os
+import sys
+import threading
+from collections import deque
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_catalog import PFCatalog
+from picframe_image_source import PFChangeLog
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    """
+    A catalog of an empty image path under tmp_path, with no background
+    scan; tests call PFCatalog.scan() themselves.  Yields the image path.
+    """
+    root = str(tmp_path / 'photos')
+    os.makedirs(root)
+    monkeypatch.setattr(PFSettings, 'image_paths', (root,))
+    monkeypatch.setattr(PFSettings, 'catalog_path', str(tmp_path / 'catalog.db'))
+    monkeypatch.setattr(PFSettings, 'hash_images', False)
+    monkeypatch.setattr(PFSettings, 'perceptual_hash', False)
+    if PFEnv.logger is None:
+        PFEnv.setup_logger()
+    PFEnv.set_supported_types()
+
+    monkeypatch.setattr(PFCatalog, 'local', threading.local())
+    monkeypatch.setattr(PFCatalog, 'scan_main', staticmethod(lambda: None))
+    monkeypatch.setattr(PFCatalog, 'added', deque())
+    monkeypatch.setattr(PFCatalog, 'removed', set())
+    monkeypatch.setattr(PFCatalog, 'changes', PFChangeLog())
+    monkeypatch.setattr(PFCatalog, 'current_scan_id', 0)
+    monkeypatch.setattr(PFCatalog, 'position_index', None)
+    monkeypatch.setattr(PFCatalog, 'initialized', False)
+    monkeypatch.setattr(PFCatalog, 'scanning', False)
+    PFCatalog.init()
+    PFCatalog.scanner.join()
+    PFCatalog.scanning = False
+    yield root
+    PFCatalog.get_conn().close()
@@ -0,0 +1,96 @@
+"""
+Choosing from an image's header whether, and at what scale, it is
+decoded within max_decoded_image_bytes.
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import pytest
+from PIL import Image
+
+if sys.platform in ("linux", "linux2"):
+    pytest.importorskip('pyheif')
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_admission import PFAdmission
+
+
+@pytest.fixture(autouse=True)
+def admission(monkeypatch):
+    if PFEnv.logger is None:
+        PFEnv.setup_logger()
+    monkeypatch.setattr(PFAdmission, 'headers', OrderedDict())
+    monkeypatch.setattr(PFAdmission, 'lock', threading.Lock())
+    monkeypatch.setattr(PFAdmission, 'rejected', 0)
+    monkeypatch.setattr(PFAdmission, 'reduced', 0)
+
+
+def save(tmp_path, name, mode, size):
+    path = str(tmp_path / name)
+    Image.new(mode, size).save(path)
+    return path
+
+
+def get_scale(path):
+    return PFAdmission.get_decode_scale(path, os.stat(path), os.path.splitext(path)[1])
+
+
+def test_fits(tmp_path, monkeypatch):
+    monkeypatch.setattr(PFSettings, 'max_decoded_image_bytes', 1000 * 800 * 4)
+    assert get_scale(save(tmp_path, 'a.jpg', 'RGB', (1000, 800))) == 1
+    assert PFAdmission.take_counters() == (0, 0)
+
+
+@pytest.mark.parametrize('budget, scale', [
+    (1000 * 800 * 4 // 4, 2),
+    (1000 * 800 * 4 // 16, 4),
+    (1000 * 800 * 4 // 64, 8),
+    (1000 * 800 * 4 // 64 - 1, None),
+])
+def test_jpeg_scales(tmp_path, monkeypatch, budget, scale):
+    monkeypatch.setattr(PFSettings, 'max_decoded_image_bytes', budget)
+    assert get_scale(save(tmp_path, 'a.jpg', 'RGB', (1000, 800))) == scale
+    if scale is None:
+        assert PFAdmission.take_counters() == (1, 0)
+    else:
+        assert PFAdmission.take_counters() == (0, 1)
+
+
+def test_other_formats_not_reduced(tmp_path, monkeypatch):
+    monkeypatch.setattr(PFSettings, 'max_decoded_image_bytes', 1000 * 800 * 4 // 4)
+    assert get_scale(save(tmp_path, 'a.png', 'RGB', (1000, 800))) is None
+    # One byte a pixel fits where four don't.
+    assert get_scale(save(tmp_path, 'b.png', 'L', (1000, 800))) == 1
+    assert PFAdmission.take_counters() == (1, 0)
+
+
+def test_headers_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(PFSettings, 'max_decoded_image_bytes', 10 ** 9)
+    reads = []
+    read_header = PFAdmission.read_header
+
+    def counting(image_file, file_extension):
+        reads.append(image_file)
+        return read_header(image_file, file_extension)
+
+    monkeypatch.setattr(PFAdmission, 'read_header', staticmethod(counting))
+    path = save(tmp_path, 'a.png', 'RGB', (10, 10))
+    get_scale(path)
+    get_scale(path)
+    assert len(reads) == 1
+
+    # A new version of the file is read again.
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    get_scale(path)
+    assert len(reads) == 2
+
+
+def test_counters_from_another_process():
+    PFAdmission.add_counters((2, 3))
+    assert PFAdmission.take_counters() == (2, 3)
+    assert PFAdmission.take_counters() == (0, 0)
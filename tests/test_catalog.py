@@ -0,0 +1,105 @@
+"""
+Scanning, syncing and root changes through PFCatalog, over a temporary
+image path.
+"""
+
+import os
+
+from picframe_settings import PFSettings
+from picframe_catalog import PFCatalog
+
+
+def write(path, data=b'x'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as image_file:
+        image_file.write(data)
+
+
+def paths(root):
+    rows = PFCatalog.get_conn().execute("SELECT path FROM files ORDER BY path")
+    return [os.path.relpath(row[0], root) for row in rows]
+
+
+def test_scan(catalog):
+    write(os.path.join(catalog, 'a.jpg'))
+    write(os.path.join(catalog, 'notes.txt'))
+    write(os.path.join(catalog, 'Trip', 'b.png'))
+    PFCatalog.scan()
+    assert paths(catalog) == ['Trip/b.png', 'a.jpg']
+    assert PFCatalog.get_count() == 2
+
+    os.remove(os.path.join(catalog, 'a.jpg'))
+    write(os.path.join(catalog, 'c.jpg'))
+    PFCatalog.scan()
+    assert paths(catalog) == ['Trip/b.png', 'c.jpg']
+    assert PFCatalog.is_removed(os.path.join(catalog, 'a.jpg'))
+
+
+def test_sync_dir(catalog):
+    write(os.path.join(catalog, 'a.jpg'))
+    write(os.path.join(catalog, 'Trip', 'b.jpg'))
+    PFCatalog.scan()
+
+    write(os.path.join(catalog, 'c.jpg'))
+    write(os.path.join(catalog, 'New', 'Deep', 'd.jpg'))
+    os.remove(os.path.join(catalog, 'a.jpg'))
+    new_dirs = PFCatalog.sync_dir(catalog)
+    assert sorted(os.path.relpath(path, catalog) for path in new_dirs) == ['New', 'New/Deep']
+    assert paths(catalog) == ['New/Deep/d.jpg', 'Trip/b.jpg', 'c.jpg']
+    # New files are shown next.
+    assert sorted(PFCatalog.added) == [os.path.join(catalog, 'New', 'Deep', 'd.jpg'),
+            os.path.join(catalog, 'c.jpg')]
+
+    # A changed file keeps its place but loses what was read from it.
+    conn = PFCatalog.get_conn()
+    with conn:
+        conn.execute("UPDATE files SET hash = 'old'")
+    write(os.path.join(catalog, 'c.jpg'), b'longer')
+    PFCatalog.sync_dir(catalog)
+    assert conn.execute("SELECT hash FROM files WHERE path = ?",
+            (os.path.join(catalog, 'c.jpg'),)).fetchone() == (None,)
+
+    # A directory that is gone takes its files with it.
+    os.remove(os.path.join(catalog, 'Trip', 'b.jpg'))
+    os.rmdir(os.path.join(catalog, 'Trip'))
+    PFCatalog.sync_dir(catalog)
+    assert paths(catalog) == ['New/Deep/d.jpg', 'c.jpg']
+
+
+def test_remove_other_roots(catalog, tmp_path, monkeypatch):
+    sibling = catalog + '2'
+    write(os.path.join(catalog, 'a.jpg'))
+    write(os.path.join(sibling, 'b.jpg'))
+    monkeypatch.setattr(PFSettings, 'image_paths', (catalog, sibling))
+    PFCatalog.scan()
+    assert PFCatalog.get_count() == 2
+
+    # The sibling's name starts with the root's, but isn't under it.
+    conn = PFCatalog.get_conn()
+    monkeypatch.setattr(PFSettings, 'image_paths', (catalog,))
+    with conn:
+        PFCatalog.remove_other_roots(conn)
+    assert [row[0] for row in conn.execute("SELECT path FROM files")] == \
+            [os.path.join(catalog, 'a.jpg')]
+    assert [row[0] for row in conn.execute("SELECT path FROM dirs")] == [catalog]
+
+    monkeypatch.setattr(PFSettings, 'image_paths', ())
+    with conn:
+        PFCatalog.remove_other_roots(conn)
+    assert conn.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM dirs").fetchone()[0] == 0
+
+
+
+def test_get_file(catalog, monkeypatch):
+    monkeypatch.setattr(PFCatalog, 'BATCH_SIZE', 3)
+    for number in range(10):
+        write(os.path.join(catalog, '%d.jpg' % (number,)))
+    PFCatalog.scan()
+    in_order = [row[0] for row in PFCatalog.get_conn().execute(
+            "SELECT path FROM files ORDER BY id")]
+    assert [PFCatalog.get_file(position) for position in range(11)] == in_order + [None]
+
+    os.remove(in_order[4])
+    PFCatalog.sync_dir(catalog)
+    assert PFCatalog.get_file(4) == in_order[5]
@@ -0,0 +1,120 @@
+"""
+The rendition cache: what its keys depend on, saving and reading
+renditions, and evicting the least recently used.
+"""
+
+import os
+import threading
+from types import SimpleNamespace
+from collections import OrderedDict
+
+import pytest
+from PIL import Image
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_disk_cache import PFDiskCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(PFSettings, 'rendition_cache_dir', str(tmp_path / 'renditions'))
+    monkeypatch.setattr(PFSettings, 'rendition_cache_bytes', 10 ** 9)
+    if PFEnv.logger is None:
+        PFEnv.setup_logger()
+    monkeypatch.setattr(PFDiskCache, 'initialized', False)
+    monkeypatch.setattr(PFDiskCache, 'entries', OrderedDict())
+    monkeypatch.setattr(PFDiskCache, 'cache_bytes', 0)
+    monkeypatch.setattr(PFDiskCache, 'hits', 0)
+    monkeypatch.setattr(PFDiskCache, 'misses', 0)
+    monkeypatch.setattr(PFDiskCache, 'lock', threading.Lock())
+    PFDiskCache.init()
+    return str(tmp_path / 'renditions')
+
+
+def stat(size=1000, mtime=1):
+    return SimpleNamespace(st_size=size, st_mtime_ns=mtime)
+
+
+def noise(mode='RGB'):
+    return Image.effect_noise((64, 48), 50).convert(mode)
+
+
+def test_key(monkeypatch):
+    name = PFDiskCache.get_name('/a.jpg', stat(), 800, 480)
+    assert name == PFDiskCache.get_name('/a.jpg', stat(), 800, 480)
+    others = [
+        PFDiskCache.get_name('/b.jpg', stat(), 800, 480),
+        PFDiskCache.get_name('/a.jpg', stat(size=1001), 800, 480),
+        PFDiskCache.get_name('/a.jpg', stat(mtime=2), 800, 480),
+        PFDiskCache.get_name('/a.jpg', stat(), 480, 800),
+    ]
+    for setting, value in (('resample_profile', 'other'),
+            ('reduced_decode', not PFSettings.reduced_decode),
+            ('max_decoded_image_bytes', PFSettings.max_decoded_image_bytes + 1)):
+        with monkeypatch.context() as patch:
+            patch.setattr(PFSettings, setting, value)
+            others.append(PFDiskCache.get_name('/a.jpg', stat(), 800, 480))
+    assert len(set(others + [name])) == len(others) + 1
+
+
+def test_put_and_get(cache):
+    assert PFDiskCache.get('/a.jpg', stat(), 800, 480) is None
+    PFDiskCache.put('/a.jpg', stat(), 800, 480, noise())
+    PFDiskCache.put('/b.png', stat(), 800, 480, noise('RGBA'))
+    assert PFDiskCache.contains('/a.jpg', stat(), 800, 480)
+    assert not PFDiskCache.contains('/a.jpg', stat(mtime=2), 800, 480)
+
+    pil_img = PFDiskCache.get('/a.jpg', stat(), 800, 480)
+    assert (pil_img.mode, pil_img.size) == ('RGB', (64, 48))
+    # Transparency needs a lossless format.
+    pil_img = PFDiskCache.get('/b.png', stat(), 800, 480)
+    assert (pil_img.format, pil_img.mode) == ('PNG', 'RGBA')
+    assert (PFDiskCache.hits, PFDiskCache.misses) == (2, 1)
+    assert PFDiskCache.cache_bytes == sum(os.path.getsize(os.path.join(cache, name))
+            for name in os.listdir(cache))
+
+
+def test_bad_rendition_dropped(cache):
+    PFDiskCache.put('/a.jpg', stat(), 800, 480, noise())
+    name = PFDiskCache.get_name('/a.jpg', stat(), 800, 480)
+    with open(os.path.join(cache, name), 'wb') as rendition:
+        rendition.write(b'garbage')
+    assert PFDiskCache.get('/a.jpg', stat(), 800, 480) is None
+    assert not os.path.exists(os.path.join(cache, name))
+    assert not PFDiskCache.contains('/a.jpg', stat(), 800, 480)
+
+
+def test_evicts_least_recently_used(cache, monkeypatch):
+    PFDiskCache.put('/a.jpg', stat(), 800, 480, noise())
+    size = PFDiskCache.cache_bytes
+    monkeypatch.setattr(PFSettings, 'rendition_cache_bytes', size * 5 // 2)
+    PFDiskCache.put('/b.jpg', stat(), 800, 480, noise())
+    # Reading a rendition makes it the most recently used.
+    assert PFDiskCache.get('/a.jpg', stat(), 800, 480) is not None
+    PFDiskCache.put('/c.jpg', stat(), 800, 480, noise())
+
+    assert PFDiskCache.contains('/a.jpg', stat(), 800, 480)
+    assert not PFDiskCache.contains('/b.jpg', stat(), 800, 480)
+    assert PFDiskCache.contains('/c.jpg', stat(), 800, 480)
+    assert len(os.listdir(cache)) == 2
+    assert PFDiskCache.cache_bytes <= PFSettings.rendition_cache_bytes
+
+
+def test_init_reloads(cache, monkeypatch):
+    for number, image_file in enumerate(('/a.jpg', '/b.jpg', '/c.jpg')):
+        PFDiskCache.put(image_file, stat(), 800, 480, noise())
+        name = PFDiskCache.get_name(image_file, stat(), 800, 480)
+        os.utime(os.path.join(cache, name), (number, number))
+    leftover = os.path.join(cache, 'partial' + PFDiskCache.TMP_SUFFIX)
+    with open(leftover, 'wb') as tmp_file:
+        tmp_file.write(b'x')
+
+    # Restarted with room for two, the oldest used goes.
+    sizes = sorted(PFDiskCache.entries.values())
+    monkeypatch.setattr(PFSettings, 'rendition_cache_bytes', sizes[-1] + sizes[-2])
+    PFDiskCache.init()
+    assert not os.path.exists(leftover)
+    assert not PFDiskCache.contains('/a.jpg', stat(), 800, 480)
+    assert PFDiskCache.contains('/b.jpg', stat(), 800, 480)
+    assert PFDiskCache.contains('/c.jpg', stat(), 800, 480)
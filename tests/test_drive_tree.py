@@ -0,0 +1,194 @@
+"""
+Crawl, sync and delete through PFDriveTree, with PFFakeDriveBackend
+serving a temporary directory as the Drive.
+"""
+
+import os
+import threading
+
+import pytest
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_drive_backend import PFFakeDriveBackend
+from picframe_drive_tree import PFDriveTree
+
+
+class Changes:
+    """
+    Collects what PFDriveTree reports through on_change.
+    """
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+
+    def __call__(self, added, removed):
+        self.added.extend(title for file_id, title, md5 in added)
+        self.removed.extend(title for file_id, title, md5 in removed)
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as image_file:
+        image_file.write(data)
+
+
+def crawl():
+    PFDriveTree.start_crawl()
+    PFDriveTree.crawler.join()
+
+
+def sync():
+    PFDriveTree.update()
+    if PFDriveTree.crawler is not None:
+        PFDriveTree.crawler.join()
+
+
+def photos():
+    return sorted(title for file_id, title, md5 in PFDriveTree.get_photos())
+
+
+@pytest.fixture
+def drive(tmp_path, monkeypatch):
+    root = str(tmp_path / 'drive')
+    write(os.path.join(root, 'PicFrame', 'a.jpg'), b'a')
+    write(os.path.join(root, 'PicFrame', 'b.jpg'), b'b')
+    write(os.path.join(root, 'PicFrame', 'notes.txt'), b'notes')
+    write(os.path.join(root, 'PicFrame', 'Trip', 'c.jpg'), b'c')
+    write(os.path.join(root, 'Other', 'd.jpg'), b'd')
+
+    monkeypatch.setattr(PFSettings, 'gdrive_tree_path', str(tmp_path / 'gdrive.db'))
+    monkeypatch.setattr(PFSettings, 'gdrive_root_folder', 'PicFrame')
+    monkeypatch.setattr(PFSettings, 'gdrive_photos_folder', 'PicFrame')
+    monkeypatch.setattr(PFSettings, 'gdrive_list_threads', 2)
+    if PFEnv.logger is None:
+        PFEnv.setup_logger()
+    PFEnv.set_supported_types()
+
+    monkeypatch.setattr(PFDriveTree, 'local', threading.local())
+    monkeypatch.setattr(PFDriveTree, 'crawler', None)
+    monkeypatch.setattr(PFDriveTree, 'crawl_failures', 0)
+    monkeypatch.setattr(PFDriveTree, 'retry_time', 0)
+
+    backend = PFFakeDriveBackend(root)
+    changes = Changes()
+    PFDriveTree.init(backend, changes)
+    yield root, backend, changes
+    PFDriveTree.get_conn().close()
+
+
+def test_crawl(drive):
+    root, backend, changes = drive
+    crawl()
+    assert PFDriveTree.is_complete()
+    assert photos() == ['a.jpg', 'b.jpg', 'c.jpg']
+    assert PFDriveTree.photo_count == 3
+    assert sorted(changes.added) == ['a.jpg', 'b.jpg', 'c.jpg', 'notes.txt']
+
+
+def test_sync(drive):
+    root, backend, changes = drive
+    crawl()
+    changes.added.clear()
+
+    write(os.path.join(root, 'PicFrame', 'Trip', 'e.jpg'), b'e')
+    write(os.path.join(root, 'PicFrame', 'a.jpg'), b'a2')
+    os.remove(os.path.join(root, 'PicFrame', 'b.jpg'))
+    sync()
+    assert photos() == ['a.jpg', 'c.jpg', 'e.jpg']
+    assert PFDriveTree.photo_count == 3
+    assert sorted(changes.added) == ['a.jpg', 'e.jpg']
+    assert sorted(changes.removed) == ['a.jpg', 'b.jpg']
+
+
+def test_delete_folder(drive):
+    root, backend, changes = drive
+    crawl()
+
+    os.remove(os.path.join(root, 'PicFrame', 'Trip', 'c.jpg'))
+    os.rmdir(os.path.join(root, 'PicFrame', 'Trip'))
+    sync()
+    assert photos() == ['a.jpg', 'b.jpg']
+    assert changes.removed == ['c.jpg']
+
+
+def test_failed_crawl_keeps_tree(drive, monkeypatch):
+    root, backend, changes = drive
+    crawl()
+    token = PFDriveTree.get_state(PFDriveTree.get_conn(), 'change_token')
+
+    list_children = PFFakeDriveBackend.list_children
+
+    def failing(self, folder_id):
+        if folder_id != PFFakeDriveBackend.ROOT_ID:
+            raise ConnectionError("listing failed")
+        return list_children(self, folder_id)
+
+    monkeypatch.setattr(PFFakeDriveBackend, 'list_children', failing)
+    crawl()
+    assert PFDriveTree.crawl_failures == 1
+    assert PFDriveTree.get_state(PFDriveTree.get_conn(), 'change_token') == token
+    assert photos() == ['a.jpg', 'b.jpg', 'c.jpg']
+
+    # Not tried again until the wait is over.
+    sync()
+    assert PFDriveTree.crawl_failures == 1
+
+    monkeypatch.setattr(PFFakeDriveBackend, 'list_children', list_children)
+    os.remove(os.path.join(root, 'PicFrame', 'b.jpg'))
+    PFDriveTree.retry_time = 0
+    crawl()
+    assert PFDriveTree.crawl_failures == 0
+    assert photos() == ['a.jpg', 'c.jpg']
+    assert changes.removed == ['b.jpg']
+
+
+def test_failed_first_crawl(drive, monkeypatch):
+    root, backend, changes = drive
+
+    def failing(self, folder_id):
+        raise ConnectionError("listing failed")
+
+    monkeypatch.setattr(PFFakeDriveBackend, 'list_children', failing)
+    crawl()
+    assert not PFDriveTree.is_complete()
+    assert PFDriveTree.get_retry_wait() > 1
+    assert photos() == []
+
+
+def test_failed_sync_commits_nothing(drive, monkeypatch):
+    root, backend, changes = drive
+    crawl()
+    token = PFDriveTree.get_state(PFDriveTree.get_conn(), 'change_token')
+
+    write(os.path.join(root, 'PicFrame', 'New', 'f.jpg'), b'f')
+    write(os.path.join(root, 'PicFrame', 'New', 'Sub', 'g.jpg'), b'g')
+    list_changes = PFFakeDriveBackend.list_changes
+    list_children = PFFakeDriveBackend.list_children
+    listed = []
+
+    def failing(self, folder_id):
+        # Fail while the new folder is crawled, after its first page.
+        if listed and folder_id == os.path.join('PicFrame', 'New', 'Sub'):
+            raise ConnectionError("listing failed")
+        return list_children(self, folder_id)
+
+    def listing(self, token):
+        result = list_changes(self, token)
+        listed.append(token)
+        return result
+
+    monkeypatch.setattr(PFFakeDriveBackend, 'list_children', failing)
+    monkeypatch.setattr(PFFakeDriveBackend, 'list_changes', listing)
+    with pytest.raises(ConnectionError):
+        sync()
+    # Neither the new folder's first page nor the token was committed.
+    conn = PFDriveTree.get_conn()
+    assert PFDriveTree.get_state(conn, 'change_token') == token
+    assert conn.execute("SELECT COUNT(*) FROM nodes WHERE title IN ('New', 'f.jpg')"
+            ).fetchone()[0] == 0
+
+    monkeypatch.setattr(PFFakeDriveBackend, 'list_children', list_children)
+    sync()
+    assert photos() == ['a.jpg', 'b.jpg', 'c.jpg', 'f.jpg', 'g.jpg']
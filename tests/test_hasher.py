@@ -0,0 +1,144 @@
+"""
+Duplicate detection: content and perceptual hashes, and the catalog
+leaving out all but the first of each set of duplicates.
+"""
+
+import os
+import sys
+import sqlite3
+import itertools
+
+import pytest
+from PIL import Image
+
+from picframe_settings import PFSettings
+from picframe_env import PFEnv
+from picframe_catalog import PFCatalog
+from picframe_hasher import PFHasher
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as image_file:
+        image_file.write(data)
+
+
+def test_content_hash(tmp_path, monkeypatch):
+    monkeypatch.setattr(PFHasher, 'SAMPLE_BYTES', 4)
+    for name, data in (('a', b'0123456789abcdef'), ('b', b'0123456789abcdef'),
+            ('c', b'0123456789abcdeX'), ('d', b'0123X56789abcdef'), ('e', b'012345')):
+        write(str(tmp_path / name), data)
+
+    def content_hash(name):
+        path = str(tmp_path / name)
+        return PFHasher.get_content_hash(path, os.path.getsize(path))
+
+    assert content_hash('a') == content_hash('b')
+    assert content_hash('a')[1] == 12
+    # The end is sampled; the middle of a large file isn't all read.
+    assert content_hash('c')[0] != content_hash('a')[0]
+    assert content_hash('d')[0] == content_hash('a')[0]
+    # Up to three samples long, the file is hashed whole.
+    assert content_hash('e')[1] == 6
+
+
+def test_perceptual_hash():
+    # Brighter on the left all the way across.
+    gradient = Image.linear_gradient('L').rotate(-90).resize((90, 80))
+    assert PFHasher.get_perceptual_hash(gradient) == 'ffffffffffffffff'
+    assert PFHasher.get_perceptual_hash(gradient.resize((45, 40))) == 'ffffffffffffffff'
+    assert PFHasher.get_perceptual_hash(Image.new('L', (90, 80))) == '0000000000000000'
+
+
+def test_find_similar_hash():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE files (phash TEXT)")
+    conn.executemany("INSERT INTO files VALUES (?)",
+            [('00000000000000ff',), ('f0f0000000000000',), (None,)])
+    # Within PHASH_DISTANCE bits of a hash in the catalog.
+    assert PFHasher.find_similar_hash(conn, '00000000000000fe') == '00000000000000ff'
+    assert PFHasher.find_similar_hash(conn, '00000000000000f0') == '00000000000000ff'
+    assert PFHasher.find_similar_hash(conn, '0000000000000000') == '0000000000000000'
+    assert PFHasher.find_similar_hash(conn, 'f0f0000000000001') == 'f0f0000000000000'
+
+
+@pytest.fixture
+def hashed(catalog, monkeypatch):
+    monkeypatch.setattr(PFSettings, 'hash_images', True)
+    for name in ('a.jpg', 'b.jpg', 'c.jpg', 'd.jpg'):
+        write(os.path.join(catalog, name), name.encode())
+    PFCatalog.scan()
+    return catalog
+
+
+def set_hashes(root, column, values):
+    conn = PFCatalog.get_conn()
+    with conn:
+        for name, value in values.items():
+            conn.execute("UPDATE files SET %s = ? WHERE path = ?" % (column,),
+                    (value, os.path.join(root, name)))
+    PFCatalog.update_count(conn)
+
+
+def first(root, *names):
+    rows = PFCatalog.get_conn().execute("SELECT path FROM files ORDER BY id")
+    return [os.path.basename(row[0]) for row in rows if os.path.basename(row[0]) in names][0]
+
+
+def shown(root):
+    files = PFCatalog.get_next_file()
+    return sorted(os.path.basename(path) for path in itertools.islice(files, PFCatalog.get_count()))
+
+
+def test_duplicates_left_out(hashed):
+    set_hashes(hashed, 'hash', {'a.jpg': 'h1', 'b.jpg': 'h1', 'c.jpg': 'h2'})
+    # d.jpg isn't hashed yet, so isn't anyone's duplicate.
+    assert PFCatalog.get_count() == 3
+    assert shown(hashed) == sorted([first(hashed, 'a.jpg', 'b.jpg'), 'c.jpg', 'd.jpg'])
+
+
+def test_perceptual_duplicates(hashed, monkeypatch):
+    set_hashes(hashed, 'hash', {'a.jpg': 'h1', 'b.jpg': 'h2', 'c.jpg': 'h3', 'd.jpg': 'h4'})
+    set_hashes(hashed, 'phash', {'a.jpg': 'p1', 'c.jpg': 'p1'})
+    assert PFCatalog.get_count() == 4
+
+    monkeypatch.setattr(PFSettings, 'perceptual_hash', True)
+    PFCatalog.update_count(PFCatalog.get_conn())
+    assert PFCatalog.get_count() == 3
+    assert shown(hashed) == sorted([first(hashed, 'a.jpg', 'c.jpg'), 'b.jpg', 'd.jpg'])
+
+
+def test_no_hashing(hashed, monkeypatch):
+    set_hashes(hashed, 'hash', {'a.jpg': 'h1', 'b.jpg': 'h1'})
+    monkeypatch.setattr(PFSettings, 'hash_images', False)
+    PFCatalog.update_count(PFCatalog.get_conn())
+    assert PFCatalog.get_count() == 4
+
+
+def test_placeholder_not_cached_or_hashed(hashed, monkeypatch):
+    if sys.platform in ("linux", "linux2"):
+        pytest.importorskip('pyheif')
+    pytest.importorskip('pydrive2')
+    from picframe_image import PFImage
+    from picframe_image_cache import PFImageCache
+
+    monkeypatch.setattr(PFSettings, 'perceptual_hash', True)
+    monkeypatch.setattr(PFHasher, 'initialized', True)
+    monkeypatch.setattr(PFImageCache, 'cache', type(PFImageCache.cache)())
+    monkeypatch.setattr(PFImageCache, 'cache_bytes', 0)
+
+    # Not an image PIL can read, so the black image is shown instead.
+    bad = os.path.join(hashed, 'bad.bmp')
+    write(bad, b'not an image')
+    pil_img = PFImage.load_image(bad, 200, 100)
+    assert pil_img.info.get(PFEnv.PLACEHOLDER)
+    PFImage.load_image(PFEnv.get_black_image(), 200, 100)
+    assert len(PFImageCache.cache) == 0
+
+    good = os.path.join(hashed, 'good.png')
+    Image.linear_gradient('L').save(good)
+    PFCatalog.sync_dir(hashed)
+    PFImage.load_image(good, 200, 100)
+    assert len(PFImageCache.cache) == 1
+    assert PFCatalog.get_conn().execute("SELECT path FROM files WHERE phash IS NOT NULL"
+            ).fetchall() == [(good,)]
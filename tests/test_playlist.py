@@ -0,0 +1,129 @@
+"""
+Playlist queries over the catalog: the SQL each key compiles to, and
+the on_this_day window across the new year and Feb 29.
+"""
+
+import os
+import time
+import calendar
+from datetime import date
+
+import pytest
+
+import picframe_playlist
+from picframe_catalog import PFCatalog
+from picframe_playlist import PFPlaylist
+
+
+def local_seconds(day, hour=12):
+    """
+    A date as seconds since 1970 of local time, as in the taken column.
+    """
+    return calendar.timegm(day.timetuple()) + hour * 3600
+
+
+@pytest.fixture
+def photos(catalog):
+    """
+    Photos with known taken dates and sizes; None for taken leaves the
+    file's mtime to go by.
+    """
+    taken = {
+        os.path.join('2019', 'jan2.jpg'): (date(2019, 1, 2), 4000, 3000),
+        os.path.join('2020', 'dec30.jpg'): (date(2020, 12, 30), 3000, 4000),
+        os.path.join('2020', 'jun1.jpg'): (date(2020, 6, 1), 4000, 3000),
+        os.path.join('2020', 'feb29.jpg'): (date(2020, 2, 29), 4000, 3000),
+        os.path.join('2021', 'mar1.jpg'): (date(2021, 3, 1), 4000, 3000),
+        os.path.join('2025', 'jan1.jpg'): (date(2025, 1, 1), 4000, 3000),
+    }
+    for name in taken:
+        path = os.path.join(catalog, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as image_file:
+            image_file.write(b'x')
+    PFCatalog.scan()
+    conn = PFCatalog.get_conn()
+    with conn:
+        for name, (day, width, height) in taken.items():
+            conn.execute("UPDATE files SET taken = ?, width = ?, height = ?, meta = 1 "
+                    "WHERE path = ?", (local_seconds(day), width, height,
+                    os.path.join(catalog, name)))
+    return catalog
+
+
+def run(root, query):
+    conn = PFCatalog.get_conn()
+    condition, params = PFPlaylist.compile(query)
+    PFPlaylist.build(conn, condition, params)
+    rows = conn.execute("SELECT path FROM playlist JOIN files ON files.id = file_id")
+    return sorted(os.path.relpath(row[0], root) for row in rows)
+
+
+def set_today(monkeypatch, today):
+    class FixedDate(date):
+        @classmethod
+        def today(cls):
+            return today
+
+    monkeypatch.setattr(picframe_playlist, 'date', FixedDate)
+
+
+def test_nearby_days():
+    assert PFPlaylist.get_nearby_days(date(2025, 12, 30), 2) == \
+            ['01-01', '12-28', '12-29', '12-30', '12-31']
+    assert PFPlaylist.get_nearby_days(date(2024, 3, 1), 1) == ['02-29', '03-01', '03-02']
+    # Photos from a Feb 29 go with Feb 28 in other years.
+    assert PFPlaylist.get_nearby_days(date(2025, 3, 1), 1) == \
+            ['02-28', '02-29', '03-01', '03-02']
+    assert PFPlaylist.get_nearby_days(date(2025, 3, 1), 0) == ['03-01']
+    assert len(PFPlaylist.get_nearby_days(date(2025, 3, 1), 1000)) == 366
+
+
+def test_on_this_day_wraps_the_new_year(photos, monkeypatch):
+    set_today(monkeypatch, date(2025, 1, 1))
+    # Taken this year doesn't count.
+    assert run(photos, {'on_this_day': 2}) == [os.path.join('2019', 'jan2.jpg'),
+            os.path.join('2020', 'dec30.jpg')]
+    assert run(photos, {'on_this_day': 1}) == [os.path.join('2019', 'jan2.jpg')]
+
+
+def test_on_this_day_leap_years(photos, monkeypatch):
+    # In a leap year, Mar 1 is a day later in the year than in 2021.
+    set_today(monkeypatch, date(2024, 3, 1))
+    assert run(photos, {'on_this_day': 0}) == [os.path.join('2021', 'mar1.jpg')]
+    set_today(monkeypatch, date(2025, 2, 28))
+    assert run(photos, {'on_this_day': 0}) == [os.path.join('2020', 'feb29.jpg')]
+
+
+def test_taken_range(photos):
+    assert run(photos, {'taken_after': '2020-06-01', 'taken_before': '2020-12-30'}) == \
+            [os.path.join('2020', 'dec30.jpg'), os.path.join('2020', 'jun1.jpg')]
+
+
+def test_folders_and_orientation(photos):
+    assert run(photos, {'include_folders': [os.path.join(photos, '2020')],
+            'exclude_folders': [os.path.join(photos, '2020', 'x')],
+            'orientation': 'portrait'}) == [os.path.join('2020', 'dec30.jpg')]
+    assert run(photos, {'exclude_folders': [os.path.join(photos, '2020'),
+            os.path.join(photos, '2021'), os.path.join(photos, '2025')]}) == \
+            [os.path.join('2019', 'jan2.jpg')]
+
+
+@pytest.mark.skipif(not hasattr(time, 'tzset'), reason="needs time.tzset()")
+def test_mtime_in_local_time(photos, monkeypatch):
+    path = os.path.join(photos, '2019', 'jan2.jpg')
+    # 02:00 UTC on Jan 1 2020 is still Dec 31 2019 five hours west.
+    mtime = calendar.timegm(date(2020, 1, 1).timetuple()) + 2 * 3600
+    conn = PFCatalog.get_conn()
+    with conn:
+        conn.execute("UPDATE files SET taken = NULL, mtime = ? WHERE path = ?",
+                (mtime * 1000000000, path))
+
+    monkeypatch.setenv('TZ', 'EST+05')
+    time.tzset()
+    try:
+        assert run(photos, {'taken_after': '2019-12-31', 'taken_before': '2019-12-31'}) == \
+                [os.path.join('2019', 'jan2.jpg')]
+    finally:
+        monkeypatch.delenv('TZ')
+        time.tzset()
@@ -0,0 +1,75 @@
+"""
+The constant memory shuffle, and the catalog's shuffled order built on
+it.
+"""
+
+import os
+import itertools
+
+import pytest
+
+from picframe_settings import PFSettings
+from picframe_catalog import PFCatalog
+from picframe_shuffle import PFShuffle
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 4, 5, 15, 16, 17, 64, 65, 1000])
+def test_permute_is_a_bijection(size):
+    for seed in (0, 1, 2 ** 62):
+        order = [PFShuffle.permute(position, size, seed) for position in range(size)]
+        assert sorted(order) == list(range(size))
+
+
+def test_permute_depends_on_seed():
+    orders = set(tuple(PFShuffle.permute(position, 50, seed) for position in range(50))
+            for seed in range(5))
+    assert len(orders) == 5
+
+
+@pytest.fixture
+def shuffled(catalog, monkeypatch):
+    monkeypatch.setattr(PFSettings, 'shuffle', True)
+    monkeypatch.setattr(PFSettings, 'shuffle_no_repeat', 3)
+    for number in range(20):
+        with open(os.path.join(catalog, '%02d.jpg' % (number,)), 'wb') as image_file:
+            image_file.write(b'x')
+    PFCatalog.scan()
+    return catalog
+
+
+def test_each_file_once_per_cycle(shuffled):
+    files = PFCatalog.get_next_file()
+    first = list(itertools.islice(files, 20))
+    second = list(itertools.islice(files, 20))
+    assert len(set(first)) == 20
+    assert sorted(first) == sorted(second)
+    assert first != second
+    # The end of one cycle isn't repeated at the start of the next.
+    assert not set(first[-3:]) & set(second[:3])
+
+
+def test_resume(shuffled):
+    first = list(itertools.islice(PFCatalog.get_next_file(), 8))
+    # As after a restart: a new reader carries on from the saved position.
+    rest = list(itertools.islice(PFCatalog.get_next_file(), 12))
+    assert len(set(first + rest)) == 20
+
+
+def test_position_saved_when_shown(shuffled, monkeypatch):
+    for number in range(0, 20, 2):
+        os.remove(os.path.join(shuffled, '%02d.jpg' % (number,)))
+    PFCatalog.scan()
+
+    saved = []
+    set_state = PFCatalog.set_state
+
+    def counting(key, value, conn=None):
+        if key == 'shuffle_position':
+            saved.append(value)
+        set_state(key, value, conn)
+
+    monkeypatch.setattr(PFCatalog, 'set_state', staticmethod(counting))
+    files = list(itertools.islice(PFCatalog.get_next_file(), 10))
+    assert len(set(files)) == 10
+    # Once when the cycle starts, then once per file, not once per id.
+    assert len(saved) == 11